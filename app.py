@@ -5,7 +5,7 @@ import os
 import logging
 import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, APIRouter, Request
+from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
@@ -18,8 +18,11 @@ from models import create_tables
 from routes import router, auth_router, users_router, roles_router, login_history_router, chits_router
 from payments.payments_routes import payments_router
 from interest.interest_routes import router as interest_router
-from middleware import audit_middleware
+from dynamic_tables_routes import dynamic_tables_router
+from middleware import AuditMiddleware, ReplicaPinMiddleware
 from migrations import run_migrations
+import schema_capabilities
+from sql_instrumentation import SqlInstrumentationMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -35,6 +38,8 @@ def init_database_with_retry(max_retries=5, retry_delay=5):
             logger.info(f"Database initialization attempt {attempt}/{max_retries}...")
             create_tables(engine)
             run_migrations()
+            # After migrations, so columns they add are seen
+            schema_capabilities.detect(engine)
             logger.info("Database initialization completed successfully")
             return True
         except Exception as e:
@@ -68,22 +73,25 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Security middleware - Add trusted host middleware
+# Middleware, outermost first:
+#   TrustedHost          rejects unknown hosts before any other work
+#   CORS                 answers preflights and adds CORS headers to every response, errors included
+#   SqlInstrumentation   Server-Timing and per-route SQL totals for everything below, audit lookup included
+#   Audit                request.state.current_user_id for the created_by/updated_by columns
+#   ReplicaPin           read-your-writes cookie for clients served by read replicas
+#   GZip                 compresses the response body
+# All of them are pure ASGI; add_middleware puts each new one outside the
+# previous, so they are added innermost first.
 trusted_hosts = os.getenv("TRUSTED_HOSTS", "localhost,127.0.0.1,0.0.0.0,api.smchitfund.local").split(",")
-app.add_middleware(
-    TrustedHostMiddleware, 
-    allowed_hosts=trusted_hosts
-)
-
-# Compression middleware
-app.add_middleware(GZipMiddleware, minimum_size=1000)
-
-# CORS middleware
 allowed_origins = os.getenv(
     "ALLOWED_ORIGINS", 
     "http://localhost:3000,http://localhost:3001,http://localhost:54113,http://smchitfund.local:3001,http://smchitfund.local,http://www.smchitfund.local"
 ).split(",")
 
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.add_middleware(ReplicaPinMiddleware)
+app.add_middleware(AuditMiddleware)
+app.add_middleware(SqlInstrumentationMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -92,11 +100,10 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["Content-Type"]
 )
-
-# Add audit middleware
-@app.middleware("http")
-async def audit_middleware_wrapper(request: Request, call_next):
-    return await audit_middleware(request, call_next)
+app.add_middleware(
+    TrustedHostMiddleware, 
+    allowed_hosts=trusted_hosts
+)
 
 # Health check endpoint
 @app.get("/health")
@@ -153,6 +160,7 @@ api_router.include_router(roles_router)
 api_router.include_router(login_history_router)
 api_router.include_router(payments_router)
 api_router.include_router(interest_router)
+api_router.include_router(dynamic_tables_router)
 
 # Include the API router in the main app
 app.include_router(api_router)
@@ -0,0 +1,52 @@
+"""
+Async versions of the crud functions on the hot request paths (login and
+token checks), for handlers using the AsyncSession from database.get_async_db.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer_group
+
+import models
+import schemas
+
+
+async def get_user_profile(db: AsyncSession, user_id: int):
+    """User with the deferred profile columns loaded; async sessions can't load them on access"""
+    result = await db.execute(
+        select(models.User).options(undefer_group("profile")).where(models.User.user_id == user_id).limit(1)
+    )
+    return result.scalars().first()
+
+async def get_user_identity(db: AsyncSession, column, value):
+    """user_id, email, fullname and role of the user whose `column` equals `value`, as a row"""
+    result = await db.execute(select(*models.USER_IDENTITY_COLUMNS).where(column == value).limit(1))
+    return result.first()
+
+async def get_user_identity_by_email(db: AsyncSession, email: str):
+    return await get_user_identity(db, models.User.email, email)
+
+async def get_user_identity_by_phone(db: AsyncSession, phone: str):
+    return await get_user_identity(db, models.User.phone, phone)
+
+async def get_user_identity_by_aadhar(db: AsyncSession, aadhar: str):
+    return await get_user_identity(db, models.User.aadhar, aadhar)
+
+async def get_user_credentials_by_email(db: AsyncSession, email: str):
+    """The identity columns plus the password hash, as a row"""
+    result = await db.execute(
+        select(*models.USER_IDENTITY_COLUMNS, models.User.password).where(models.User.email == email).limit(1)
+    )
+    return result.first()
+
+async def create_login_history(db: AsyncSession, login_history: schemas.UserLoginHistoryCreate):
+    """Create a new login history entry"""
+    db_login_history = models.UserLoginHistory(
+        user_id=login_history.user_id,
+        device_details=login_history.device_details,
+        ip_address=login_history.ip_address,
+        login_status=login_history.login_status
+    )
+    db.add(db_login_history)
+    await db.commit()
+    await db.refresh(db_login_history)
+    return db_login_history
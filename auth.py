@@ -3,14 +3,17 @@ import random
 import string
 from typing import Optional, Set
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+import async_crud
 import crud
 import schemas
-from database import get_db
+from database import get_async_db
 
 # Simple in-memory token blacklist
 # In a production environment, this should be replaced with a Redis cache or database
@@ -23,6 +26,8 @@ __all__ = [
     'generate_random_password',
     'authenticate_user',
     'authenticate_user_by_identifier',
+    'authenticate_user_async',
+    'authenticate_user_by_identifier_async',
     'create_access_token',
     'get_current_user',
     'blacklist_token',
@@ -77,7 +82,8 @@ def generate_random_password(length=12):
     return ''.join(password)
 
 def authenticate_user(db: Session, email: str, password: str):
-    user = crud.get_user_by_email(db, email)
+    """Returns the user's identity row (see crud.get_user_credentials_by_email)"""
+    user = crud.get_user_credentials_by_email(db, email)
     if not user:
         return False
     if not verify_password(password, user.password):
@@ -89,11 +95,33 @@ def authenticate_user_by_identifier(db: Session, email: Optional[str] = None, ph
     user = None
 
     if email:
-        user = crud.get_user_by_email(db, email)
+        user = crud.get_user_identity_by_email(db, email)
     elif phone:
-        user = crud.get_user_by_phone(db, phone)
+        user = crud.get_user_identity_by_phone(db, phone)
     elif aadhar:
-        user = crud.get_user_by_aadhar(db, aadhar)
+        user = crud.get_user_identity_by_aadhar(db, aadhar)
+
+    return user
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    user = await async_crud.get_user_credentials_by_email(db, email)
+    if not user:
+        return False
+    # bcrypt is deliberately slow; keep it off the event loop
+    if not await run_in_threadpool(verify_password, password, user.password):
+        return False
+    return user
+
+async def authenticate_user_by_identifier_async(db: AsyncSession, email: Optional[str] = None, phone: Optional[str] = None, aadhar: Optional[str] = None):
+    """Authenticate user by email, phone, or aadhar without password"""
+    user = None
+
+    if email:
+        user = await async_crud.get_user_identity_by_email(db, email)
+    elif phone:
+        user = await async_crud.get_user_identity_by_phone(db, phone)
+    elif aadhar:
+        user = await async_crud.get_user_identity_by_aadhar(db, aadhar)
 
     return user
 
@@ -122,7 +150,7 @@ def is_token_blacklisted(token: str) -> bool:
     return token.strip() in TOKEN_BLACKLIST
 
 # Get current user from token
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -145,7 +173,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_email(db, email=token_data.email)
+    # Identity row only (user_id, email, fullname, role); load the full user where it's needed
+    user = await async_crud.get_user_identity_by_email(db, email=token_data.email)
     if user is None:
         raise credentials_exception
     return user
\ No newline at end of file
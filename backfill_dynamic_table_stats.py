@@ -0,0 +1,19 @@
+import sys
+
+from database import SessionLocal, engine
+from models import create_tables
+import dynamic_tables
+
+if __name__ == "__main__":
+    # --stale rebuilds only the tables whose updates and deletes have made the
+    # statistics drift (see dynamic_table_stats); run it from cron, e.g. hourly
+    stale_only = "--stale" in sys.argv[1:]
+    print("Rebuilding stale dynamic table statistics..." if stale_only else "Rebuilding dynamic table statistics...")
+    # Make sure the statistics tables exist before filling them
+    create_tables(engine)
+    db = SessionLocal()
+    try:
+        tables = dynamic_tables.rebuild_all_table_stats(db, stale_only=stale_only)
+    finally:
+        db.close()
+    print(f"Dynamic table statistics rebuilt: {tables} tables.")
@@ -0,0 +1,14 @@
+from database import SessionLocal, engine
+from models import create_tables
+import crud
+
+if __name__ == "__main__":
+    print("Rebuilding pay_monthly_rollup from pay...")
+    # Make sure the rollup table exists before filling it
+    create_tables(engine)
+    db = SessionLocal()
+    try:
+        rows = crud.rebuild_pay_rollup(db)
+    finally:
+        db.close()
+    print(f"Rollup rebuilt: {rows} rows written.")
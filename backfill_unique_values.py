@@ -0,0 +1,14 @@
+from database import SessionLocal, engine
+from models import create_tables
+import dynamic_tables
+
+if __name__ == "__main__":
+    print("Rebuilding dynamic_table_unique_values from dynamic_table_data...")
+    # Make sure the index table exists before filling it
+    create_tables(engine)
+    db = SessionLocal()
+    try:
+        dynamic_tables.rebuild_unique_values(db)
+    finally:
+        db.close()
+    print("Unique value index rebuilt.")
@@ -41,6 +41,10 @@ class ClusterManager:
                 print(f"Invalid worker count: {mode}. Using auto mode.")
                 return (cpu_count * 2) + 1
     
+    def worker_env(self, workers: int) -> dict:
+        """Environment for worker processes; they size their database pools from the worker count"""
+        return {**os.environ, "WEB_CONCURRENCY": str(workers)}
+    
     def start_uvicorn_cluster(self, workers: int, host: str = "0.0.0.0", port: int = 8000):
         """Start multiple Uvicorn workers manually"""
         print(f"Starting {workers} Uvicorn workers on {host}:{port}")
@@ -60,7 +64,7 @@ class ClusterManager:
             ]
             
             print(f"Starting worker {i+1} on port {worker_port}")
-            process = subprocess.Popen(cmd)
+            process = subprocess.Popen(cmd, env=self.worker_env(workers))
             self.workers.append(process)
             time.sleep(1)  # Stagger startup
         
@@ -85,7 +89,7 @@ class ClusterManager:
         ]
         
         try:
-            process = subprocess.Popen(cmd)
+            process = subprocess.Popen(cmd, env=self.worker_env(workers))
             self.workers.append(process)
             print(f"Gunicorn master process started with PID: {process.pid}")
             return process
@@ -1,18 +1,47 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, undefer_group
+from sqlalchemy import case, extract, func, insert, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from fastapi import HTTPException, status
 from typing import List
+from datetime import datetime
 
 import models
 import schemas
 import auth
+import schema_capabilities
+import response_cache
 from payments import payment_schemas
 import random
 import time
 # from audit import add_audit_fields
 
 def get_user(db: Session, user_id: int):
-    """ return db.query(models.User).filter(models.User.user_id == user_id).first() """    
-    return db.query(models.User).filter(models.User.user_id == user_id).first()
+    """Users already loaded in the session are returned without a query; profile columns load on access"""
+    return db.get(models.User, user_id)
+
+def get_user_profile(db: Session, user_id: int):
+    """User with the deferred profile columns (aadhar, dob, pin) loaded up front"""
+    return db.query(models.User).options(undefer_group("profile")).filter(models.User.user_id == user_id).first()
+
+def get_user_identity(db: Session, column, value):
+    """user_id, email, fullname and role of the user whose `column` equals `value`, as a row"""
+    return db.execute(select(*models.USER_IDENTITY_COLUMNS).where(column == value).limit(1)).first()
+
+def get_user_identity_by_email(db: Session, email: str):
+    return get_user_identity(db, models.User.email, email)
+
+def get_user_identity_by_phone(db: Session, phone: str):
+    return get_user_identity(db, models.User.phone, phone)
+
+def get_user_identity_by_aadhar(db: Session, aadhar: str):
+    return get_user_identity(db, models.User.aadhar, aadhar)
+
+def get_user_credentials_by_email(db: Session, email: str):
+    """The identity columns plus the password hash, as a row"""
+    return db.execute(
+        select(*models.USER_IDENTITY_COLUMNS, models.User.password).where(models.User.email == email).limit(1)
+    ).first()
 
 def get_user_by_email(db: Session, email: str):
     """ return db.query(models.User).filter(models.User.email == email).first() """
@@ -25,7 +54,7 @@ def get_user_by_phone(db: Session, phone: str):
     return db.query(models.User).filter(models.User.phone == phone).first()
 
 def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+    return db.query(models.User).options(undefer_group("profile")).offset(skip).limit(limit).all()
 
 def create_user(db: Session, user: schemas.UserCreate, current_user_id: int = None):
     # Check if user with same email exists (only if email is provided)
@@ -43,7 +72,7 @@ def create_user(db: Session, user: schemas.UserCreate, current_user_id: int = No
     #     )
 
     # Check if user with same phone exists (phone is mandatory)
-    if get_user_by_phone(db, phone=user.phone):
+    if get_user_identity_by_phone(db, phone=user.phone):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Phone number already registered"
@@ -62,50 +91,23 @@ def create_user(db: Session, user: schemas.UserCreate, current_user_id: int = No
     if user.role is None:
         user.role = "customer"
     
-    try:
-        # Try to create with all fields including audit fields
-        db_user = models.User(
-            fullname=user.fullname,
-            email=user.email,
-            phone=user.phone,
-            aadhar=user.aadhar,
-            dob=user.dob,
-            password=hashed_password,
-            pin= user.pin,
-            role= user.role
-        )
-        
-        # Add audit fields
-        # add_audit_fields(db_user, current_user_id, is_new=True)
-        
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-    except Exception as e:
-        # If there's an error, try again with just the basic fields
-        db.rollback()
-        
-        if "unknown column" in str(e).lower() or "no such column" in str(e).lower():
-            # Create with just the basic fields
-            db_user = models.User(
-                fullname=user.fullname,
-                email=user.email,
-                phone=user.phone,
-                aadhar=user.aadhar,
-                dob=user.dob,
-                password=hashed_password
-            )
-            
-            db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
-        else:
-            # If it's some other error, re-raise it
-            raise
+    db_user = models.User(
+        fullname=user.fullname,
+        email=user.email,
+        phone=user.phone,
+        aadhar=user.aadhar,
+        dob=user.dob,
+        password=hashed_password,
+        pin= user.pin,
+        role= user.role
+    )
+    schema_capabilities.set_audit_columns(db_user, current_user_id, is_new=True)
+    db.add(db_user)
+    db.commit()
 
     # Return the generated password if one was created
     result = db_user
-    create_chit_user(db, payment_schemas.ChitUserCreate(user_id=db_user.user_id, chit_no=1))
+    create_chit_user(db, payment_schemas.ChitUserCreate(user_id=db_user.user_id, chit_no=1), current_user_id=current_user_id)
     if generated_password:
         # We need to convert the ORM model to a dict and add the password
         # We can't modify the SQLAlchemy model directly
@@ -124,7 +126,7 @@ def create_user(db: Session, user: schemas.UserCreate, current_user_id: int = No
     return result
 
 def update_user(db: Session, user_id: int, user: schemas.UserUpdate, current_user_id: str = None):
-    db_user = get_user(db, user_id)
+    db_user = get_user_profile(db, user_id)
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -141,34 +143,10 @@ def update_user(db: Session, user_id: int, user: schemas.UserUpdate, current_use
 
     for key, value in user_data.items():
         setattr(db_user, key, value)
-    
-    try:
-        # Add audit fields
-        # add_audit_fields(db_user, current_user_id, is_new=False)
-        if current_user_id:
-            db_user["updated_by"] = current_user_id
+    schema_capabilities.set_audit_columns(db_user, current_user_id, is_new=False)
 
-        db.commit()
-        db.refresh(db_user)
-        return db_user
-    except Exception as e:
-        # If there's an error updating with audit fields, try again without them
-        db.rollback()
-        
-        if "unknown column" in str(e).lower() or "no such column" in str(e).lower():
-            # Get a fresh copy of the user
-            db_user = get_user(db, user_id)
-            
-            # Update fields again
-            for key, value in user_data.items():
-                setattr(db_user, key, value)
-            
-            db.commit()
-            db.refresh(db_user)
-            return db_user
-        else:
-            # If it's some other error, re-raise it
-            raise
+    db.commit()
+    return db_user
 
 def delete_user(db: Session, user_id: int):
     db_user = get_user(db, user_id)
@@ -180,6 +158,7 @@ def delete_user(db: Session, user_id: int):
 
     db.delete(db_user)
     db.commit()
+    response_cache.invalidate("chits")
     return {"message": "User deleted successfully"}
 
 #chit_payment
@@ -207,29 +186,10 @@ def update_chit_amount(db: Session, user_id: int, amount: int, base_amount: int,
         )
 
     db_chit.amount = base_amount
-    
-    try:
-        # Add audit fields
-        # add_audit_fields(db_chit, current_user_id, is_new=False)
-        
-        db.commit()
-        db.refresh(db_chit)
-        return db_chit
-    except Exception as e:
-        # If there's an error updating with audit fields, try again without them
-        db.rollback()
-        
-        if "unknown column" in str(e).lower() or "no such column" in str(e).lower():
-            # Just update the amount without audit fields
-            db_chit = get_chit_by_user_id_and_chit_no(db, user_id=user_id, amount=amount)
-            db_chit.amount = base_amount
-            
-            db.commit()
-            db.refresh(db_chit)
-            return db_chit
-        else:
-            # If it's some other error, re-raise it
-            raise
+    schema_capabilities.set_audit_columns(db_chit, current_user_id, is_new=False)
+    db.commit()
+    response_cache.invalidate("chits")
+    return db_chit
 
 def create_chit_user(db: Session, chit_user: "payment_schemas.ChitUserCreate", current_user_id: int = None):
     # Check if user exists
@@ -249,45 +209,19 @@ def create_chit_user(db: Session, chit_user: "payment_schemas.ChitUserCreate", c
         )
 
     # Create new chit_user
-    try:
-        # Try to create with all fields including audit fields
-        db_chit_user = models.Chit_users(
-            user_id=chit_user.user_id,
-            chit_no=chit_user.chit_no,
-            amount=chit_user.amount
-        )
-        
-        # Add audit fields
-        # add_audit_fields(db_chit_user, chit_user.user_id, is_new=True)
-        
-        db.add(db_chit_user)
-        db.commit()
-        db.refresh(db_chit_user)
-        # ... existing fields ...
-        # pay_details = relationship("pay_details", back_populates="chit")
-        create_pay_details(db, db_chit_user.chit_id)
-        return db_chit_user
-    except Exception as e:
-        # If there's an error, try again with just the basic fields
-        # This is a fallback for when the database schema hasn't been updated yet
-        db.rollback()
-        
-        if "unknown column" in str(e).lower() or "no such column" in str(e).lower():
-            # Create with just the basic fields
-            db_chit_user = models.Chit_users(
-                user_id=chit_user.user_id,
-                chit_no=chit_user.chit_no,
-                amount=chit_user.amount
-            )
-            
-            db.add(db_chit_user)
-            db.commit()
-            db.refresh(db_chit_user)
-            
-            return db_chit_user
-        else:
-            # If it's some other error, re-raise it
-            raise
+    db_chit_user = models.Chit_users(
+        user_id=chit_user.user_id,
+        chit_no=chit_user.chit_no,
+        amount=chit_user.amount
+    )
+    schema_capabilities.set_audit_columns(db_chit_user, current_user_id, is_new=True)
+    db.add(db_chit_user)
+    db.commit()
+    response_cache.invalidate("chits")
+    # ... existing fields ...
+    # pay_details = relationship("pay_details", back_populates="chit")
+    create_pay_details(db, db_chit_user.chit_id)
+    return db_chit_user
 
 def create_pay_details(db: Session, chit_id: int = None):
     # Check if pay_details already exist for this chit_id
@@ -302,27 +236,23 @@ def create_pay_details(db: Session, chit_id: int = None):
             detail=f"Pay details already exist for chit_id {chit_id}"
         )
     
-    # Create new pay_details
+    # Create new pay_details: one batched INSERT for all weeks
     try:
-        # Try to create with all fields including audit fields
-        pay_details = []
-        for week in range(1, 55):
-            db_pay_details = models.Pay_details(
-                chit_id=chit_id,
-                week=week,
-                is_paid='N'
+        rows = [{"chit_id": chit_id, "week": week, "is_paid": 'N'} for week in range(1, 55)]
+        if db.get_bind().dialect.insert_executemany_returning:
+            # The rows come back from the INSERT itself
+            pay_details = sorted(
+                db.scalars(insert(models.Pay_details).returning(models.Pay_details), rows),
+                key=lambda pay_detail: pay_detail.week
             )
-            db.add(db_pay_details)  # Add each instance individually
-            pay_details.append(db_pay_details)
-        
-        # Add audit fields
-        # add_audit_fields(db_pay_details, current_user_id, is_new=True)
-        
+        else:
+            # No RETURNING (MySQL): read the new rows back with one SELECT
+            db.execute(insert(models.Pay_details), rows)
+            pay_details = db.query(models.Pay_details).filter(
+                models.Pay_details.chit_id == chit_id
+            ).order_by(models.Pay_details.week).all()
         db.commit()
-        # Refresh each instance individually
-        for db_pay_details in pay_details:
-            db.refresh(db_pay_details)
-    
+        response_cache.invalidate(f"pay_details:{chit_id}")
         return pay_details
     except Exception as e:
         db.rollback()
@@ -353,7 +283,7 @@ def update_pay_detail(db: Session, chit_id: int, week: int, is_paid: str) -> mod
     # Or if we're changing from unpaid (N) to paid (Y), we should also allow this
     pay_detail.is_paid = is_paid
     db.commit()
-    db.refresh(pay_detail)
+    response_cache.invalidate(f"pay_details:{chit_id}")
     return pay_detail
 
 def create_payment(db: Session, payment: "payment_schemas.PaymentCreate", current_user_id: int = None):
@@ -389,26 +319,28 @@ def create_payment(db: Session, payment: "payment_schemas.PaymentCreate", curren
             pay_qr=payment.pay_qr,
             transaction_id=transaction_id,
             status="completed",  # Set a default status
+            # Set here rather than by the database so the rollup below buckets
+            # the payment on the same timestamp the rebuilds read
+            created_at=datetime.now(),
             created_by=current_user_id
         )
         
+        # Everything below is flushed and committed once so the payment, the
+        # pay_details week and the monthly rollup never drift apart
         db.add(db_payment)
-        db.commit()
-        db.refresh(db_payment)
+        db.flush()
         
         # Update the pay_details to mark the week as paid
         # Find the chit_id based on user_id and chit_no
         chit_user = db.query(models.Chit_users).filter(
             models.Chit_users.user_id == payment.user_id,
             models.Chit_users.chit_no == payment.chit_no
-        ).first()
+        ).order_by(models.Chit_users.chit_id).first()
         
         if chit_user:
             # Update the chit user's amount if needed
             if payment.amount and (chit_user.amount is None or chit_user.amount != payment.amount):
                 chit_user.amount = payment.amount
-                db.commit()
-                db.refresh(chit_user)
             
             # Update the pay_detail for this week
             pay_detail = db.query(models.Pay_details).filter(
@@ -416,10 +348,8 @@ def create_payment(db: Session, payment: "payment_schemas.PaymentCreate", curren
                 models.Pay_details.week == payment.week_no
             ).first()
             
-            if pay_detail and pay_detail.is_paid == 'N':
+            if pay_detail is not None:
                 pay_detail.is_paid = 'Y'
-                db.commit()
-                db.refresh(pay_detail)
             else:
                 # If pay_detail doesn't exist for some reason, create it
                 new_pay_detail = models.Pay_details(
@@ -428,28 +358,28 @@ def create_payment(db: Session, payment: "payment_schemas.PaymentCreate", curren
                     is_paid='Y'
                 )
                 db.add(new_pay_detail)
-                db.commit()
-                db.refresh(new_pay_detail)
         else:
             # If chit_user doesn't exist, create it
-            new_chit_user = models.Chit_users(
+            chit_user = models.Chit_users(
                 user_id=payment.user_id,
                 chit_no=payment.chit_no,
                 amount=payment.amount
             )
-            db.add(new_chit_user)
-            db.commit()
-            db.refresh(new_chit_user)
+            db.add(chit_user)
+            db.flush()
             
             # Create pay_detail for this week
             new_pay_detail = models.Pay_details(
-                chit_id=new_chit_user.chit_id,
+                chit_id=chit_user.chit_id,
                 week=payment.week_no,
                 is_paid='Y'
             )
             db.add(new_pay_detail)
-            db.commit()
-            db.refresh(new_pay_detail)
+        
+        add_payment_to_rollup(db, chit_user.chit_id, db_payment, paid_at=db_payment.created_at)
+        
+        db.commit()
+        response_cache.invalidate("chits", f"pay_details:{chit_user.chit_id}")
         
         # Add transaction_id to the payment response
         db_payment.transaction_id = transaction_id
@@ -461,6 +391,191 @@ def create_payment(db: Session, payment: "payment_schemas.PaymentCreate", curren
             detail=f"Error creating payment: {str(e)}"
         ) from e
 
+def update_payment_status(db: Session, pay_id: int, payment_status: str, current_user_id: int = None):
+    """Change a payment's status and re-derive the rollup bucket it belongs to"""
+    db_payment = get_payment(db, pay_id=pay_id)
+    if not db_payment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment not found"
+        )
+    
+    if db_payment.status == payment_status:
+        return db_payment
+    
+    db_payment.status = payment_status
+    db_payment.updated_by = current_user_id
+    db.flush()
+    
+    # Lowest chit_id, the same chit rebuild_pay_rollup attaches the payment to
+    chit_user = db.query(models.Chit_users).filter(
+        models.Chit_users.user_id == db_payment.user_id,
+        models.Chit_users.chit_no == db_payment.chit_no
+    ).order_by(models.Chit_users.chit_id).first()
+    if chit_user and db_payment.created_at:
+        rebuild_rollup_bucket(db, chit_user, db_payment.created_at.year, db_payment.created_at.month)
+    
+    db.commit()
+    return db_payment
+
+# Monthly payment rollup
+def add_payment_to_rollup(db: Session, chit_id: int, payment: models.Payment, paid_at: datetime):
+    """
+    Fold one completed payment into its (chit_id, year, month) rollup row.
+
+    weeks_paid counts completed payments (a second payment for the same week
+    counts again), the same as the rebuilds' _rollup_aggregates.
+    Runs as a single upsert inside the caller's transaction; the caller commits.
+    """
+    rollup = models.PayMonthlyRollup.__table__
+    values = {
+        "chit_id": chit_id,
+        "year": paid_at.year,
+        "month": paid_at.month,
+        "user_id": payment.user_id,
+        "chit_no": payment.chit_no,
+        "total_amount": payment.amount,
+        "weeks_paid": 1,
+        "last_week_no": payment.week_no,
+        "last_paid_at": paid_at,
+    }
+    
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(rollup).values(**values)
+        incoming = stmt.inserted
+    else:
+        stmt = sqlite_insert(rollup).values(**values)
+        incoming = stmt.excluded
+    
+    updates = {
+        "total_amount": rollup.c.total_amount + incoming.total_amount,
+        "weeks_paid": rollup.c.weeks_paid + incoming.weeks_paid,
+        "last_week_no": case(
+            (rollup.c.last_week_no > incoming.last_week_no, rollup.c.last_week_no),
+            else_=incoming.last_week_no
+        ),
+        "last_paid_at": case(
+            (rollup.c.last_paid_at > incoming.last_paid_at, rollup.c.last_paid_at),
+            else_=incoming.last_paid_at
+        ),
+    }
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(**updates)
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[rollup.c.chit_id, rollup.c.year, rollup.c.month],
+            set_=updates
+        )
+    db.execute(stmt)
+
+def _rollup_aggregates():
+    """total_amount, weeks_paid, last_week_no and last_paid_at over completed `pay` rows"""
+    return (
+        func.coalesce(func.sum(models.Payment.amount), 0),
+        func.count(models.Payment.pay_id),
+        func.max(models.Payment.week_no),
+        func.max(models.Payment.created_at)
+    )
+
+def rebuild_rollup_bucket(db: Session, chit_user: models.Chit_users, year: int, month: int):
+    """Recompute a single rollup row from `pay`; used when a payment changes status"""
+    totals = db.query(*_rollup_aggregates()).filter(
+        models.Payment.user_id == chit_user.user_id,
+        models.Payment.chit_no == chit_user.chit_no,
+        models.Payment.status == "completed",
+        extract("year", models.Payment.created_at) == year,
+        extract("month", models.Payment.created_at) == month
+    ).one()
+    total_amount, weeks_paid, last_week_no, last_paid_at = totals
+    
+    db_rollup = db.query(models.PayMonthlyRollup).filter(
+        models.PayMonthlyRollup.chit_id == chit_user.chit_id,
+        models.PayMonthlyRollup.year == year,
+        models.PayMonthlyRollup.month == month
+    ).with_for_update().first()
+    
+    if not weeks_paid:
+        if db_rollup:
+            db.delete(db_rollup)
+        return None
+    
+    if not db_rollup:
+        db_rollup = models.PayMonthlyRollup(chit_id=chit_user.chit_id, year=year, month=month)
+        db.add(db_rollup)
+    db_rollup.user_id = chit_user.user_id
+    db_rollup.chit_no = chit_user.chit_no
+    db_rollup.total_amount = int(total_amount)
+    db_rollup.weeks_paid = weeks_paid
+    db_rollup.last_week_no = last_week_no
+    db_rollup.last_paid_at = last_paid_at
+    return db_rollup
+
+def rebuild_pay_rollup(db: Session) -> int:
+    """
+    Rebuild pay_monthly_rollup from scratch out of the completed rows in `pay`.
+
+    Payments are attached to the lowest chit_id for their (user_id, chit_no),
+    matching the lookups in create_payment and update_payment_status. Returns the number of rollup rows written.
+    """
+    chit_ids = db.query(
+        models.Chit_users.user_id,
+        models.Chit_users.chit_no,
+        func.min(models.Chit_users.chit_id).label("chit_id")
+    ).group_by(models.Chit_users.user_id, models.Chit_users.chit_no).subquery()
+    
+    year = extract("year", models.Payment.created_at)
+    month = extract("month", models.Payment.created_at)
+    source = select(
+        chit_ids.c.chit_id,
+        year,
+        month,
+        models.Payment.user_id,
+        models.Payment.chit_no,
+        *_rollup_aggregates()
+    ).join(
+        chit_ids,
+        (chit_ids.c.user_id == models.Payment.user_id) &
+        (chit_ids.c.chit_no == models.Payment.chit_no)
+    ).where(
+        models.Payment.status == "completed"
+    ).group_by(
+        chit_ids.c.chit_id, year, month, models.Payment.user_id, models.Payment.chit_no
+    )
+    
+    rollup = models.PayMonthlyRollup.__table__
+    try:
+        db.execute(rollup.delete())
+        result = db.execute(rollup.insert().from_select(
+            ["chit_id", "year", "month", "user_id", "chit_no",
+             "total_amount", "weeks_paid", "last_week_no", "last_paid_at"],
+            source
+        ))
+        db.commit()
+        return result.rowcount
+    except Exception:
+        db.rollback()
+        raise
+
+def get_pay_rollups(db: Session, user_id: int = None, chit_no: int = None, year: int = None, month: int = None, skip: int = 0, limit: int = 100):
+    """Get monthly payment totals from the rollup instead of aggregating `pay`"""
+    query = db.query(models.PayMonthlyRollup)
+    
+    if user_id is not None:
+        query = query.filter(models.PayMonthlyRollup.user_id == user_id)
+    if chit_no is not None:
+        query = query.filter(models.PayMonthlyRollup.chit_no == chit_no)
+    if year is not None:
+        query = query.filter(models.PayMonthlyRollup.year == year)
+    if month is not None:
+        query = query.filter(models.PayMonthlyRollup.month == month)
+    
+    return query.order_by(
+        models.PayMonthlyRollup.year.desc(),
+        models.PayMonthlyRollup.month.desc(),
+        models.PayMonthlyRollup.chit_id
+    ).offset(skip).limit(limit).all()
+
 def get_payments(db: Session, skip: int = 0, limit: int = 100):
     """Get all payments"""
     return db.query(models.Payment).offset(skip).limit(limit).all()
@@ -512,7 +627,7 @@ def create_role(db: Session, role: schemas.RoleCreate):
     
     db.add(db_role)
     db.commit()
-    db.refresh(db_role)
+    response_cache.invalidate("roles")
     return db_role
 
 def update_role(db: Session, role_id: int, role: schemas.RoleUpdate):
@@ -539,7 +654,7 @@ def update_role(db: Session, role_id: int, role: schemas.RoleUpdate):
         setattr(db_role, key, value)
     
     db.commit()
-    db.refresh(db_role)
+    response_cache.invalidate("roles")
     return db_role
 
 def delete_role(db: Session, role_id: int):
@@ -553,6 +668,7 @@ def delete_role(db: Session, role_id: int):
     
     db.delete(db_role)
     db.commit()
+    response_cache.invalidate("roles")
     return {"message": "Role deleted successfully"}
 
 # Login History CRUD operations
@@ -566,7 +682,6 @@ def create_login_history(db: Session, login_history: schemas.UserLoginHistoryCre
     )
     db.add(db_login_history)
     db.commit()
-    db.refresh(db_login_history)
     return db_login_history
 
 def get_login_history(db: Session, user_login_id: int):
@@ -1,9 +1,21 @@
 # database.py
+import itertools
 import logging
-from sqlalchemy import create_engine
+import os
+import time
+from typing import Dict, Optional
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dbconfig import DATABASE_URL
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from dbconfig import (
+    DATABASE_URL, ASYNC_DATABASE_URL, DATABASE_REPLICA_URLS, REPLICA_PIN_SECONDS,
+    DB_CONNECTION_BUDGET, DB_CLUSTER_NODES, DB_WORKERS, DB_POOL_TIMEOUT
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -12,22 +24,226 @@ logger = logging.getLogger(__name__)
 masked_url = DATABASE_URL.replace(':admin@', ':****@') if ':admin@' in DATABASE_URL else DATABASE_URL
 logger.info(f"Connecting to database: {masked_url}")
 
+class _PoolStats:
+    """Checkout counters of one pool, for /metrics/db-pool"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class _MeteredPool:
+    """Times every checkout; the wait is how long a request queued for a connection"""
+
+    def _do_get(self):
+        stats = self.__dict__.setdefault("stats", _PoolStats())
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            stats.checkouts += 1
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+
+class MeteredQueuePool(_MeteredPool, QueuePool):
+    pass
+
+class MeteredAsyncQueuePool(_MeteredPool, AsyncAdaptedQueuePool):
+    pass
+
+# Connections one worker may hold on a database server
+_worker_share = DB_CONNECTION_BUDGET // max(DB_WORKERS * DB_CLUSTER_NODES, 1)
+if _worker_share < 2:
+    logger.warning(
+        f"DB_CONNECTION_BUDGET={DB_CONNECTION_BUDGET} is too small for {DB_WORKERS} workers "
+        f"on {DB_CLUSTER_NODES} node(s); each worker still opens 2 connections"
+    )
+    _worker_share = 2
+
+def pool_budget(share: int) -> Dict[str, int]:
+    """Pool arguments that keep an engine within `share` connections"""
+    pool_size = max(share // 2, 1)
+    return {
+        "pool_size": pool_size,  # Connections kept open
+        "max_overflow": max(share - pool_size, 0),  # Extra connections opened under load
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+
+# The primary's share is split between the sync engine and the async engine
+_async_share = max(_worker_share // 4, 1)
+_sync_share = _worker_share - _async_share
+
+logger.info(
+    f"Database connection budget: {DB_CONNECTION_BUDGET} over {DB_WORKERS} workers x "
+    f"{DB_CLUSTER_NODES} node(s) = {_worker_share} per worker"
+)
+
 # Create engine with connection pooling and timeout handling
 engine = create_engine(
     DATABASE_URL,
+    poolclass=MeteredQueuePool,
     pool_pre_ping=True,  # Verify connections before using them
     pool_recycle=3600,   # Recycle connections after 1 hour (3600 seconds)
-    pool_size=10,        # Maximum number of connections to keep open
-    max_overflow=20,     # Maximum number of connections that can be created beyond pool_size
+    **pool_budget(_sync_share),
     connect_args={
         "connect_timeout": 60,  # Connection timeout in seconds
         "read_timeout": 60,     # Read timeout in seconds
         "write_timeout": 60     # Write timeout in seconds
     }
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay loaded after commit, so writes don't reload what they just wrote
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Read replicas, used round-robin by read-only endpoints (see get_read_db)
+replica_engines = [
+    create_engine(
+        url,
+        poolclass=MeteredQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        # Each replica is a server of its own with the same budget
+        **pool_budget(_worker_share),
+        connect_args={
+            "connect_timeout": 5,  # Fail over to the next replica quickly
+            "read_timeout": 60,
+            "write_timeout": 60
+        }
+    )
+    for url in DATABASE_REPLICA_URLS
+]
+
+# A replica that failed is skipped for this long, then probed before it is used again
+REPLICA_RETRY_SECONDS = 30
+
+# Cookie holding the time until which the client reads from the primary
+PRIMARY_PIN_COOKIE = "db_primary_until"
+
+_replica_cycle = itertools.count()
+_replica_down_until: Dict[Engine, float] = {}
+
+def _mark_replica_down(replica: Engine):
+    _replica_down_until[replica] = time.monotonic() + REPLICA_RETRY_SECONDS
+    logger.warning(f"Read replica {replica.url.host} is unavailable; skipping it for {REPLICA_RETRY_SECONDS}s")
+
+def _watch_replica(replica: Engine):
+    @event.listens_for(replica, "handle_error")
+    def _on_error(context):
+        # Connection errors and lost connections take the replica out of rotation
+        if context.is_disconnect or context.connection is None:
+            _mark_replica_down(replica)
+
+for _replica in replica_engines:
+    _watch_replica(_replica)
+
+def _replica_is_healthy(replica: Engine) -> bool:
+    down_until = _replica_down_until.get(replica)
+    if down_until is None:
+        return True
+    if down_until > time.monotonic():
+        return False
+    try:
+        with replica.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except Exception:
+        _mark_replica_down(replica)
+        return False
+    _replica_down_until.pop(replica, None)
+    logger.info(f"Read replica {replica.url.host} is back in rotation")
+    return True
+
+def pick_replica() -> Optional[Engine]:
+    """Next healthy replica in round-robin order, or None to use the primary"""
+    for _ in range(len(replica_engines)):
+        replica = replica_engines[next(_replica_cycle) % len(replica_engines)]
+        if _replica_is_healthy(replica):
+            return replica
+    return None
+
+def is_pinned_to_primary(request: Request) -> bool:
+    """Whether the client wrote recently enough that a replica may not have its write yet"""
+    try:
+        return float(request.cookies.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+class RoutingSession(Session):
+    """
+    Session that reads from a replica.
+
+    Flushes, DML and SELECT ... FOR UPDATE go to the primary, and once one
+    has, so does everything after it in the session, so a handler that does
+    write still reads its own changes.
+    """
+
+    def __init__(self, *args, replica: Optional[Engine] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replica is not None and not self.info.get("use_primary"):
+            writes = self._flushing or (clause is not None and (
+                getattr(clause, "is_dml", False) or getattr(clause, "_for_update_arg", None) is not None
+            ))
+            if not writes:
+                return self.replica
+            self.info["use_primary"] = True
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Async engine for handlers that await the database instead of blocking the event loop
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    # Local testing: aiosqlite picks its own pool
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        poolclass=MeteredAsyncQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        **pool_budget(_async_share),
+        connect_args={"connect_timeout": 60}
+    )
+# Loaded objects stay readable after commit, without a lazy load that would need to await
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+def _pool_metrics(name: str, pool) -> Dict[str, object]:
+    stats = pool.__dict__.get("stats") or _PoolStats()
+    size = pool.size()
+    limit = size + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "pool": name,
+        "size": size,
+        "max_overflow": pool._max_overflow,
+        "checked_out": checked_out,
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(checked_out / limit, 3) if limit else 0.0,
+        "checkouts": stats.checkouts,
+        "checkout_timeouts": stats.timeouts,
+        "checkout_wait_avg_ms": round(stats.wait_total * 1000 / stats.checkouts, 3) if stats.checkouts else 0.0,
+        "checkout_wait_max_ms": round(stats.wait_max * 1000, 3),
+    }
+
+def pool_metrics() -> Dict[str, object]:
+    """Connection pool usage of this worker process"""
+    pools = [("primary", engine.pool), ("async", async_engine.sync_engine.pool)]
+    pools.extend((f"replica:{replica.url.host}", replica.pool) for replica in replica_engines)
+    return {
+        "pid": os.getpid(),
+        "workers": DB_WORKERS,
+        "nodes": DB_CLUSTER_NODES,
+        "connection_budget": DB_CONNECTION_BUDGET,
+        "pools": [_pool_metrics(name, pool) for name, pool in pools if isinstance(pool, QueuePool)],
+    }
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -35,3 +251,18 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency to get a DB session for read-only endpoints; reads go to a
+# replica unless the client wrote within the last REPLICA_PIN_SECONDS
+def get_read_db(request: Request):
+    replica = None if not replica_engines or is_pinned_to_primary(request) else pick_replica()
+    db = ReadSessionLocal(replica=replica)
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependency to get an async DB session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
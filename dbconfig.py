@@ -31,9 +31,60 @@ else:
     PORT = int(os.getenv("PORT", "8000"))
     logger.info(f"Using local development configuration (PORT: {PORT})")
 
+# Connection budget: the most connections the app may hold on one database
+# server, across every worker on every node. Each worker's pools are sized
+# from its share, so adding workers or nodes can't exceed max_connections.
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "100"))
+# Nodes running the app against the same database
+DB_CLUSTER_NODES = int(os.getenv("DB_CLUSTER_NODES", "1"))
+# Worker processes on this node; the launch scripts export it (gunicorn reads it too).
+# When it's unset, assume one worker per CPU so the pools stay inside the budget
+# if the server was started with more workers than it told us about.
+if os.getenv("WEB_CONCURRENCY"):
+    DB_WORKERS = int(os.getenv("WEB_CONCURRENCY"))
+else:
+    DB_WORKERS = os.cpu_count() or 1
+    logger.warning(
+        f"WEB_CONCURRENCY is not set; sizing connection pools for {DB_WORKERS} workers (one per CPU). "
+        "Export WEB_CONCURRENCY with the real worker count."
+    )
+# Seconds a request waits for a pooled connection before failing
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Warn when one statement shape runs more than this many times in a request (N+1)
+SQL_REPEAT_WARN_THRESHOLD = int(os.getenv("SQL_REPEAT_WARN_THRESHOLD", "10"))
+
+# Statements slower than this are captured for the slow query report (0 disables)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# Read replicas (comma-separated URLs); read-only endpoints are spread across them
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# After a write, the client reads from the primary for this many seconds
+REPLICA_PIN_SECONDS = int(os.getenv("REPLICA_PIN_SECONDS", "5"))
+
+# Async driver URL for the async engine, derived from DATABASE_URL unless set
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DATABASE_URL
+    .replace("mysql+pymysql://", "mysql+aiomysql://", 1)
+    .replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
 # Redis configuration
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 if ENVIRONMENT == "development":
     REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 
+# Route response cache: "memory" (LRU per worker), "redis" (shared, uses REDIS_URL) or "off"
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "off").lower()
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+# Coalesce identical concurrent reads of the routes marked with @coalesced:
+# "worker" (within each worker), "redis" (also across workers, uses REDIS_URL) or "off"
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "worker").lower()
+# How long a worker waits for another worker's response before computing it itself
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "10"))
+
+# Cache the dynamic table catalogue in each worker (checked against a version on every read)
+DYNAMIC_TABLE_CATALOGUE_CACHE = os.getenv("DYNAMIC_TABLE_CATALOGUE_CACHE", "false").lower() == "true"
+
 logger.info(f"Database URL configured (host extracted): {DATABASE_URL.split('@')[1].split('/')[0] if '@' in DATABASE_URL else 'unknown'}")
@@ -0,0 +1,416 @@
+"""
+Filter and sort compilation for dynamic table rows.
+
+Filters arrive as the `filter` JSON query parameter and are compiled into
+SQLAlchemy expressions with bound parameters. Columns marked `is_index` get a
+virtual generated column plus a secondary index on `dynamic_table_data`
+(MySQL only), and filters/sorts on them are compiled against that column so
+they become index seeks instead of JSON scans. Materialized tables compile
+against their typed physical columns instead (see dynamic_table_storage).
+
+Aggregations (group-by plus count/sum/avg/min/max) are compiled the same
+way, so they reuse the generated columns and run entirely in SQL.
+
+Supported filter forms, per field:
+    {"age": 30}                         equality (shorthand for {"eq": 30})
+    {"age": {"eq": 30}}
+    {"age": {"in": [30, 31]}}
+    {"age": {"gte": 18, "lt": 65}}      any of gt/gte/lt/lte
+    {"age": {"range": [18, 65]}}        inclusive on both ends
+    {"name": {"prefix": "Jo"}}          string/text/date/datetime columns only
+"""
+import json
+from collections import namedtuple
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import HTTPException, status
+from sqlalchemy import JSON, Numeric, String, cast, func, literal, literal_column, text
+from sqlalchemy.orm import Session
+
+import dynamic_table_storage
+import models
+
+# Column metadata the compiler needs, detached from the ORM session.
+# physical_column is the typed column of a materialized table, if any;
+# previous_names are the keys rows may still store the field under while a
+# rename is being rewritten (newest first).
+ColumnSpec = namedtuple(
+    "ColumnSpec",
+    ["id", "name", "column_type", "max_length", "indexed_column", "physical_column", "previous_names"],
+    defaults=[None, ()]
+)
+
+RANGE_OPERATORS = {"gt", "gte", "lt", "lte"}
+FILTER_OPERATORS = {"eq", "in", "range", "prefix"} | RANGE_OPERATORS
+
+_STRING_TYPES = {"string", "text", "date", "datetime"}
+_NUMERIC_TYPES = {"integer", "float"}
+
+# MySQL JSON_VALUE return types used for the generated columns
+_GENERATED_TYPES = {
+    "string": "CHAR({length})",
+    "text": "CHAR(255)",
+    "integer": "SIGNED",
+    "float": "DOUBLE",
+    "boolean": "CHAR(5)",
+    "date": "DATE",
+    "datetime": "DATETIME",
+}
+_COLUMN_TYPES = {
+    "string": "VARCHAR({length})",
+    "text": "VARCHAR(255)",
+    "integer": "BIGINT",
+    "float": "DOUBLE",
+    "boolean": "VARCHAR(5)",
+    "date": "DATE",
+    "datetime": "DATETIME",
+}
+
+
+def column_spec(column: models.ColumnDefinition, physical_column=None, previous_names=()) -> ColumnSpec:
+    # The generated column only reads the current key, so it isn't used until the rename is rewritten
+    indexed_column = column.indexed_column if not previous_names else None
+    return ColumnSpec(column.id, column.name, column.column_type, column.max_length, indexed_column, physical_column,
+                      tuple(previous_names))
+
+
+def json_path(field: str) -> str:
+    return f"$.{json.dumps(field)}"
+
+
+def json_literal(dialect: str, value: Any):
+    """SQL JSON value for a Python value, bound as its JSON text"""
+    encoded = literal(json.dumps(value, default=str), String)
+    if dialect == "mysql":
+        return cast(encoded, JSON)
+    return func.json(encoded)
+
+
+def json_set(dialect: str, document, fields: Dict[str, Any]):
+    """
+    JSON_SET expression writing each field of `fields` into `document`.
+
+    Used as the right-hand side of an UPDATE so fields are changed in place,
+    without reading the document first; fields not mentioned are untouched,
+    so concurrent updates of different fields don't overwrite each other.
+    """
+    arguments = []
+    for field, value in fields.items():
+        arguments.extend([json_path(field), json_literal(dialect, value)])
+    return func.json_set(document, *arguments)
+
+
+def _bad_request(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+def _uses_index(dialect: str, spec: ColumnSpec) -> bool:
+    return dialect == "mysql" and bool(spec.indexed_column)
+
+
+def value_expression(dialect: str, spec: ColumnSpec):
+    """SQL expression reading a field of `dynamic_table_data.data` (or its physical column)"""
+    if spec.physical_column is not None:
+        return spec.physical_column
+    if _uses_index(dialect, spec):
+        return literal_column(spec.indexed_column)
+    extracted = func.json_extract(models.DynamicTableData.data, json_path(spec.name))
+    if spec.previous_names:
+        # Rows not rewritten yet still store the field under an old key
+        extracted = func.coalesce(extracted, *(
+            func.json_extract(models.DynamicTableData.data, json_path(name)) for name in spec.previous_names
+        ))
+    if dialect == "mysql" and spec.column_type in _STRING_TYPES:
+        return func.json_unquote(extracted)
+    return extracted
+
+
+def _coerce(dialect: str, spec: ColumnSpec, value: Any):
+    """Convert a filter value to the parameter type the column expression compares against"""
+    if spec.physical_column is not None and spec.column_type in ("boolean", "date", "datetime"):
+        try:
+            return dynamic_table_storage.to_column_value(spec.column_type, value)
+        except (TypeError, ValueError):
+            raise _bad_request(f"Filter value for field '{spec.name}' is not a valid {spec.column_type}")
+
+    try:
+        if spec.column_type == "integer":
+            return int(value)
+        if spec.column_type == "float":
+            return float(value)
+    except (TypeError, ValueError):
+        raise _bad_request(f"Filter value for field '{spec.name}' must be a number")
+
+    if spec.column_type == "boolean":
+        flag = value in (True, 1, "true", "True")
+        if dialect != "mysql":
+            return int(flag)
+        if _uses_index(dialect, spec):
+            return "true" if flag else "false"
+        return json_literal(dialect, flag)
+
+    if isinstance(value, (dict, list)):
+        raise _bad_request(f"Filter value for field '{spec.name}' must be a scalar")
+    return str(value)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _compile_field(dialect: str, spec: ColumnSpec, condition: Any) -> List:
+    expr = value_expression(dialect, spec)
+
+    if not isinstance(condition, dict):
+        condition = {"eq": condition}
+
+    unknown = set(condition) - FILTER_OPERATORS
+    if unknown:
+        raise _bad_request(
+            f"Unsupported filter operator(s) {sorted(unknown)} for field '{spec.name}'. "
+            f"Use one of {sorted(FILTER_OPERATORS)}"
+        )
+
+    clauses = []
+    for operator, operand in condition.items():
+        if operator == "eq":
+            clauses.append(expr == _coerce(dialect, spec, operand))
+        elif operator == "in":
+            if not isinstance(operand, list) or not operand:
+                raise _bad_request(f"'in' filter for field '{spec.name}' needs a non-empty list")
+            clauses.append(expr.in_([_coerce(dialect, spec, item) for item in operand]))
+        elif operator == "range":
+            if not isinstance(operand, list) or len(operand) != 2:
+                raise _bad_request(f"'range' filter for field '{spec.name}' needs [low, high]")
+            low, high = operand
+            if low is not None:
+                clauses.append(expr >= _coerce(dialect, spec, low))
+            if high is not None:
+                clauses.append(expr <= _coerce(dialect, spec, high))
+        elif operator == "prefix":
+            if spec.column_type not in _STRING_TYPES:
+                raise _bad_request(f"'prefix' filter is only supported on string columns, not '{spec.name}'")
+            clauses.append(expr.like(_escape_like(str(operand)) + "%", escape="\\"))
+        else:
+            value = _coerce(dialect, spec, operand)
+            if operator == "gt":
+                clauses.append(expr > value)
+            elif operator == "gte":
+                clauses.append(expr >= value)
+            elif operator == "lt":
+                clauses.append(expr < value)
+            else:
+                clauses.append(expr <= value)
+    return clauses
+
+
+def _lookup(columns: Dict[str, ColumnSpec], field: str) -> ColumnSpec:
+    spec = columns.get(field)
+    if spec is None:
+        raise _bad_request(f"Unknown field '{field}'")
+    if spec.column_type == "json":
+        raise _bad_request(f"Field '{field}' is a JSON column and cannot be filtered or sorted on")
+    return spec
+
+
+def compile_filters(dialect: str, columns: Dict[str, ColumnSpec], filter_params: Optional[Dict[str, Any]],
+                    index_fields: Optional[Set[str]] = None) -> List:
+    """
+    Compile the `filter` query parameter into WHERE clauses with bound parameters.
+
+    `index_fields`, when given, limits which indexed fields are compiled
+    against their generated column; the rest read the JSON value.
+    """
+    if not filter_params:
+        return []
+    if not isinstance(filter_params, dict):
+        raise _bad_request("filter must be a JSON object")
+
+    clauses = []
+    for field, condition in filter_params.items():
+        spec = _lookup(columns, field)
+        if index_fields is not None and field not in index_fields:
+            spec = spec._replace(indexed_column=None)
+        clauses.extend(_compile_field(dialect, spec, condition))
+    return clauses
+
+
+def compile_sort(dialect: str, columns: Dict[str, ColumnSpec], sort_field: str, sort_direction: str = "asc"):
+    """Compile the `sort` query parameter into an ORDER BY expression"""
+    expr = value_expression(dialect, _lookup(columns, sort_field))
+    if sort_direction.lower() == "desc":
+        return expr.desc()
+    return expr.asc()
+
+
+def json_has_field(dialect: str, document, field: str):
+    """Condition true when `document` has the field (even if it is null)"""
+    if dialect == "mysql":
+        return func.json_contains_path(document, "one", json_path(field))
+    return func.json_type(document, json_path(field)).isnot(None)
+
+
+def json_remove_field(document, field: str):
+    return func.json_remove(document, json_path(field))
+
+
+def json_rename_field(dialect: str, document, field: str, new_field: str):
+    """
+    Move a field's value to `new_field` and remove the old key.
+
+    JSON_INSERT leaves an existing `new_field` alone, so a value written under
+    the new name since the rename is not overwritten by the old one.
+    """
+    if dialect == "mysql":
+        value = func.json_extract(document, json_path(field))
+    else:
+        value = document.op("->")(json_path(field))
+    return func.json_remove(func.json_insert(document, json_path(new_field), value), json_path(field))
+
+
+# Aggregations
+
+AGGREGATE_OPERATIONS = {"count", "sum", "avg", "min", "max"}
+
+
+def numeric_expression(dialect: str, spec: ColumnSpec):
+    """Value of a numeric field as a SQL number, for sum/avg"""
+    expr = value_expression(dialect, spec)
+    if spec.physical_column is not None or _uses_index(dialect, spec):
+        return expr
+    if dialect == "mysql":
+        expr = func.json_unquote(expr)
+    return cast(expr, Numeric(65, 10))
+
+
+def compile_aggregate(dialect: str, columns: Dict[str, ColumnSpec], group_by: List[str], metrics: List[Dict[str, Any]]):
+    """
+    Compile group-by fields and metrics into labelled SELECT expressions.
+
+    Each metric is {"op": ..., "field": ..., "alias": ...}; `field` is optional
+    for count and `alias` defaults to "<op>_<field>" (or "count"). Returns
+    (group expressions, metric expressions, metric column types by alias).
+    """
+    if not metrics:
+        raise _bad_request("At least one metric is required")
+
+    group_exprs = []
+    for field in group_by:
+        group_exprs.append(value_expression(dialect, _lookup(columns, field)).label(field))
+
+    metric_exprs = []
+    metric_types = {}
+    aliases = set(group_by)
+    for metric in metrics:
+        operation = metric.get("op")
+        field = metric.get("field")
+        if operation not in AGGREGATE_OPERATIONS:
+            raise _bad_request(f"Unsupported metric '{operation}'. Use one of {sorted(AGGREGATE_OPERATIONS)}")
+
+        alias = metric.get("alias") or (f"{operation}_{field}" if field else operation)
+        if not alias.isidentifier():
+            raise _bad_request(f"Metric alias '{alias}' must be a valid identifier")
+        if alias in aliases:
+            raise _bad_request(f"Duplicate output name '{alias}'")
+        aliases.add(alias)
+
+        if field is None:
+            if operation != "count":
+                raise _bad_request(f"Metric '{operation}' needs a field")
+            metric_exprs.append(func.count().label(alias))
+            metric_types[alias] = "integer"
+            continue
+
+        spec = _lookup(columns, field)
+        if operation in ("sum", "avg"):
+            if spec.column_type not in _NUMERIC_TYPES:
+                raise _bad_request(f"Metric '{operation}' needs a numeric field, '{field}' is {spec.column_type}")
+            aggregate = getattr(func, operation)(numeric_expression(dialect, spec))
+            metric_types[alias] = "float" if operation == "avg" else spec.column_type
+        elif operation == "count":
+            aggregate = func.count(value_expression(dialect, spec))
+            metric_types[alias] = "integer"
+        else:
+            expr = numeric_expression(dialect, spec) if spec.column_type in _NUMERIC_TYPES else value_expression(dialect, spec)
+            aggregate = getattr(func, operation)(expr)
+            metric_types[alias] = spec.column_type
+        metric_exprs.append(aggregate.label(alias))
+
+    return group_exprs, metric_exprs, metric_types
+
+
+# Generated column indexes
+
+# Every generated column index lives on the shared dynamic_table_data table,
+# which MySQL caps at 64 indexes; keep room for its own
+MAX_JSON_INDEXES = 48
+
+
+def generated_column_name(column_id: int) -> str:
+    return f"jx_{column_id}"
+
+
+def needs_json_index(db: Session, column_type: str) -> bool:
+    """Whether an `is_index` column of this type gets a generated column index on this database"""
+    return db.get_bind().dialect.name == "mysql" and column_type in _GENERATED_TYPES
+
+
+def check_json_index_capacity(db: Session, added: int):
+    """Refuse `added` more generated column indexes if the shared table would go past MAX_JSON_INDEXES"""
+    if added <= 0:
+        return
+    in_use = db.query(func.count(models.ColumnDefinition.id)).filter(
+        models.ColumnDefinition.indexed_column.isnot(None)
+    ).scalar()
+    if in_use + added > MAX_JSON_INDEXES:
+        raise _bad_request(
+            f"Only {MAX_JSON_INDEXES} indexed columns are allowed across JSON-stored tables ({in_use} in use); "
+            "materialize the table to index its columns in a table of its own"
+        )
+
+
+def create_json_index(db: Session, column: models.ColumnDefinition) -> Optional[str]:
+    """
+    Add a virtual generated column and secondary index for an `is_index` column.
+
+    Only the owning table's rows get a value; other tables see NULL. The column
+    is virtual, so adding it is an in-place metadata change, and the index is
+    built online. Returns the generated column name, or None on databases
+    without generated column support.
+    """
+    if not needs_json_index(db, column.column_type):
+        return None
+
+    name = generated_column_name(column.id)
+    length = column.max_length or 255
+    returning = _GENERATED_TYPES[column.column_type].format(length=length)
+    column_type = _COLUMN_TYPES[column.column_type].format(length=length)
+    path = json_path(column.name)
+
+    db.execute(text(f"""
+        ALTER TABLE dynamic_table_data
+        ADD COLUMN {name} {column_type} GENERATED ALWAYS AS (
+            CASE WHEN table_id = {int(column.table_id)}
+            THEN JSON_VALUE(data, '{path}' RETURNING {returning} NULL ON EMPTY NULL ON ERROR)
+            END
+        ) VIRTUAL,
+        ALGORITHM=INPLACE, LOCK=NONE
+    """))
+    try:
+        db.execute(text(f"""
+            ALTER TABLE dynamic_table_data
+            ADD INDEX ix_dynamic_{name} (table_id, {name}),
+            ALGORITHM=INPLACE, LOCK=NONE
+        """))
+    except Exception:
+        # Don't leave an unindexed generated column behind
+        db.execute(text(f"ALTER TABLE dynamic_table_data DROP COLUMN {name}"))
+        raise
+    return name
+
+
+def drop_json_index(db: Session, column: models.ColumnDefinition):
+    """Drop the generated column (and with it the index) created for a column"""
+    if not column.indexed_column or db.get_bind().dialect.name != "mysql":
+        return
+    db.execute(text(f"ALTER TABLE dynamic_table_data DROP COLUMN {generated_column_name(column.id)}"))
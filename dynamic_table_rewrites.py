@@ -0,0 +1,180 @@
+"""
+Background rewrite of stored dynamic table rows after column drops and renames.
+
+Dropping or renaming a column queues a `DynamicTableRewriteJob`. The job walks
+the table's rows in id order, a batch at a time, removing the key (JSON_REMOVE)
+or moving it to the new name. Each batch is one short transaction touching a
+bounded id range, followed by a pause, so row locks are held briefly and
+replicas get time to apply each batch before the next one arrives. Progress is
+saved after every batch, so an interrupted job resumes where it stopped.
+
+Until a rename job finishes, reads and filters of the field fall back to the
+old key for rows it hasn't reached yet.
+
+Jobs of one table run in the order they were queued. They are started as a
+FastAPI background task after the column change, and
+`run_dynamic_table_rewrites.py` resumes anything left over.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import or_, and_, select
+from sqlalchemy.orm import Session
+
+import dynamic_table_query
+import dynamic_tables
+import models
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+REWRITE_BATCH_SIZE = 500
+
+# Share of the job's wall time spent writing; the rest is spent pausing
+REWRITE_DUTY_CYCLE = 0.5
+REWRITE_MIN_PAUSE = 0.05  # seconds
+
+# A running job that has made no progress for this long is taken over
+REWRITE_STALE_AFTER = timedelta(minutes=5)
+
+Job = models.DynamicTableRewriteJob
+
+
+def get_rewrite_jobs(db: Session, table_id: int, skip: int = 0, limit: int = 100) -> List[Job]:
+    return db.query(Job).filter(Job.table_id == table_id).order_by(Job.id.desc()).offset(skip).limit(limit).all()
+
+
+def get_rewrite_job(db: Session, job_id: int) -> Optional[Job]:
+    return db.query(Job).filter(Job.id == job_id).first()
+
+
+def _claim_next_job(db: Session, table_id: Optional[int] = None) -> Optional[Job]:
+    """Claim the earliest unfinished job of a table whose earlier jobs are done"""
+    query = db.query(Job).filter(Job.status.in_(("pending", "running")))
+    if table_id is not None:
+        query = query.filter(Job.table_id == table_id)
+
+    seen_tables = set()
+    for job in query.order_by(Job.id).all():
+        if job.table_id in seen_tables:
+            continue
+        seen_tables.add(job.table_id)
+
+        now = datetime.now()
+        claimed = db.query(Job).filter(
+            Job.id == job.id,
+            or_(
+                Job.status == "pending",
+                and_(Job.status == "running", Job.updated_at < now - REWRITE_STALE_AFTER)
+            )
+        ).update({Job.status: "running", Job.updated_at: now})
+        db.commit()
+        if claimed:
+            return get_rewrite_job(db, job.id)
+    return None
+
+
+def _rewrite_batch(db: Session, job: Job, batch_size: int) -> bool:
+    """Rewrite the next id range of the job; returns False once there is nothing left"""
+    table = dynamic_tables.get_table_definition(db, job.table_id)
+    if table is None:
+        return False
+    compiled = dynamic_tables.get_compiled_schema(db, table)
+    dialect = db.get_bind().dialect.name
+
+    # The table may have been materialized since the job was queued; row ids
+    # are preserved, so the same cursor continues over its extra column
+    if compiled.physical is not None:
+        target = compiled.physical
+        document = target.c.extra
+        scope = []
+    else:
+        target = models.DynamicTableData.__table__
+        document = target.c.data
+        scope = [target.c.table_id == job.table_id]
+
+    row_ids = [row_id for (row_id,) in db.execute(
+        select(target.c.id).where(
+            *scope,
+            target.c.id > job.last_row_id,
+            target.c.id <= job.max_row_id
+        ).order_by(target.c.id).limit(batch_size)
+    )]
+    if not row_ids:
+        return False
+
+    if job.operation == "rename":
+        rewritten = dynamic_table_query.json_rename_field(dialect, document, job.field, job.new_field)
+    else:
+        rewritten = dynamic_table_query.json_remove_field(document, job.field)
+    result = db.execute(
+        target.update().where(
+            *scope,
+            target.c.id > job.last_row_id,
+            target.c.id <= row_ids[-1],
+            dynamic_table_query.json_has_field(dialect, document, job.field)
+        ).values({document.name: rewritten})
+    )
+
+    job.rows_scanned += len(row_ids)
+    job.rows_rewritten += result.rowcount
+    job.last_row_id = row_ids[-1]
+    job.updated_at = datetime.now()
+    db.commit()
+    return True
+
+
+def _finish_job(db: Session, job_id: int, status: str, error: Optional[str] = None):
+    job = get_rewrite_job(db, job_id)
+    if job is None:
+        # Its table was deleted
+        return
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.now()
+    if job.operation == "rename":
+        # Reads and filters stop falling back to the old key (see CompiledTableSchema.renamed_from)
+        db.query(models.TableDefinition).filter(models.TableDefinition.id == job.table_id).update(
+            {models.TableDefinition.schema_version: models.TableDefinition.schema_version + 1}
+        )
+        dynamic_tables.invalidate_compiled_schema(job.table_id)
+    db.commit()
+
+
+def run_job(db: Session, job: Job, batch_size: int = REWRITE_BATCH_SIZE):
+    """Run a claimed job to completion, pausing between batches"""
+    job_id = job.id
+    try:
+        while True:
+            started = time.monotonic()
+            if not _rewrite_batch(db, job, batch_size):
+                break
+            elapsed = time.monotonic() - started
+            time.sleep(max(REWRITE_MIN_PAUSE, elapsed * (1 - REWRITE_DUTY_CYCLE) / REWRITE_DUTY_CYCLE))
+        _finish_job(db, job_id, "completed")
+    except Exception as e:
+        db.rollback()
+        logger.exception("Dynamic table rewrite job %s failed", job_id)
+        _finish_job(db, job_id, "failed", str(e)[:255])
+
+
+def run_pending_rewrites(table_id: Optional[int] = None, batch_size: int = REWRITE_BATCH_SIZE) -> int:
+    """
+    Run queued rewrite jobs until none is left, optionally for one table only.
+
+    Uses its own session, so it can run as a background task after the
+    request's session is closed. Returns the number of jobs run.
+    """
+    db = SessionLocal()
+    count = 0
+    try:
+        while True:
+            job = _claim_next_job(db, table_id)
+            if job is None:
+                return count
+            run_job(db, job, batch_size)
+            count += 1
+    finally:
+        db.close()
@@ -0,0 +1,381 @@
+"""
+Row counts and column statistics for dynamic tables.
+
+Row writes keep the statistics current without locking them: inserts and
+deletes adjust the row and non-null counts with atomic `count = count + n`
+updates in the writer's transaction. Written values widen min/max and are
+added to a HyperLogLog sketch for the distinct estimate, but those are
+collected in each worker and folded into the stored statistics at most every
+FOLD_SECONDS per table (or once FOLD_MAX_ROWS values are waiting), so only the
+fold locks the column stats rows. Until then the stored min/max and distinct
+estimate lag a few seconds behind the writes. Values of a write that is
+rolled back may still be folded in, and values folded by a write that is
+rolled back are lost; both only until the next rebuild.
+
+Updates are not tracked beyond counting them in `modifications`: the update
+path doesn't load the old row, so a field set to or from null doesn't change
+the non-null count, and overwritten or deleted values can't be taken back out
+of min/max or the sketch. Those drift until the next rebuild, which rescans
+the rows; backfill_dynamic_table_stats.py --stale rebuilds the tables whose
+modifications since the last rebuild exceed a share of their rows, and is
+meant to run on a schedule.
+
+The filter path uses the statistics to decide whether a generated column
+index is selective enough to be worth using for a filter.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+
+import dynamic_table_storage
+import models
+
+# HyperLogLog precision: 2**10 one-byte registers, about 3% standard error
+_SKETCH_BITS = 10
+_SKETCH_SIZE = 1 << _SKETCH_BITS
+
+# Filters expected to match more than this share of a table skip the index
+INDEX_SELECTIVITY_THRESHOLD = 0.2
+
+# Below this many rows the index choice makes no measurable difference
+INDEX_MIN_ROWS = 1000
+
+# How long written values wait in a worker before they are folded into min/max and the sketch
+FOLD_SECONDS = 5
+FOLD_MAX_ROWS = 1000
+
+# Tables whose modifications since the last rebuild exceed this share of their rows are stale
+STALE_FRACTION = 0.2
+
+_NUMERIC_TYPES = {"integer", "float"}
+
+
+def _sketch_add(registers: bytearray, value: Any):
+    digest = hashlib.sha1(repr(value).encode("utf-8")).digest()
+    hashed = int.from_bytes(digest[:8], "big")
+    index = hashed >> (64 - _SKETCH_BITS)
+    remaining = hashed & ((1 << (64 - _SKETCH_BITS)) - 1)
+    rank = (64 - _SKETCH_BITS) - remaining.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def distinct_estimate(sketch: Optional[bytes]) -> int:
+    """HyperLogLog estimate of the number of distinct values added to a sketch"""
+    if not sketch:
+        return 0
+    alpha = 0.7213 / (1 + 1.079 / _SKETCH_SIZE)
+    estimate = alpha * _SKETCH_SIZE * _SKETCH_SIZE / sum(2.0 ** -register for register in sketch)
+    empty = sketch.count(0)
+    if estimate <= 2.5 * _SKETCH_SIZE and empty:
+        # Linear counting is more accurate for small cardinalities
+        estimate = _SKETCH_SIZE * math.log(_SKETCH_SIZE / empty)
+    return int(round(estimate))
+
+
+def _typed(spec, value: Any):
+    """Value in a form that compares correctly for its column type, or None if it doesn't convert"""
+    try:
+        return dynamic_table_storage.to_column_value(spec.column_type, value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _ColumnAccumulator:
+    """Folds column values into an existing column stats row"""
+
+    def __init__(self, spec, column_stats: models.DynamicTableColumnStats):
+        self.spec = spec
+        self.stats = column_stats
+        self.registers = bytearray(column_stats.sketch or bytes(_SKETCH_SIZE))
+        self.low = _typed(spec, column_stats.min_value) if column_stats.min_value is not None else None
+        self.high = _typed(spec, column_stats.max_value) if column_stats.max_value is not None else None
+
+    def add(self, value: Any):
+        typed = _typed(self.spec, value)
+        if typed is None:
+            return
+        _sketch_add(self.registers, typed)
+        if self.spec.column_type in ("json", "boolean"):
+            return
+        if self.low is None or typed < self.low:
+            self.low = typed
+        if self.high is None or typed > self.high:
+            self.high = typed
+
+    def save(self):
+        self.stats.sketch = bytes(self.registers)
+        column_type = self.spec.column_type
+        self.stats.min_value = dynamic_table_storage.from_column_value(column_type, self.low) if self.low is not None else None
+        self.stats.max_value = dynamic_table_storage.from_column_value(column_type, self.high) if self.high is not None else None
+
+
+def create_stats(db: Session, table_id: int, column_ids: Iterable[int] = (), table: bool = False):
+    """Add empty statistics for a new table and/or new columns (which hold no values yet)"""
+    if table:
+        db.add(models.DynamicTableStats(table_id=table_id, row_count=0, modifications=0))
+    for column_id in column_ids:
+        db.add(models.DynamicTableColumnStats(column_id=column_id, table_id=table_id, non_null_count=0))
+
+
+class _PendingValues:
+    """Written values of one table waiting in this worker to be folded into its column stats"""
+
+    def __init__(self):
+        self.since = time.monotonic()
+        self.rows = 0
+        self.values: Dict[int, List[Any]] = {}
+
+
+_pending_lock = threading.Lock()
+_pending: Dict[int, _PendingValues] = {}
+
+
+def _fold_pending(db: Session, compiled, pending: _PendingValues):
+    """Widen min/max and the sketches of the table's columns with values written since the last fold"""
+    column_stats = db.query(models.DynamicTableColumnStats).filter(
+        models.DynamicTableColumnStats.column_id.in_(list(pending.values))
+    ).with_for_update().all()
+    specs = {spec.id: spec for spec in compiled.columns.values()}
+    for stats in column_stats:
+        spec = specs.get(stats.column_id)
+        if spec is None:
+            continue
+        accumulator = _ColumnAccumulator(spec, stats)
+        for value in pending.values[stats.column_id]:
+            accumulator.add(value)
+        accumulator.save()
+
+
+def record_changes(db: Session, compiled, inserted: List[Dict[str, Any]] = (), updated: List[Dict[str, Any]] = (),
+                   deleted: List[Dict[str, Any]] = ()):
+    """
+    Fold a write into the statistics, in the writer's transaction.
+
+    `inserted` and `deleted` are whole rows, `updated` holds only the fields
+    that were set. Counts are adjusted with atomic updates, which do nothing
+    for tables without statistics (never rebuilt); written values are folded
+    into min/max and the sketches later (see the module docstring).
+    """
+    db.execute(
+        update(models.DynamicTableStats)
+        .where(models.DynamicTableStats.table_id == compiled.table_id)
+        .values(
+            row_count=models.DynamicTableStats.row_count + (len(inserted) - len(deleted)),
+            modifications=models.DynamicTableStats.modifications + (len(updated) + len(deleted))
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    deltas = {}
+    written: Dict[int, List[Any]] = {}
+    for spec in compiled.columns.values():
+        delta = (
+            sum(1 for data in inserted if data.get(spec.name) is not None)
+            - sum(1 for data in deleted if data.get(spec.name) is not None)
+        )
+        if delta:
+            deltas[spec.id] = delta
+        values = [data[spec.name] for data in list(inserted) + list(updated) if data.get(spec.name) is not None]
+        if values:
+            written[spec.id] = values
+    if deltas:
+        db.execute(
+            update(models.DynamicTableColumnStats)
+            .where(models.DynamicTableColumnStats.column_id.in_(list(deltas)))
+            .values(non_null_count=models.DynamicTableColumnStats.non_null_count + case(
+                deltas, value=models.DynamicTableColumnStats.column_id
+            ))
+            .execution_options(synchronize_session=False)
+        )
+
+    if not written:
+        return
+    with _pending_lock:
+        pending = _pending.setdefault(compiled.table_id, _PendingValues())
+        pending.rows += len(inserted) + len(updated)
+        for column_id, values in written.items():
+            pending.values.setdefault(column_id, []).extend(values)
+        if pending.rows < FOLD_MAX_ROWS and time.monotonic() - pending.since < FOLD_SECONDS:
+            return
+        del _pending[compiled.table_id]
+    _fold_pending(db, compiled, pending)
+
+
+def _iter_row_data(db: Session, compiled, batch_size: int):
+    if compiled.physical is not None:
+        result = db.execute(
+            select(compiled.physical).execution_options(yield_per=batch_size)
+        )
+        for record in result:
+            yield dynamic_table_storage.row_data(compiled.columns, record)
+        return
+    rows = db.query(models.DynamicTableData.data).filter(
+        models.DynamicTableData.table_id == compiled.table_id
+    ).yield_per(batch_size)
+    for (data,) in rows:
+        yield data or {}
+
+
+def rebuild_stats(db: Session, compiled, batch_size: int = 1000):
+    """Recompute a table's statistics from its rows and commit them"""
+    with _pending_lock:
+        # The rescan sees every committed value
+        _pending.pop(compiled.table_id, None)
+    db.query(models.DynamicTableColumnStats).filter(
+        models.DynamicTableColumnStats.table_id == compiled.table_id
+    ).delete(synchronize_session=False)
+    db.query(models.DynamicTableStats).filter(
+        models.DynamicTableStats.table_id == compiled.table_id
+    ).delete(synchronize_session=False)
+
+    accumulators = []
+    for spec in compiled.columns.values():
+        stats = models.DynamicTableColumnStats(column_id=spec.id, table_id=compiled.table_id, non_null_count=0)
+        accumulators.append(_ColumnAccumulator(spec, stats))
+
+    row_count = 0
+    for data in _iter_row_data(db, compiled, batch_size):
+        row_count += 1
+        for accumulator in accumulators:
+            value = data.get(accumulator.spec.name)
+            if value is not None:
+                accumulator.stats.non_null_count += 1
+                accumulator.add(value)
+
+    db.add(models.DynamicTableStats(
+        table_id=compiled.table_id,
+        row_count=row_count,
+        modifications=0,
+        rebuilt_at=datetime.now()
+    ))
+    for accumulator in accumulators:
+        accumulator.save()
+        db.add(accumulator.stats)
+    db.commit()
+
+
+def stale_table_ids(db: Session, fraction: float = STALE_FRACTION) -> List[int]:
+    """Tables whose updates and deletes since the last rebuild exceed `fraction` of their rows, or never rebuilt"""
+    stale = db.query(models.DynamicTableStats.table_id).filter(
+        models.DynamicTableStats.modifications > models.DynamicTableStats.row_count * fraction
+    )
+    missing = db.query(models.TableDefinition.id).filter(
+        ~models.TableDefinition.id.in_(select(models.DynamicTableStats.table_id))
+    )
+    return sorted({table_id for (table_id,) in stale} | {table_id for (table_id,) in missing})
+
+
+def get_stats(db: Session, compiled) -> Optional[Dict[str, Any]]:
+    """Statistics of a table for the API, or None if they have never been built"""
+    table_stats = db.query(models.DynamicTableStats).filter(
+        models.DynamicTableStats.table_id == compiled.table_id
+    ).first()
+    if table_stats is None:
+        return None
+    column_stats = {
+        stats.column_id: stats
+        for stats in db.query(models.DynamicTableColumnStats).filter(
+            models.DynamicTableColumnStats.table_id == compiled.table_id
+        )
+    }
+
+    columns = []
+    for spec in compiled.columns.values():
+        stats = column_stats.get(spec.id)
+        if stats is None:
+            continue
+        # Untracked updates can take the count below zero before a rebuild
+        non_null_count = max(stats.non_null_count, 0)
+        columns.append({
+            "column_id": spec.id,
+            "name": spec.name,
+            "non_null_count": non_null_count,
+            "null_count": max(table_stats.row_count - non_null_count, 0),
+            "distinct_estimate": min(distinct_estimate(stats.sketch), non_null_count),
+            "min_value": stats.min_value,
+            "max_value": stats.max_value,
+        })
+    return {
+        "row_count": max(table_stats.row_count, 0),
+        "modifications": table_stats.modifications,
+        "rebuilt_at": table_stats.rebuilt_at,
+        "columns": columns,
+    }
+
+
+def _matching_fraction(spec, stats: models.DynamicTableColumnStats, row_count: int, condition: Any) -> Optional[float]:
+    """Estimated share of the table's rows a filter on one field matches, or None if unknown"""
+    non_null = min(max(stats.non_null_count, 0) / row_count, 1.0)
+    if not isinstance(condition, dict):
+        condition = {"eq": condition}
+
+    if "eq" in condition or "in" in condition:
+        values = len(condition["in"]) if isinstance(condition.get("in"), list) else 1
+        distinct = max(min(distinct_estimate(stats.sketch), stats.non_null_count), 1)
+        return min(non_null * values / distinct, 1.0)
+
+    if spec.column_type not in _NUMERIC_TYPES or stats.min_value is None or stats.max_value is None:
+        return None
+    low, high = float(stats.min_value), float(stats.max_value)
+    if high <= low:
+        return non_null
+    try:
+        lower = max([float(v) for k, v in condition.items() if k in ("gt", "gte")] or [low])
+        upper = min([float(v) for k, v in condition.items() if k in ("lt", "lte")] or [high])
+        if isinstance(condition.get("range"), list) and len(condition["range"]) == 2:
+            range_low, range_high = condition["range"]
+            if range_low is not None:
+                lower = max(lower, float(range_low))
+            if range_high is not None:
+                upper = min(upper, float(range_high))
+    except (TypeError, ValueError):
+        return None
+    return non_null * max(min(upper, high) - max(lower, low), 0.0) / (high - low)
+
+
+def selective_index_fields(db: Session, compiled, dialect: str, filter_params: Optional[Dict[str, Any]]) -> Optional[Set[str]]:
+    """
+    Filtered fields whose generated column index is worth using.
+
+    Returns None when every index may be used (no statistics, small tables,
+    or no indexed field filtered). Otherwise the set of indexed fields whose
+    filter is estimated to match at most INDEX_SELECTIVITY_THRESHOLD of the
+    rows; the others are filtered on the JSON value, so MySQL reads the table
+    by table_id rather than making many index lookups.
+    """
+    if dialect != "mysql" or compiled.physical is not None or not isinstance(filter_params, dict):
+        return None
+    indexed = {
+        field: compiled.columns[field]
+        for field in filter_params
+        if field in compiled.columns and compiled.columns[field].indexed_column
+    }
+    if not indexed:
+        return None
+
+    table_stats = db.query(models.DynamicTableStats).filter(
+        models.DynamicTableStats.table_id == compiled.table_id
+    ).first()
+    if table_stats is None or table_stats.row_count < INDEX_MIN_ROWS:
+        return None
+    column_stats = {
+        stats.column_id: stats
+        for stats in db.query(models.DynamicTableColumnStats).filter(
+            models.DynamicTableColumnStats.column_id.in_([spec.id for spec in indexed.values()])
+        )
+    }
+
+    selective = set()
+    for field, spec in indexed.items():
+        stats = column_stats.get(spec.id)
+        fraction = _matching_fraction(spec, stats, table_stats.row_count, filter_params[field]) if stats else None
+        if fraction is None or fraction <= INDEX_SELECTIVITY_THRESHOLD:
+            selective.add(field)
+    return selective
@@ -0,0 +1,205 @@
+"""
+Physical storage for materialized dynamic tables.
+
+A materialized table keeps its rows in a table of its own (`dt_<table id>`)
+instead of `dynamic_table_data`. Every `ColumnDefinition` becomes a typed
+column named `c_<column id>`, so renaming a column needs no DDL. Columns marked
+`is_index` get a native index, and columns marked `is_unique` get an `h_<column
+id>` hash column with a unique index, using the same hash as
+`dynamic_table_unique_values`. Fields that are not declared columns, and
+explicit nulls, are kept in the `extra` JSON column so a table can be converted
+back to JSON storage without losing data.
+"""
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List
+
+from sqlalchemy import (
+    JSON, BigInteger, Boolean, Column, Date, DateTime, Float, Index, Integer,
+    MetaData, String, Table, Text, func, text,
+)
+from sqlalchemy.orm import Session
+
+import models
+
+# Longest string column stored as VARCHAR; longer ones become TEXT
+_MAX_VARCHAR = 1000
+
+# Prefix length used when indexing TEXT columns on MySQL
+_TEXT_INDEX_LENGTH = 255
+
+
+def physical_table_name(table_id: int) -> str:
+    return f"dt_{table_id}"
+
+
+def value_column_name(column_id: int) -> str:
+    return f"c_{column_id}"
+
+
+def hash_column_name(column_id: int) -> str:
+    return f"h_{column_id}"
+
+
+def _index_name(table_name: str, column_name: str) -> str:
+    return f"ix_{table_name}_{column_name}"
+
+
+def _column_type(column: models.ColumnDefinition):
+    column_type = column.column_type
+    if column_type == "string":
+        length = column.max_length or 255
+        return String(length) if length <= _MAX_VARCHAR else Text
+    if column_type == "text":
+        return Text
+    if column_type == "integer":
+        return BigInteger
+    if column_type == "float":
+        return Float(53)
+    if column_type == "boolean":
+        return Boolean
+    if column_type == "date":
+        return Date
+    if column_type == "datetime":
+        return DateTime
+    return JSON
+
+
+def _value_column(column: models.ColumnDefinition) -> Column:
+    return Column(value_column_name(column.id), _column_type(column), nullable=True)
+
+
+def _column_indexes(table_name: str, column: models.ColumnDefinition, value_column: Column, hash_column: Column = None) -> List[Index]:
+    indexes = []
+    if column.is_index and column.column_type != "json":
+        kwargs = {}
+        if isinstance(value_column.type, Text):
+            kwargs["mysql_length"] = _TEXT_INDEX_LENGTH
+        indexes.append(Index(_index_name(table_name, value_column.name), value_column, **kwargs))
+    if hash_column is not None:
+        indexes.append(Index(_index_name(table_name, hash_column.name), hash_column, unique=True))
+    return indexes
+
+
+def build_table(table_name: str, columns: List[models.ColumnDefinition]) -> Table:
+    """Describe the physical table for a set of column definitions"""
+    table_columns = [
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("created_by", Integer, nullable=True),
+        Column("created_at", DateTime, server_default=func.now()), # pylint: disable=E1102
+        Column("updated_at", DateTime, server_default=func.now()), # pylint: disable=E1102
+        Column("version", Integer, nullable=False, server_default="1"),
+        Column("extra", JSON, nullable=True),
+    ]
+    indexes = []
+    for column in columns:
+        value_column = _value_column(column)
+        hash_column = Column(hash_column_name(column.id), String(64), nullable=True) if column.is_unique else None
+        table_columns.append(value_column)
+        if hash_column is not None:
+            table_columns.append(hash_column)
+        indexes.extend(_column_indexes(table_name, column, value_column, hash_column))
+    return Table(table_name, MetaData(), *table_columns, *indexes)
+
+
+def add_column(db: Session, table_name: str, columns: List[models.ColumnDefinition], column: models.ColumnDefinition):
+    """Add the storage (and indexes) of a new column definition to an existing physical table"""
+    bind = db.connection()
+    table = build_table(table_name, columns)
+    names = [value_column_name(column.id), hash_column_name(column.id)]
+    for name in names:
+        if name in table.c:
+            column_type = table.c[name].type.compile(dialect=bind.dialect)
+            db.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type} NULL"))
+    for index in table.indexes:
+        if any(c.name in names for c in index.columns):
+            index.create(bind)
+
+
+def drop_column(db: Session, table: Table, column: models.ColumnDefinition):
+    """Drop the storage of a column definition, indexes first"""
+    bind = db.connection()
+    names = [value_column_name(column.id), hash_column_name(column.id)]
+    for index in list(table.indexes):
+        if any(c.name in names for c in index.columns):
+            index.drop(bind)
+    for name in names:
+        if name in table.c:
+            db.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {name}"))
+
+
+def to_column_value(column_type: str, value: Any) -> Any:
+    """Convert a JSON field value to the Python value of its typed column; raises ValueError"""
+    if column_type == "integer":
+        return int(value)
+    if column_type == "float":
+        return float(value)
+    if column_type == "boolean":
+        if isinstance(value, bool):
+            return value
+        if value in (1, "true", "True"):
+            return True
+        if value in (0, "false", "False"):
+            return False
+        raise ValueError(f"not a boolean: {value!r}")
+    if column_type == "date":
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    if column_type == "datetime":
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        # DATETIME columns hold naive UTC values
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    if column_type in ("string", "text"):
+        if isinstance(value, (dict, list)):
+            raise ValueError("not a string")
+        return str(value)
+    return value
+
+
+def from_column_value(column_type: str, value: Any) -> Any:
+    """Convert a typed column value back to its JSON form"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if column_type == "boolean":
+        return bool(value)
+    return value
+
+
+def row_values(columns: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Split row data into physical column values.
+
+    `columns` maps field name to its ColumnSpec. Every value column is present
+    in the result (None when missing) so rows can be written with executemany.
+    """
+    values: Dict[str, Any] = {value_column_name(spec.id): None for spec in columns.values()}
+    extra = {}
+    for name, value in data.items():
+        spec = columns.get(name)
+        if spec is None or value is None:
+            extra[name] = value
+            continue
+        values[value_column_name(spec.id)] = to_column_value(spec.column_type, value)
+    values["extra"] = extra or None
+    return values
+
+
+def row_data(columns: Dict[str, Any], record) -> Dict[str, Any]:
+    """
+    Rebuild row data from a physical table record.
+
+    Column values win over `extra`, which may still hold an explicit null for
+    a column that has since been given a value.
+    """
+    mapping = record._mapping
+    data = dict(mapping["extra"] or {})
+    for name, spec in columns.items():
+        value = mapping[value_column_name(spec.id)]
+        if value is not None:
+            data[name] = from_column_value(spec.column_type, value)
+    return data
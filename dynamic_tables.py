@@ -1,21 +1,88 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import text, inspect
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import text, inspect, and_, or_, select, func
+from sqlalchemy.exc import IntegrityError
 import models
 import schemas
-from typing import List, Dict, Any, Optional, Union
+import dynamic_table_query
+import dynamic_table_stats
+import dynamic_table_storage
+from typing import List, Dict, Any, Optional, Union, Callable, Tuple
 import json
-from datetime import datetime, date
+import hashlib
+from datetime import datetime, date, timedelta
+from decimal import Decimal
 from fastapi import HTTPException, status
 
 # Dynamic Table CRUD operations
 def get_table_definition(db: Session, table_id: int):
     return db.query(models.TableDefinition).filter(models.TableDefinition.id == table_id).first()
 
+def get_table_definition_for_write(db: Session, table_id: int):
+    """
+    Load a table definition for a row write, holding a shared lock on it until commit.
+
+    Moving a table between JSON and physical storage takes the exclusive lock,
+    so it waits for in-flight writes and writes never land in the old storage.
+    """
+    table = db.query(models.TableDefinition).filter(
+        models.TableDefinition.id == table_id
+    ).with_for_update(read=True).first()
+    if not table:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+    return table
+
 def get_table_definition_by_name(db: Session, name: str):
     return db.query(models.TableDefinition).filter(models.TableDefinition.name == name).first()
 
 def get_table_definitions(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.TableDefinition).offset(skip).limit(limit).all()
+    # Columns of the whole page come in one extra query instead of one per table
+    return db.query(models.TableDefinition).options(
+        selectinload(models.TableDefinition.columns)
+    ).order_by(models.TableDefinition.id).offset(skip).limit(limit).all()
+
+def get_table_definition_with_columns(db: Session, table_id: int):
+    return db.query(models.TableDefinition).options(
+        selectinload(models.TableDefinition.columns)
+    ).filter(models.TableDefinition.id == table_id).first()
+
+# (catalogue version, every table definition), shared by the requests of this worker
+_table_catalogue: Optional[Tuple[Tuple, List[schemas.TableDefinition]]] = None
+
+def _catalogue_version(db: Session) -> Tuple:
+    """
+    Fingerprint of table_definitions that changes with every definition change.
+
+    Creating a table raises the max id, deleting one lowers the count, and
+    every other change bumps a schema_version.
+    """
+    return tuple(db.query(
+        func.count(models.TableDefinition.id),
+        func.max(models.TableDefinition.id),
+        func.coalesce(func.sum(models.TableDefinition.schema_version), 0),
+        func.max(models.TableDefinition.updated_at)
+    ).one())
+
+def get_table_catalogue(db: Session) -> List[schemas.TableDefinition]:
+    """
+    Return every table definition with its columns, from this worker's cache.
+
+    Each call costs one aggregate query to check the catalogue version; the
+    definitions are reloaded only when it differs, so changes made through
+    any worker are seen on the next call.
+    """
+    global _table_catalogue
+    # Read the version first: a change racing with the reload is caught next time
+    version = _catalogue_version(db)
+    if _table_catalogue is None or _table_catalogue[0] != version:
+        tables = db.query(models.TableDefinition).options(
+            selectinload(models.TableDefinition.columns)
+        ).order_by(models.TableDefinition.id).all()
+        _table_catalogue = (version, [schemas.TableDefinition.model_validate(table) for table in tables])
+    return _table_catalogue[1]
 
 def create_table_definition(db: Session, table: schemas.TableDefinitionCreate, user_id: Optional[int] = None):
     # Check if table with same name exists
@@ -30,11 +97,16 @@ def create_table_definition(db: Session, table: schemas.TableDefinitionCreate, u
         description=table.description,
         created_by=user_id
     )
+    dynamic_table_query.check_json_index_capacity(db, sum(
+        1 for column in table.columns
+        if column.is_index and dynamic_table_query.needs_json_index(db, column.column_type.value)
+    ))
     db.add(db_table)
     db.commit()
     db.refresh(db_table)
     
     # Add columns
+    db_columns = []
     for column in table.columns:
         db_column = models.ColumnDefinition(
             table_id=db_table.id,
@@ -49,8 +121,16 @@ def create_table_definition(db: Session, table: schemas.TableDefinitionCreate, u
             max_length=column.max_length
         )
         db.add(db_column)
+        db_columns.append(db_column)
     
+    db.flush()
+    dynamic_table_stats.create_stats(db, db_table.id, [db_column.id for db_column in db_columns], table=True)
     db.commit()
+    
+    for db_column in db_table.columns:
+        if db_column.is_index:
+            sync_json_index(db, db_column)
+    
     db.refresh(db_table)
     return db_table
 
@@ -72,6 +152,7 @@ def update_table_definition(db: Session, table_id: int, table: schemas.TableDefi
     db_table.name = table.name
     db_table.description = table.description
     db_table.updated_at = datetime.now()
+    _bump_schema_version(db, table_id)
     
     db.commit()
     db.refresh(db_table)
@@ -85,11 +166,256 @@ def delete_table_definition(db: Session, table_id: int):
             detail="Table not found"
         )
     
+    for db_column in db_table.columns:
+        if db_column.indexed_column:
+            dynamic_table_query.drop_json_index(db, db_column)
+    if db_table.physical_table:
+        dynamic_table_storage.build_table(db_table.physical_table, db_table.columns).drop(db.connection(), checkfirst=True)
+    
     # This will cascade delete all columns and data
     db.delete(db_table)
     db.commit()
+    invalidate_compiled_schema(table_id)
     return {"message": "Table deleted successfully"}
 
+def sync_json_index(db: Session, db_column: models.ColumnDefinition):
+    """
+    Create or drop the generated column index so it matches the column's is_index flag.
+
+    Runs after the column definition is committed because MySQL DDL commits
+    implicitly. If the index can't be built (or the shared table has no room
+    left for it), is_index is turned back off and the error is raised.
+    """
+    dropping = db_column.indexed_column
+    try:
+        if db_column.indexed_column:
+            dynamic_table_query.drop_json_index(db, db_column)
+            db_column.indexed_column = None
+            dropping = None
+        if db_column.is_index:
+            if dynamic_table_query.needs_json_index(db, db_column.column_type):
+                dynamic_table_query.check_json_index_capacity(db, 1)
+            db_column.indexed_column = dynamic_table_query.create_json_index(db, db_column)
+    except Exception as e:
+        db.rollback()
+        db_column.is_index = False
+        db_column.indexed_column = None
+        _bump_schema_version(db, db_column.table_id)
+        db.commit()
+        if isinstance(e, HTTPException):
+            raise
+        detail = f"Column '{db_column.name}' was saved without its index: {e}"
+        if dropping:
+            detail += f"; its old generated column {dropping} could not be dropped"
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=detail
+        ) from e
+    _bump_schema_version(db, db_column.table_id)
+    db.commit()
+
+# Rows changed this close to the start of a materialize copy are copied again at the switch
+_MATERIALIZE_CLOCK_MARGIN = timedelta(minutes=1)
+
+def _copy_rows_to_physical(db: Session, compiled: "CompiledTableSchema", physical, rows):
+    db.execute(physical.insert(), [
+        {
+            **_physical_values(compiled, row.data or {}, row.id),
+            "id": row.id,
+            "created_by": row.created_by,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            "version": row.version
+        }
+        for row in rows
+    ])
+
+def materialize_table(db: Session, table_id: int, batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Move a table's rows out of dynamic_table_data into a typed table of its own.
+
+    Rows are copied in id order, one committed batch at a time, while the table
+    stays writable. The switch then takes the definition's exclusive lock,
+    re-copies rows added, changed or deleted during the copy, and points the
+    definition at the new table; from then on the row functions read and write
+    the physical table. The JSON copies are deleted in batches afterwards.
+    Row ids are preserved.
+    """
+    table = get_table_definition(db, table_id)
+    if not table:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+    if table.physical_table:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Table is already materialized"
+        )
+    
+    columns = get_column_definitions_by_table(db, table_id)
+    compiled = get_compiled_schema(db, table)
+    table_name = dynamic_table_storage.physical_table_name(table_id)
+    physical = dynamic_table_storage.build_table(table_name, columns)
+    source = models.DynamicTableData
+    row_columns = (source.id, source.data, source.created_by, source.created_at, source.updated_at, source.version)
+    
+    # A table left behind by an interrupted run is rebuilt from scratch
+    physical.drop(db.connection(), checkfirst=True)
+    physical.create(db.connection())
+    db.commit()
+    
+    started_at = datetime.now() - _MATERIALIZE_CLOCK_MARGIN
+    last_id = 0
+    try:
+        while True:
+            rows = db.query(*row_columns).filter(
+                source.table_id == table_id,
+                source.id > last_id
+            ).order_by(source.id).limit(batch_size).all()
+            if not rows:
+                break
+            _copy_rows_to_physical(db, compiled, physical, rows)
+            db.commit()
+            last_id = rows[-1].id
+        
+        locked = db.query(models.TableDefinition).filter(
+            models.TableDefinition.id == table_id
+        ).with_for_update().first()
+        if not locked or locked.schema_version != compiled.schema_version:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Table definition changed while materializing; try again"
+            )
+        
+        changed = db.query(*row_columns).filter(
+            source.table_id == table_id,
+            or_(source.id > last_id, source.updated_at >= started_at)
+        ).order_by(source.id).all()
+        for start in range(0, len(changed), batch_size):
+            batch = changed[start:start + batch_size]
+            db.execute(physical.delete().where(physical.c.id.in_([row.id for row in batch])))
+            _copy_rows_to_physical(db, compiled, physical, batch)
+        db.execute(physical.delete().where(physical.c.id.not_in(
+            select(source.id).where(source.table_id == table_id)
+        )))
+        
+        locked.physical_table = table_name
+        _bump_schema_version(db, table_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        physical.drop(db.connection(), checkfirst=True)
+        db.commit()
+        raise
+    
+    # Generated column indexes on dynamic_table_data are no longer read
+    for column in columns:
+        if column.indexed_column:
+            dynamic_table_query.drop_json_index(db, column)
+            column.indexed_column = None
+    db.commit()
+    
+    while True:
+        row_ids = [row_id for (row_id,) in db.query(source.id).filter(source.table_id == table_id).limit(batch_size)]
+        if not row_ids:
+            break
+        db.query(models.DynamicTableUniqueValue).filter(
+            models.DynamicTableUniqueValue.row_id.in_(row_ids)
+        ).delete(synchronize_session=False)
+        db.query(source).filter(source.id.in_(row_ids)).delete(synchronize_session=False)
+        db.commit()
+    
+    return {
+        "table_id": table_id,
+        "physical_table": table_name,
+        "rows_moved": db.execute(select(func.count()).select_from(physical)).scalar()
+    }
+
+def dematerialize_table(db: Session, table_id: int, batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Move a materialized table's rows back into dynamic_table_data.
+
+    Runs as one transaction holding the definition's exclusive lock, so writes
+    to the table wait until it finishes; rows are still read and inserted in
+    batches. Row ids are kept unless another table's row has taken the id in
+    the meantime, in which case the row gets a new id.
+    """
+    table = db.query(models.TableDefinition).filter(
+        models.TableDefinition.id == table_id
+    ).with_for_update().first()
+    if not table:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+    if not table.physical_table:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Table is not materialized"
+        )
+    
+    compiled = get_compiled_schema(db, table)
+    physical = compiled.physical
+    target = models.DynamicTableData.__table__
+    
+    last_id = 0
+    moved = 0
+    # Rows whose id was taken get new ids only after every other row is in,
+    # so a new id can't collide with a row still to be copied
+    renumbered = []
+    while True:
+        records = db.execute(
+            select(physical).where(physical.c.id > last_id).order_by(physical.c.id).limit(batch_size)
+        ).all()
+        if not records:
+            break
+        row_ids = [record.id for record in records]
+        taken = {row_id for (row_id,) in db.query(models.DynamicTableData.id).filter(models.DynamicTableData.id.in_(row_ids))}
+        
+        kept = []
+        for record in records:
+            row = {
+                "table_id": table_id,
+                "data": dynamic_table_storage.row_data(compiled.columns, record),
+                "created_by": record.created_by,
+                "created_at": record.created_at,
+                "updated_at": record.updated_at,
+                "version": record.version
+            }
+            if record.id in taken:
+                renumbered.append(row)
+            else:
+                kept.append({**row, "id": record.id})
+        if kept:
+            db.execute(target.insert(), kept)
+        moved += len(records)
+        last_id = row_ids[-1]
+    for start in range(0, len(renumbered), batch_size):
+        db.execute(target.insert(), renumbered[start:start + batch_size])
+    
+    table.physical_table = None
+    _bump_schema_version(db, table_id)
+    db.flush()
+    columns = get_column_definitions_by_table(db, table_id)
+    for column in columns:
+        if column.is_unique:
+            index_unique_column(db, column, batch_size)
+    db.commit()
+    
+    physical.drop(db.connection())
+    db.commit()
+    for column in columns:
+        if column.is_index:
+            sync_json_index(db, column)
+    
+    return {
+        "table_id": table_id,
+        "physical_table": None,
+        "rows_moved": moved,
+        "rows_renumbered": len(renumbered)
+    }
+
 def get_column_definition(db: Session, column_id: int):
     return db.query(models.ColumnDefinition).filter(models.ColumnDefinition.id == column_id).first()
 
@@ -113,6 +439,9 @@ def create_column_definition(db: Session, column: schemas.ColumnDefinitionCreate
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Column with name '{column.name}' already exists in this table"
             )
+    _check_no_pending_rewrite(db, table_id, column.name)
+    if column.is_index and not db_table.physical_table and dynamic_table_query.needs_json_index(db, column.column_type.value):
+        dynamic_table_query.check_json_index_capacity(db, 1)
     
     db_column = models.ColumnDefinition(
         table_id=table_id,
@@ -127,7 +456,20 @@ def create_column_definition(db: Session, column: schemas.ColumnDefinitionCreate
         max_length=column.max_length
     )
     db.add(db_column)
+    _bump_schema_version(db, table_id)
+    db.flush()
+    # A new column holds no values yet, so its statistics start out empty
+    dynamic_table_stats.create_stats(db, table_id, [db_column.id])
+    if db_table.physical_table:
+        # ...and there is nothing to index or check in the physical table
+        dynamic_table_storage.add_column(
+            db, db_table.physical_table, get_column_definitions_by_table(db, table_id), db_column
+        )
+    elif db_column.is_unique:
+        index_unique_column(db, db_column)
     db.commit()
+    if db_column.is_index and not db_table.physical_table:
+        sync_json_index(db, db_column)
     db.refresh(db_column)
     return db_column
 
@@ -148,6 +490,37 @@ def update_column_definition(db: Session, column_id: int, column: schemas.Column
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Column with name '{column.name}' already exists in this table"
                 )
+        _check_no_pending_rewrite(db, db_column.table_id, column.name)
+    
+    physical_table = db_column.table.physical_table
+    if physical_table and (
+        column.column_type.value != db_column.column_type
+        or column.max_length != db_column.max_length
+        or bool(column.is_unique) != bool(db_column.is_unique)
+        or bool(column.is_index) != bool(db_column.is_index)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Table is materialized; move it back to JSON storage before changing a column's type, length, uniqueness or index"
+        )
+    
+    if (column.is_index and not physical_table and not db_column.indexed_column
+            and dynamic_table_query.needs_json_index(db, column.column_type.value)):
+        dynamic_table_query.check_json_index_capacity(db, 1)
+    
+    if column.name != db_column.name:
+        # Stored values move to the new key in the background
+        _schedule_rewrite(db, db_column.table, "rename", db_column.name, column.name)
+    
+    was_unique = bool(db_column.is_unique)
+    index_changed = (
+        bool(column.is_index) != bool(db_column.is_index)
+        or (column.is_index and (
+            column.name != db_column.name
+            or column.column_type.value != db_column.column_type
+            or column.max_length != db_column.max_length
+        ))
+    )
     
     db_column.name = column.name
     db_column.description = column.description
@@ -158,11 +531,69 @@ def update_column_definition(db: Session, column_id: int, column: schemas.Column
     db_column.is_index = column.is_index
     db_column.default_value = column.default_value
     db_column.max_length = column.max_length
+    _bump_schema_version(db, db_column.table_id)
+    
+    if column.is_unique and not was_unique:
+        db.flush()
+        index_unique_column(db, db_column)
+    elif was_unique and not column.is_unique:
+        db.query(models.DynamicTableUniqueValue).filter(
+            models.DynamicTableUniqueValue.column_id == column_id
+        ).delete(synchronize_session=False)
     
     db.commit()
+    if index_changed and not physical_table:
+        sync_json_index(db, db_column)
     db.refresh(db_column)
     return db_column
 
+def _check_no_pending_rewrite(db: Session, table_id: int, name: str):
+    """Refuse to reuse a field name while stored rows are still being rewritten for it"""
+    pending = db.query(models.DynamicTableRewriteJob.id).filter(
+        models.DynamicTableRewriteJob.table_id == table_id,
+        models.DynamicTableRewriteJob.field == name,
+        models.DynamicTableRewriteJob.status.in_(("pending", "running"))
+    ).first()
+    if pending:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Rows are still being rewritten after a change to '{name}'; try again when rewrite job {pending.id} has finished"
+        )
+
+def _schedule_rewrite(db: Session, table: models.TableDefinition, operation: str, field: str,
+                      new_field: Optional[str] = None) -> Optional[models.DynamicTableRewriteJob]:
+    """
+    Queue a background rewrite of the stored rows, committed with the column change.
+
+    Only rows that exist now are rewritten; rows written afterwards already
+    use the new definition. Returns None when the table has no rows.
+    """
+    if table.physical_table:
+        # Typed columns are handled by DDL; only the extra JSON column needs rewriting
+        physical = get_compiled_schema(db, table).physical
+        max_row_id, rows_total = db.execute(select(func.max(physical.c.id), func.count())).one()
+    else:
+        max_row_id, rows_total = db.query(
+            func.max(models.DynamicTableData.id), func.count(models.DynamicTableData.id)
+        ).filter(models.DynamicTableData.table_id == table.id).one()
+    if not rows_total:
+        return None
+    
+    job = models.DynamicTableRewriteJob(
+        table_id=table.id,
+        operation=operation,
+        field=field,
+        new_field=new_field,
+        status="pending",
+        max_row_id=max_row_id,
+        last_row_id=0,
+        rows_total=rows_total,
+        rows_scanned=0,
+        rows_rewritten=0
+    )
+    db.add(job)
+    return job
+
 def delete_column_definition(db: Session, column_id: int):
     db_column = get_column_definition(db, column_id)
     if not db_column:
@@ -171,91 +602,419 @@ def delete_column_definition(db: Session, column_id: int):
             detail="Column not found"
         )
     
+    if db_column.indexed_column:
+        dynamic_table_query.drop_json_index(db, db_column)
+    physical_table = db_column.table.physical_table
+    if physical_table:
+        dynamic_table_storage.drop_column(
+            db,
+            dynamic_table_storage.build_table(physical_table, get_column_definitions_by_table(db, db_column.table_id)),
+            db_column
+        )
+    
+    db.query(models.DynamicTableUniqueValue).filter(
+        models.DynamicTableUniqueValue.column_id == column_id
+    ).delete(synchronize_session=False)
+    # The column's values are removed from the stored rows in the background
+    job = _schedule_rewrite(db, db_column.table, "drop", db_column.name)
     db.delete(db_column)
+    _bump_schema_version(db, db_column.table_id)
     db.commit()
-    return {"message": "Column deleted successfully"}
+    return {
+        "message": "Column deleted successfully",
+        "rewrite_job_id": job.id if job else None
+    }
+
+def _check_string(column):
+    name, max_length = column.name, column.max_length
+    def check(value):
+        if not isinstance(value, str):
+            return f"Field '{name}' must be a string"
+        if max_length and len(value) > max_length:
+            return f"Field '{name}' exceeds maximum length of {max_length}"
+        return None
+    return check
+
+def _check_integer(column):
+    message = f"Field '{column.name}' must be an integer"
+    def check(value):
+        try:
+            int(value)
+        except (ValueError, TypeError):
+            return message
+        return None
+    return check
+
+def _check_float(column):
+    message = f"Field '{column.name}' must be a number"
+    def check(value):
+        try:
+            float(value)
+        except (ValueError, TypeError):
+            return message
+        return None
+    return check
+
+def _check_boolean(column):
+    message = f"Field '{column.name}' must be a boolean"
+    def check(value):
+        if not isinstance(value, bool) and value not in (0, 1, "true", "false", "True", "False"):
+            return message
+        return None
+    return check
+
+def _normalize_boolean(value):
+    # Stored as JSON true/false, which is what the boolean filters compare against
+    return value is True or (not isinstance(value, bool) and value in (1, "true", "True"))
+
+def _check_date(column):
+    message = f"Field '{column.name}' must be a valid date (YYYY-MM-DD)"
+    def check(value):
+        try:
+            if isinstance(value, str):
+                datetime.strptime(value, "%Y-%m-%d").date()
+            elif not isinstance(value, date):
+                return message
+        except ValueError:
+            return message
+        return None
+    return check
+
+def _check_datetime(column):
+    message = f"Field '{column.name}' must be a valid datetime"
+    def check(value):
+        try:
+            if isinstance(value, str):
+                datetime.fromisoformat(value.replace('Z', '+00:00'))
+            elif not isinstance(value, datetime):
+                return message
+        except ValueError:
+            return message
+        return None
+    return check
+
+def _check_json(column):
+    message = f"Field '{column.name}' must be valid JSON"
+    def check(value):
+        if isinstance(value, str):
+            try:
+                json.loads(value)
+            except json.JSONDecodeError:
+                return message
+        elif not isinstance(value, (dict, list)):
+            return message
+        return None
+    return check
+
+# Column type -> factory building the type check for one column
+_TYPE_CHECKS = {
+    "string": _check_string,
+    "text": _check_string,
+    "integer": _check_integer,
+    "float": _check_float,
+    "boolean": _check_boolean,
+    "date": _check_date,
+    "datetime": _check_datetime,
+    "json": _check_json,
+}
+
+# Column type -> conversion applied to valid values before they are stored
+_TYPE_NORMALIZERS = {
+    "boolean": _normalize_boolean,
+}
+
+def compile_row_validator(columns: List[models.ColumnDefinition]) -> Callable[[Dict[str, Any]], Dict[str, str]]:
+    """
+    Build a validator for a table's columns.
+
+    The column type dispatch happens once here; the returned function only runs
+    the pre-selected checks against each row and returns errors keyed by field.
+    With partial=True (updates) missing required fields are not reported.
+    Valid values that have a canonical form (booleans) are normalized in
+    `data` in place.
+    """
+    checks = []
+    for column in columns:
+        factory = _TYPE_CHECKS.get(column.column_type)
+        checks.append((
+            column.name,
+            bool(column.is_required),
+            f"Field '{column.name}' is required",
+            factory(column) if factory else None,
+            _TYPE_NORMALIZERS.get(column.column_type)
+        ))
+
+    def validate(data: Dict[str, Any], partial: bool = False) -> Dict[str, str]:
+        errors = {}
+        for name, is_required, required_message, check, normalize in checks:
+            if name not in data:
+                if is_required and not partial:
+                    errors[name] = required_message
+                continue
+            if check is not None:
+                message = check(data[name])
+                if message:
+                    errors[name] = message
+                    continue
+            if normalize is not None:
+                data[name] = normalize(data[name])
+        return errors
+
+    return validate
 
 def validate_data_against_schema(data: Dict[str, Any], columns: List[models.ColumnDefinition]) -> Dict[str, str]:
     """Validate data against column definitions and return errors if any"""
-    errors = {}
+    return compile_row_validator(columns)(data)
+
+class CompiledTableSchema:
+    """Column definitions of one table, compiled for row writes"""
+
+    def __init__(self, table: models.TableDefinition, columns: List[models.ColumnDefinition],
+                 renamed_from: Optional[Dict[str, Tuple[str, ...]]] = None):
+        self.table_id = table.id
+        self.schema_version = table.schema_version
+        self.validate = compile_row_validator(columns)
+        self.column_names = [column.name for column in columns]
+        self.unique_columns = [(column.name, column.id) for column in columns if column.is_unique]
+        # Rows of a materialized table live in their own typed table
+        self.physical = (
+            dynamic_table_storage.build_table(table.physical_table, columns)
+            if table.physical_table else None
+        )
+        # Field -> older keys rows may still store it under while a rename is
+        # being rewritten; a materialized table keeps values by column id
+        self.renamed_from = (renamed_from or {}) if self.physical is None else {}
+        self.columns = {
+            column.name: dynamic_table_query.column_spec(
+                column,
+                self.physical.c[dynamic_table_storage.value_column_name(column.id)] if self.physical is not None else None,
+                self.renamed_from.get(column.name, ())
+            )
+            for column in columns
+        }
+
+    def present(self, rows: List[models.DynamicTableData]) -> List[models.DynamicTableData]:
+        """Show fields of rows not rewritten yet after a rename under their current name"""
+        if not self.renamed_from:
+            return rows
+        for row in rows:
+            data = row.data or {}
+            if not any(old in data for names in self.renamed_from.values() for old in names):
+                continue
+            data = dict(data)
+            for name, previous_names in self.renamed_from.items():
+                for old in previous_names:
+                    if old in data:
+                        value = data.pop(old)
+                        data.setdefault(name, value)
+            # Only what is returned changes; the row is not marked as modified
+            set_committed_value(row, "data", data)
+        return rows
+
+def _pending_renames(db: Session, table_id: int) -> Dict[str, Tuple[str, ...]]:
+    """Field -> keys it had before renames whose rewrite jobs haven't finished, newest first"""
+    jobs = db.query(models.DynamicTableRewriteJob.field, models.DynamicTableRewriteJob.new_field).filter(
+        models.DynamicTableRewriteJob.table_id == table_id,
+        models.DynamicTableRewriteJob.operation == "rename",
+        models.DynamicTableRewriteJob.status.in_(("pending", "running"))
+    ).order_by(models.DynamicTableRewriteJob.id).all()
+    renamed_from: Dict[str, Tuple[str, ...]] = {}
+    for field, new_field in jobs:
+        renamed_from[new_field] = (field,) + renamed_from.pop(field, ())
+    return renamed_from
+
+# table_id -> CompiledTableSchema, checked against table_definitions.schema_version
+_compiled_schemas: Dict[int, CompiledTableSchema] = {}
+
+def get_compiled_schema(db: Session, table: models.TableDefinition) -> CompiledTableSchema:
+    """
+    Return the compiled schema for a table, compiling it on first use.
+
+    The entry is reused for as long as the table's schema_version matches, so
+    other workers pick up column changes on their next write.
+    """
+    compiled = _compiled_schemas.get(table.id)
+    if compiled is None or compiled.schema_version != table.schema_version:
+        compiled = CompiledTableSchema(
+            table, get_column_definitions_by_table(db, table.id), _pending_renames(db, table.id)
+        )
+        _compiled_schemas[table.id] = compiled
+    return compiled
+
+def invalidate_compiled_schema(table_id: int):
+    """Drop the compiled schema of a table from this worker's cache"""
+    _compiled_schemas.pop(table_id, None)
+
+def _bump_schema_version(db: Session, table_id: int):
+    """Mark a table's columns as changed so every worker recompiles its validator"""
+    db.query(models.TableDefinition).filter(models.TableDefinition.id == table_id).update(
+        {models.TableDefinition.schema_version: models.TableDefinition.schema_version + 1}
+    )
+    invalidate_compiled_schema(table_id)
+
+def unique_value_hash(value: Any) -> str:
+    """Hash a column value the same way regardless of key order or formatting"""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _duplicate_value_error(column_name: str, value: Any) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Value '{value}' already exists for field '{column_name}'"
+    )
+
+def _check_unique_values(db: Session, compiled: "CompiledTableSchema", data: Dict[str, Any], exclude_row_id: Optional[int] = None):
+    """Probe the unique value index once for every unique column present in data"""
+    probes = {}
+    for column_name, column_id in compiled.unique_columns:
+        if column_name in data:
+            probes[(column_id, unique_value_hash(data[column_name]))] = column_name
+    if not probes:
+        return
     
-    # Check for required fields
-    for column in columns:
-        if column.is_required and column.name not in data:
-            errors[column.name] = f"Field '{column.name}' is required"
-            continue
-            
-        if column.name not in data:
-            continue
-            
-        value = data[column.name]
-        
-        # Type validation
-        if column.column_type == "string" or column.column_type == "text":
-            if not isinstance(value, str):
-                errors[column.name] = f"Field '{column.name}' must be a string"
-            elif column.max_length and len(value) > column.max_length:
-                errors[column.name] = f"Field '{column.name}' exceeds maximum length of {column.max_length}"
-                
-        elif column.column_type == "integer":
-            try:
-                int(value)
-            except (ValueError, TypeError):
-                errors[column.name] = f"Field '{column.name}' must be an integer"
-                
-        elif column.column_type == "float":
-            try:
-                float(value)
-            except (ValueError, TypeError):
-                errors[column.name] = f"Field '{column.name}' must be a number"
-                
-        elif column.column_type == "boolean":
-            if not isinstance(value, bool) and value not in (0, 1, "true", "false", "True", "False"):
-                errors[column.name] = f"Field '{column.name}' must be a boolean"
-                
-        elif column.column_type == "date":
-            try:
-                if isinstance(value, str):
-                    datetime.strptime(value, "%Y-%m-%d").date()
-                elif not isinstance(value, date):
-                    errors[column.name] = f"Field '{column.name}' must be a valid date (YYYY-MM-DD)"
-            except ValueError:
-                errors[column.name] = f"Field '{column.name}' must be a valid date (YYYY-MM-DD)"
-                
-        elif column.column_type == "datetime":
-            try:
-                if isinstance(value, str):
-                    datetime.fromisoformat(value.replace('Z', '+00:00'))
-                elif not isinstance(value, datetime):
-                    errors[column.name] = f"Field '{column.name}' must be a valid datetime"
-            except ValueError:
-                errors[column.name] = f"Field '{column.name}' must be a valid datetime"
-                
-        elif column.column_type == "json":
-            if isinstance(value, str):
-                try:
-                    json.loads(value)
-                except json.JSONDecodeError:
-                    errors[column.name] = f"Field '{column.name}' must be valid JSON"
-            elif not isinstance(value, (dict, list)):
-                errors[column.name] = f"Field '{column.name}' must be valid JSON"
+    if compiled.physical is not None:
+        physical = compiled.physical
+        hash_columns = [physical.c[dynamic_table_storage.hash_column_name(column_id)] for column_id, _ in probes]
+        query = select(*hash_columns).where(or_(*[
+            physical.c[dynamic_table_storage.hash_column_name(column_id)] == value_hash
+            for column_id, value_hash in probes
+        ]))
+        if exclude_row_id is not None:
+            query = query.where(physical.c.id != exclude_row_id)
+        clash = db.execute(query.limit(1)).first()
+        if clash:
+            for (column_id, value_hash), column_name in probes.items():
+                if clash._mapping[dynamic_table_storage.hash_column_name(column_id)] == value_hash:
+                    raise _duplicate_value_error(column_name, data[column_name])
+        return
     
-    return errors
+    query = db.query(models.DynamicTableUniqueValue.column_id).filter(
+        models.DynamicTableUniqueValue.table_id == compiled.table_id,
+        or_(*[
+            and_(
+                models.DynamicTableUniqueValue.column_id == column_id,
+                models.DynamicTableUniqueValue.value_hash == value_hash
+            )
+            for column_id, value_hash in probes
+        ])
+    )
+    if exclude_row_id is not None:
+        query = query.filter(models.DynamicTableUniqueValue.row_id != exclude_row_id)
+    
+    clash = query.first()
+    if clash:
+        column_name = next(name for (column_id, _), name in probes.items() if column_id == clash.column_id)
+        raise _duplicate_value_error(column_name, data[column_name])
 
-def create_table_row(db: Session, table_id: int, data: Dict[str, Any], user_id: Optional[int] = None):
-    # Get table definition
-    table = get_table_definition(db, table_id)
-    if not table:
+def _add_unique_values(db: Session, compiled: "CompiledTableSchema", row_id: int, data: Dict[str, Any]):
+    for column_name, column_id in compiled.unique_columns:
+        if column_name in data:
+            db.add(models.DynamicTableUniqueValue(
+                table_id=compiled.table_id,
+                column_id=column_id,
+                row_id=row_id,
+                value_hash=unique_value_hash(data[column_name])
+            ))
+
+def _physical_values(compiled: "CompiledTableSchema", data: Dict[str, Any], row_id: Optional[int] = None) -> Dict[str, Any]:
+    """Column values (including unique hashes) of a row in a materialized table"""
+    try:
+        values = dynamic_table_storage.row_values(compiled.columns, data)
+    except (TypeError, ValueError) as e:
+        row = f"Row {row_id}" if row_id is not None else "Row"
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{row} cannot be stored in typed columns: {e}"
+        ) from e
+    for column_name, column_id in compiled.unique_columns:
+        values[dynamic_table_storage.hash_column_name(column_id)] = (
+            unique_value_hash(data[column_name]) if column_name in data else None
+        )
+    return values
+
+def _physical_row(compiled: "CompiledTableSchema", record) -> models.DynamicTableData:
+    """Present a materialized table record as a (detached) DynamicTableData row"""
+    return models.DynamicTableData(
+        id=record.id,
+        table_id=compiled.table_id,
+        data=dynamic_table_storage.row_data(compiled.columns, record),
+        created_at=record.created_at,
+        updated_at=record.updated_at,
+        created_by=record.created_by,
+        version=record.version
+    )
+
+def _get_physical_record(db: Session, compiled: "CompiledTableSchema", row_id: int):
+    query = select(compiled.physical).where(compiled.physical.c.id == row_id)
+    record = db.execute(query).first()
+    if not record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Table not found"
+            detail="Row not found"
         )
+    return record
+
+def index_unique_column(db: Session, column: models.ColumnDefinition, batch_size: int = 1000):
+    """
+    Add unique index entries for an existing column across all rows of its table.
+
+    Raises a 400 if the rows already hold duplicate values; the caller's
+    transaction is rolled back in that case.
+    """
+    db.query(models.DynamicTableUniqueValue).filter(
+        models.DynamicTableUniqueValue.column_id == column.id
+    ).delete(synchronize_session=False)
     
-    # Get column definitions
-    columns = get_column_definitions_by_table(db, table_id)
+    rows = db.query(models.DynamicTableData.id, models.DynamicTableData.data).filter(
+        models.DynamicTableData.table_id == column.table_id
+    ).yield_per(batch_size)
+    
+    seen = set()
+    entries = []
+    for row_id, data in rows:
+        if not data or column.name not in data:
+            continue
+        value_hash = unique_value_hash(data[column.name])
+        if value_hash in seen:
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Existing rows contain duplicate values for field '{column.name}'"
+            )
+        seen.add(value_hash)
+        entries.append({
+            "table_id": column.table_id,
+            "column_id": column.id,
+            "row_id": row_id,
+            "value_hash": value_hash
+        })
+        if len(entries) >= batch_size:
+            db.execute(models.DynamicTableUniqueValue.__table__.insert(), entries)
+            entries = []
+    if entries:
+        db.execute(models.DynamicTableUniqueValue.__table__.insert(), entries)
+
+def rebuild_unique_values(db: Session, table_id: Optional[int] = None):
+    """Re-index every unique column, optionally limited to one table"""
+    # Materialized tables enforce uniqueness with their own hash columns
+    query = db.query(models.ColumnDefinition).join(models.TableDefinition).filter(
+        models.ColumnDefinition.is_unique == True,  # noqa: E712
+        models.TableDefinition.physical_table.is_(None)
+    )
+    if table_id is not None:
+        query = query.filter(models.ColumnDefinition.table_id == table_id)
+    for column in query.all():
+        index_unique_column(db, column)
+    db.commit()
+
+def create_table_row(db: Session, table_id: int, data: Dict[str, Any], user_id: Optional[int] = None):
+    # Get table definition
+    table = get_table_definition_for_write(db, table_id)
+    
+    compiled = get_compiled_schema(db, table)
     
     # Validate data against schema
-    errors = validate_data_against_schema(data, columns)
+    errors = compiled.validate(data)
     if errors:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -263,32 +1022,252 @@ def create_table_row(db: Session, table_id: int, data: Dict[str, Any], user_id:
         )
     
     # Check for unique constraints
-    for column in columns:
-        if column.is_unique and column.name in data:
-            # Check if value already exists
-            existing_rows = db.query(models.DynamicTableData).filter(
-                models.DynamicTableData.table_id == table_id
-            ).all()
-            
-            for row in existing_rows:
-                if column.name in row.data and row.data[column.name] == data[column.name]:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail=f"Value '{data[column.name]}' already exists for field '{column.name}'"
-                    )
-    
-    # Create row
-    db_row = models.DynamicTableData(
-        table_id=table_id,
-        data=data,
-        created_by=user_id
-    )
-    db.add(db_row)
-    db.commit()
+    _check_unique_values(db, compiled, data)
+    
+    try:
+        if compiled.physical is not None:
+            values = _physical_values(compiled, data)
+            values["created_by"] = user_id
+            row_id = db.execute(compiled.physical.insert().values(**values)).inserted_primary_key[0]
+        else:
+            # Create row
+            db_row = models.DynamicTableData(
+                table_id=table_id,
+                data=data,
+                created_by=user_id
+            )
+            db.add(db_row)
+            db.flush()
+            # The unique key on the index table rejects a concurrent insert of the same value
+            _add_unique_values(db, compiled, db_row.id, data)
+        dynamic_table_stats.record_changes(db, compiled, inserted=[data])
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A row with the same unique value was written concurrently"
+        ) from e
+    
+    if compiled.physical is not None:
+        return _physical_row(compiled, _get_physical_record(db, compiled, row_id))
     db.refresh(db_row)
     return db_row
 
+# Bulk ingestion
+
+_CSV_TRUE = {"true", "1", "yes", "y"}
+_CSV_FALSE = {"false", "0", "no", "n"}
+
+def coerce_csv_record(compiled: CompiledTableSchema, record: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Turn a CSV record (all strings) into typed row data.
+
+    Empty cells are treated as missing fields. Values that cannot be converted
+    are passed through unchanged so the validator reports them.
+    """
+    data = {}
+    for name, raw in record.items():
+        if name is None or raw is None or raw == "":
+            continue
+        spec = compiled.columns.get(name)
+        value: Any = raw
+        if spec is not None:
+            try:
+                if spec.column_type == "integer":
+                    value = int(raw)
+                elif spec.column_type == "float":
+                    value = float(raw)
+                elif spec.column_type == "boolean":
+                    if raw.lower() in _CSV_TRUE:
+                        value = True
+                    elif raw.lower() in _CSV_FALSE:
+                        value = False
+                elif spec.column_type == "json":
+                    value = json.loads(raw)
+            except ValueError:
+                value = raw
+        data[name] = value
+    return data
+
+def _insert_rows(db: Session, rows: List[Dict[str, Any]], need_ids: bool) -> List[int]:
+    """
+    Insert rows with multi-row statements, returning their ids in order when asked.
+
+    Ids are needed only for the unique value index. They come from RETURNING
+    where the dialect supports it. On MySQL the rows are read back after the
+    insert from LAST_INSERT_ID() on, which doesn't depend on the
+    auto-increment lock mode or increment; otherwise they come from one
+    INSERT per row.
+    """
+    table = models.DynamicTableData.__table__
+    if not need_ids:
+        db.execute(table.insert(), rows)
+        return []
+    
+    dialect = db.get_bind().dialect
+    if getattr(dialect, "insert_returning", False):
+        result = db.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows)
+        return [row.id for row in result]
+    if dialect.name == "mysql":
+        return _insert_rows_read_back(db, rows)
+    return [db.execute(table.insert().values(**row)).inserted_primary_key[0] for row in rows]
+
+def _insert_rows_read_back(db: Session, rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    One multi-row INSERT, then one SELECT of the table's rows from the first new id on.
+
+    InnoDB gives the rows of one statement increasing ids, but with
+    innodb_autoinc_lock_mode=2 another transaction's rows may take ids in
+    between, and under READ COMMITTED the committed ones show up in the
+    SELECT. The rows' data is the batch marker: the new rows are matched in
+    order by their data hash. A foreign row with the same data as one of
+    ours also has its unique values, so the unique value insert that follows
+    fails and the batch is re-checked.
+    """
+    table = models.DynamicTableData.__table__
+    db.execute(table.insert().values(rows))
+    candidates = db.execute(
+        select(table.c.id, table.c.data)
+        .where(table.c.table_id == rows[0]["table_id"], table.c.id >= func.last_insert_id())
+        .order_by(table.c.id)
+    ).all()
+    if len(candidates) == len(rows):
+        return [candidate.id for candidate in candidates]
+    
+    row_ids = []
+    candidates = iter(candidates)
+    for row in rows:
+        row_hash = unique_value_hash(row["data"])
+        for candidate in candidates:
+            if unique_value_hash(candidate.data) == row_hash:
+                row_ids.append(candidate.id)
+                break
+        else:
+            raise RuntimeError("Inserted rows not found when reading their ids back")
+    return row_ids
+
+def _find_batch_duplicates(db: Session, compiled: CompiledTableSchema, batch: List[Tuple[int, Dict[str, Any]]]) -> Dict[int, Dict[str, str]]:
+    """Check unique columns within the batch and, with one query per column, against stored rows"""
+    errors: Dict[int, Dict[str, str]] = {}
+    for column_name, column_id in compiled.unique_columns:
+        first_seen: Dict[str, int] = {}
+        hashes: Dict[str, List[int]] = {}
+        for row_no, data in batch:
+            if column_name not in data:
+                continue
+            value_hash = unique_value_hash(data[column_name])
+            if value_hash in first_seen:
+                errors.setdefault(row_no, {})[column_name] = (
+                    f"Value '{data[column_name]}' duplicates row {first_seen[value_hash]} for field '{column_name}'"
+                )
+                continue
+            first_seen[value_hash] = row_no
+            hashes.setdefault(value_hash, []).append(row_no)
+        if not hashes:
+            continue
+        
+        if compiled.physical is not None:
+            hash_column = compiled.physical.c[dynamic_table_storage.hash_column_name(column_id)]
+            existing = db.execute(select(hash_column).where(hash_column.in_(list(hashes)))).all()
+        else:
+            existing = db.query(models.DynamicTableUniqueValue.value_hash).filter(
+                models.DynamicTableUniqueValue.table_id == compiled.table_id,
+                models.DynamicTableUniqueValue.column_id == column_id,
+                models.DynamicTableUniqueValue.value_hash.in_(list(hashes))
+            ).all()
+        rows_by_no = dict(batch)
+        for (value_hash,) in existing:
+            for row_no in hashes[value_hash]:
+                errors.setdefault(row_no, {})[column_name] = (
+                    f"Value '{rows_by_no[row_no][column_name]}' already exists for field '{column_name}'"
+                )
+    return errors
+
+def insert_row_batch(db: Session, compiled: CompiledTableSchema, batch: List[Tuple[int, Dict[str, Any]]], user_id: Optional[int] = None) -> Tuple[int, Dict[int, Dict[str, str]]]:
+    """
+    Validate and insert one batch of rows in a single transaction.
+
+    `batch` holds (row number, data) pairs. Invalid rows are skipped and
+    returned as {row number: {field: error}}; the rest are inserted. Returns
+    (inserted count, errors).
+    """
+    # Re-read the definition under its write lock; the table may have been
+    # materialized (or converted back) since the caller compiled its schema
+    compiled = get_compiled_schema(db, get_table_definition_for_write(db, compiled.table_id))
+    
+    errors: Dict[int, Dict[str, str]] = {}
+    for row_no, data in batch:
+        row_errors = compiled.validate(data)
+        if row_errors:
+            errors[row_no] = row_errors
+    
+    # A concurrent writer can take a unique value between the probe and the
+    # insert; the batch is then re-checked once against the new state
+    for attempt in range(2):
+        candidates = [(row_no, data) for row_no, data in batch if row_no not in errors]
+        duplicates = _find_batch_duplicates(db, compiled, candidates)
+        valid = [(row_no, data) for row_no, data in candidates if row_no not in duplicates]
+        if not valid:
+            db.rollback()
+            return 0, {**errors, **duplicates}
+        
+        try:
+            if compiled.physical is not None:
+                physical_rows = []
+                for row_no, data in valid:
+                    try:
+                        physical_rows.append({**_physical_values(compiled, data), "created_by": user_id})
+                    except HTTPException as e:
+                        # Reported like a validation error; the rest of the batch still goes in
+                        errors[row_no] = {"_row": e.detail}
+                valid = [(row_no, data) for row_no, data in valid if row_no not in errors]
+                if not valid:
+                    db.rollback()
+                    return 0, {**errors, **duplicates}
+                db.execute(compiled.physical.insert(), physical_rows)
+                dynamic_table_stats.record_changes(db, compiled, inserted=[data for _, data in valid])
+                db.commit()
+                return len(valid), {**errors, **duplicates}
+            
+            row_ids = _insert_rows(
+                db,
+                [{"table_id": compiled.table_id, "data": data, "created_by": user_id} for _, data in valid],
+                need_ids=bool(compiled.unique_columns)
+            )
+            entries = []
+            for row_id, (_, data) in zip(row_ids, valid):
+                for column_name, column_id in compiled.unique_columns:
+                    if column_name in data:
+                        entries.append({
+                            "table_id": compiled.table_id,
+                            "column_id": column_id,
+                            "row_id": row_id,
+                            "value_hash": unique_value_hash(data[column_name])
+                        })
+            if entries:
+                db.execute(models.DynamicTableUniqueValue.__table__.insert(), entries)
+            dynamic_table_stats.record_changes(db, compiled, inserted=[data for _, data in valid])
+            db.commit()
+            return len(valid), {**errors, **duplicates}
+        except IntegrityError:
+            db.rollback()
+            if attempt:
+                raise
+            compiled = get_compiled_schema(db, get_table_definition_for_write(db, compiled.table_id))
+
 def get_table_row(db: Session, table_id: int, row_id: int):
+    table = get_table_definition(db, table_id)
+    if not table:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+    
+    compiled = get_compiled_schema(db, table)
+    if compiled.physical is not None:
+        return _physical_row(compiled, _get_physical_record(db, compiled, row_id))
+    
     row = db.query(models.DynamicTableData).filter(
         models.DynamicTableData.table_id == table_id,
         models.DynamicTableData.id == row_id
@@ -300,7 +1279,7 @@ def get_table_row(db: Session, table_id: int, row_id: int):
             detail="Row not found"
         )
     
-    return row
+    return compiled.present([row])[0]
 
 def get_table_rows(db: Session, table_id: int, skip: int = 0, limit: int = 100, 
                   filter_params: Optional[Dict[str, Any]] = None, 
@@ -314,45 +1293,140 @@ def get_table_rows(db: Session, table_id: int, skip: int = 0, limit: int = 100,
             detail="Table not found"
         )
     
-    query = db.query(models.DynamicTableData).filter(models.DynamicTableData.table_id == table_id)
+    compiled = get_compiled_schema(db, table)
+    dialect = db.get_bind().dialect.name
+    
+    # Materialized tables are queried through their typed columns
+    if compiled.physical is not None:
+        query = select(compiled.physical)
+        row_id_column = compiled.physical.c.id
+    else:
+        query = db.query(models.DynamicTableData).filter(models.DynamicTableData.table_id == table_id)
+        row_id_column = models.DynamicTableData.id
     
-    # Apply filters if provided
-    if filter_params:
-        # This is a simplified approach - in a real app, you'd need more sophisticated JSON filtering
-        for field, value in filter_params.items():
-            # For JSON fields, we need to use the -> operator in SQL
-            # This is MySQL specific syntax
-            query = query.filter(text(f"JSON_EXTRACT(data, '$.{field}') = '{value}'"))
+    # Apply filters if provided; values are bound parameters and indexed
+    # columns are read from their generated column when the column
+    # statistics say the filter is selective enough for the index to help
+    index_fields = dynamic_table_stats.selective_index_fields(db, compiled, dialect, filter_params)
+    for clause in dynamic_table_query.compile_filters(dialect, compiled.columns, filter_params, index_fields):
+        query = query.filter(clause)
     
-    # Apply sorting if provided
+    # Apply sorting if provided, with the row id as a stable tie-breaker
     if sort_field:
-        # Again, MySQL specific JSON sorting
-        if sort_direction.lower() == "desc":
-            query = query.order_by(text(f"JSON_EXTRACT(data, '$.{sort_field}') DESC"))
-        else:
-            query = query.order_by(text(f"JSON_EXTRACT(data, '$.{sort_field}') ASC"))
+        query = query.order_by(dynamic_table_query.compile_sort(dialect, compiled.columns, sort_field, sort_direction))
+    query = query.order_by(row_id_column)
     
     # Apply pagination
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if compiled.physical is not None:
+        return [_physical_row(compiled, record) for record in db.execute(query)]
+    return compiled.present(query.all())
 
-def update_table_row(db: Session, table_id: int, row_id: int, data: Dict[str, Any]):
-    # Get row
-    db_row = db.query(models.DynamicTableData).filter(
-        models.DynamicTableData.table_id == table_id,
-        models.DynamicTableData.id == row_id
-    ).first()
-    
-    if not db_row:
+def aggregate_table_rows(db: Session, table_id: int, group_by: List[str], metrics: List[Dict[str, Any]],
+                         filter_params: Optional[Dict[str, Any]] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    """Run a group-by aggregation over a table's rows in SQL and return one dict per group"""
+    table = get_table_definition(db, table_id)
+    if not table:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Row not found"
+            detail="Table not found"
         )
     
-    # Get column definitions
-    columns = get_column_definitions_by_table(db, table_id)
+    compiled = get_compiled_schema(db, table)
+    dialect = db.get_bind().dialect.name
     
-    # Validate data against schema
-    errors = validate_data_against_schema(data, columns)
+    group_exprs, metric_exprs, metric_types = dynamic_table_query.compile_aggregate(
+        dialect, compiled.columns, group_by, metrics
+    )
+    if compiled.physical is not None:
+        query = db.query(*group_exprs, *metric_exprs).select_from(compiled.physical)
+    else:
+        query = db.query(*group_exprs, *metric_exprs).select_from(models.DynamicTableData).filter(
+            models.DynamicTableData.table_id == table_id
+        )
+    index_fields = dynamic_table_stats.selective_index_fields(db, compiled, dialect, filter_params)
+    for clause in dynamic_table_query.compile_filters(dialect, compiled.columns, filter_params, index_fields):
+        query = query.filter(clause)
+    if group_exprs:
+        query = query.group_by(*group_exprs).order_by(*group_exprs)
+    
+    results = []
+    for row in query.limit(limit).all():
+        result = dict(row._mapping)
+        for alias, column_type in metric_types.items():
+            value = result[alias]
+            if isinstance(value, Decimal):
+                result[alias] = int(value) if column_type == "integer" else float(value)
+        results.append(result)
+    return results
+
+def get_table_stats(db: Session, table: models.TableDefinition) -> Optional[Dict[str, Any]]:
+    """Cached row count and column statistics of a table, or None if they were never built"""
+    return dynamic_table_stats.get_stats(db, get_compiled_schema(db, table))
+
+def rebuild_table_stats(db: Session, table_id: int) -> Dict[str, Any]:
+    """Recompute a table's statistics by scanning its rows"""
+    table = get_table_definition(db, table_id)
+    if not table:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+    compiled = get_compiled_schema(db, table)
+    dynamic_table_stats.rebuild_stats(db, compiled)
+    return dynamic_table_stats.get_stats(db, compiled)
+
+def rebuild_all_table_stats(db: Session, stale_only: bool = False) -> int:
+    """Recompute the statistics of every table, or only of stale ones; returns how many were rebuilt"""
+    if stale_only:
+        table_ids = dynamic_table_stats.stale_table_ids(db)
+    else:
+        table_ids = [table_id for (table_id,) in db.query(models.TableDefinition.id).all()]
+    for table_id in table_ids:
+        rebuild_table_stats(db, table_id)
+    return len(table_ids)
+
+def _physical_patch(compiled: CompiledTableSchema, dialect: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """SET values changing only the given fields of a materialized table row"""
+    physical = compiled.physical
+    values = {}
+    extra = {}
+    try:
+        for name, value in data.items():
+            spec = compiled.columns.get(name)
+            if spec is None or value is None:
+                extra[name] = value
+            if spec is not None:
+                values[dynamic_table_storage.value_column_name(spec.id)] = (
+                    dynamic_table_storage.to_column_value(spec.column_type, value) if value is not None else None
+                )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Row cannot be stored in typed columns: {e}"
+        ) from e
+    for column_name, column_id in compiled.unique_columns:
+        if column_name in data:
+            values[dynamic_table_storage.hash_column_name(column_id)] = unique_value_hash(data[column_name])
+    if extra:
+        values["extra"] = dynamic_table_query.json_set(dialect, func.coalesce(physical.c.extra, func.json_object()), extra)
+    return values
+
+def update_table_row(db: Session, table_id: int, row_id: int, data: Dict[str, Any], expected_version: Optional[int] = None):
+    """
+    Change the given fields of a row with a single UPDATE.
+
+    Fields are written in place (JSON_SET, or the typed columns of a
+    materialized table) instead of rewriting the whole document, so concurrent
+    updates of different fields both survive. With expected_version the update
+    only applies if the row is still at that version, otherwise a 409 is raised.
+    """
+    table = get_table_definition_for_write(db, table_id)
+    compiled = get_compiled_schema(db, table)
+    dialect = db.get_bind().dialect.name
+    
+    # Validate the fields being changed against the schema
+    errors = compiled.validate(data, partial=True)
     if errors:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -360,32 +1434,66 @@ def update_table_row(db: Session, table_id: int, row_id: int, data: Dict[str, An
         )
     
     # Check for unique constraints
-    for column in columns:
-        if column.is_unique and column.name in data:
-            # Check if value already exists in other rows
-            existing_rows = db.query(models.DynamicTableData).filter(
-                models.DynamicTableData.table_id == table_id,
-                models.DynamicTableData.id != row_id
-            ).all()
-            
-            for row in existing_rows:
-                if column.name in row.data and row.data[column.name] == data[column.name]:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail=f"Value '{data[column.name]}' already exists for field '{column.name}'"
-                    )
-    
-    # Update row
-    # Merge existing data with new data
-    updated_data = {**db_row.data, **data}
-    db_row.data = updated_data
-    db_row.updated_at = datetime.now()
+    _check_unique_values(db, compiled, data, exclude_row_id=row_id)
     
-    db.commit()
-    db.refresh(db_row)
-    return db_row
+    if compiled.physical is not None:
+        target = compiled.physical
+        statement = target.update().where(target.c.id == row_id).values(**_physical_patch(compiled, dialect, data))
+    else:
+        target = models.DynamicTableData.__table__
+        statement = target.update().where(target.c.table_id == table_id, target.c.id == row_id)
+        if data:
+            statement = statement.values(data=dynamic_table_query.json_set(dialect, target.c.data, data))
+    if expected_version is not None:
+        statement = statement.where(target.c.version == expected_version)
+    statement = statement.values(version=target.c.version + 1, updated_at=datetime.now())
+    
+    changed_column_ids = [column_id for column_name, column_id in compiled.unique_columns if column_name in data]
+    try:
+        if not db.execute(statement).rowcount:
+            db.rollback()
+            version_query = select(target.c.version).where(target.c.id == row_id)
+            if compiled.physical is None:
+                version_query = version_query.where(target.c.table_id == table_id)
+            current_version = db.execute(version_query).scalar()
+            if current_version is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Row not found"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Row was modified concurrently; current version is {current_version}"
+            )
+        if changed_column_ids and compiled.physical is None:
+            db.query(models.DynamicTableUniqueValue).filter(
+                models.DynamicTableUniqueValue.row_id == row_id,
+                models.DynamicTableUniqueValue.column_id.in_(changed_column_ids)
+            ).delete(synchronize_session=False)
+            _add_unique_values(db, compiled, row_id, data)
+        dynamic_table_stats.record_changes(db, compiled, updated=[data])
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A row with the same unique value was written concurrently"
+        ) from e
+    return get_table_row(db, table_id, row_id)
 
 def delete_table_row(db: Session, table_id: int, row_id: int):
+    table = get_table_definition_for_write(db, table_id)
+    compiled = get_compiled_schema(db, table)
+    if compiled.physical is not None:
+        # The deleted values are needed to keep the column statistics exact
+        record = _get_physical_record(db, compiled, row_id)
+        db.execute(compiled.physical.delete().where(compiled.physical.c.id == row_id))
+        dynamic_table_stats.record_changes(
+            db, compiled, deleted=[dynamic_table_storage.row_data(compiled.columns, record)]
+        )
+        db.commit()
+        return {"message": "Row deleted successfully"}
+    
     db_row = db.query(models.DynamicTableData).filter(
         models.DynamicTableData.table_id == table_id,
         models.DynamicTableData.id == row_id
@@ -397,6 +1505,10 @@ def delete_table_row(db: Session, table_id: int, row_id: int):
             detail="Row not found"
         )
     
+    db.query(models.DynamicTableUniqueValue).filter(
+        models.DynamicTableUniqueValue.row_id == row_id
+    ).delete(synchronize_session=False)
+    dynamic_table_stats.record_changes(db, compiled, deleted=[db_row.data or {}])
     db.delete(db_row)
     db.commit()
     return {"message": "Row deleted successfully"}
\ No newline at end of file
@@ -1,19 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+import csv
 import json
 
+import dynamic_table_rewrites
 import dynamic_tables
 import schemas
 from database import get_db
+from dbconfig import DYNAMIC_TABLE_CATALOGUE_CACHE
 from auth import get_current_user
 
 # Create router for dynamic tables
+# Handlers that only make synchronous database calls are plain `def`, so
+# FastAPI runs them in its threadpool instead of on the event loop
 dynamic_tables_router = APIRouter(prefix="/tables", tags=["Dynamic Tables"])
 
 # Table Definition Endpoints
 @dynamic_tables_router.post("/", response_model=schemas.TableDefinition)
-async def create_table(
+def create_table(
     table: schemas.TableDefinitionCreate,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -27,7 +34,7 @@ async def create_table(
     return dynamic_tables.create_table_definition(db, table, current_user.user_id)
 
 @dynamic_tables_router.get("/", response_model=List[schemas.TableDefinition])
-async def get_tables(
+def get_tables(
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
@@ -38,10 +45,12 @@ async def get_tables(
     
     Returns a list of all table definitions with their columns.
     """
+    if DYNAMIC_TABLE_CATALOGUE_CACHE:
+        return dynamic_tables.get_table_catalogue(db)[skip:skip + limit]
     return dynamic_tables.get_table_definitions(db, skip, limit)
 
-@dynamic_tables_router.get("/{table_id}", response_model=schemas.TableDefinition)
-async def get_table(
+@dynamic_tables_router.get("/{table_id}", response_model=schemas.TableDefinitionDetail)
+def get_table(
     table_id: int,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -49,12 +58,35 @@ async def get_table(
     """
     Get a specific table definition by ID.
     
-    Returns the table definition with all its columns.
+    Returns the table definition with all its columns, plus the cached row
+    count and per-column statistics (null count, distinct estimate, min/max).
     """
-    return dynamic_tables.get_table_definition(db, table_id)
+    table = dynamic_tables.get_table_definition_with_columns(db, table_id)
+    if not table:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Table not found"
+        )
+    detail = schemas.TableDefinitionDetail.model_validate(table)
+    detail.stats = dynamic_tables.get_table_stats(db, table)
+    return detail
+
+@dynamic_tables_router.post("/{table_id}/stats/rebuild", response_model=schemas.DynamicTableStats)
+def rebuild_table_stats(
+    table_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Recompute a table's row count and column statistics from its rows.
+    
+    Statistics are kept up to date by writes, but min/max and the distinct
+    estimate only ever widen; a rebuild tightens them again.
+    """
+    return dynamic_tables.rebuild_table_stats(db, table_id)
 
 @dynamic_tables_router.put("/{table_id}", response_model=schemas.TableDefinition)
-async def update_table(
+def update_table(
     table_id: int,
     table: schemas.TableDefinitionBase,
     db: Session = Depends(get_db),
@@ -69,7 +101,7 @@ async def update_table(
     return dynamic_tables.update_table_definition(db, table_id, table)
 
 @dynamic_tables_router.delete("/{table_id}")
-async def delete_table(
+def delete_table(
     table_id: int,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -81,9 +113,41 @@ async def delete_table(
     """
     return dynamic_tables.delete_table_definition(db, table_id)
 
+@dynamic_tables_router.post("/{table_id}/materialize", response_model=schemas.DynamicTableStorageResult)
+def materialize_table(
+    table_id: int,
+    batch_size: int = Query(1000, ge=1, le=10000, description="Rows copied per transaction"),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Move a table's rows into a physical table with typed columns.
+    
+    Use this for busy tables: filters, sorts and aggregations then run on
+    real columns with native indexes. Rows are copied in batches while the
+    table stays writable, and all row endpoints keep working unchanged.
+    """
+    return dynamic_tables.materialize_table(db, table_id, batch_size)
+
+@dynamic_tables_router.post("/{table_id}/dematerialize", response_model=schemas.DynamicTableStorageResult)
+def dematerialize_table(
+    table_id: int,
+    batch_size: int = Query(1000, ge=1, le=10000, description="Rows copied per statement"),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Move a materialized table's rows back into JSON storage.
+    
+    Writes to the table wait until the move finishes. Rows keep their ids
+    unless the id has been reused in the meantime; those are counted in
+    rows_renumbered.
+    """
+    return dynamic_tables.dematerialize_table(db, table_id, batch_size)
+
 # Column Definition Endpoints
 @dynamic_tables_router.post("/{table_id}/columns", response_model=schemas.ColumnDefinition)
-async def create_column(
+def create_column(
     table_id: int,
     column: schemas.ColumnDefinitionCreate,
     db: Session = Depends(get_db),
@@ -97,7 +161,7 @@ async def create_column(
     return dynamic_tables.create_column_definition(db, column, table_id)
 
 @dynamic_tables_router.get("/{table_id}/columns", response_model=List[schemas.ColumnDefinition])
-async def get_columns(
+def get_columns(
     table_id: int,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -110,7 +174,7 @@ async def get_columns(
     return dynamic_tables.get_column_definitions_by_table(db, table_id)
 
 @dynamic_tables_router.get("/{table_id}/columns/{column_id}", response_model=schemas.ColumnDefinition)
-async def get_column(
+def get_column(
     table_id: int,
     column_id: int,
     db: Session = Depends(get_db),
@@ -130,17 +194,20 @@ async def get_column(
     return column
 
 @dynamic_tables_router.put("/{table_id}/columns/{column_id}", response_model=schemas.ColumnDefinition)
-async def update_column(
+def update_column(
     table_id: int,
     column_id: int,
     column: schemas.ColumnDefinitionBase,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
     Update a column definition.
     
-    This endpoint allows you to update the properties of a column.
+    This endpoint allows you to update the properties of a column. When the
+    column is renamed, stored values are moved to the new name in the
+    background; see GET /{table_id}/rewrites for progress.
     """
     db_column = dynamic_tables.get_column_definition(db, column_id)
     if not db_column or db_column.table_id != table_id:
@@ -148,19 +215,24 @@ async def update_column(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Column not found in this table"
         )
-    return dynamic_tables.update_column_definition(db, column_id, column)
+    updated = dynamic_tables.update_column_definition(db, column_id, column)
+    background_tasks.add_task(dynamic_table_rewrites.run_pending_rewrites, table_id)
+    return updated
 
 @dynamic_tables_router.delete("/{table_id}/columns/{column_id}")
-async def delete_column(
+def delete_column(
     table_id: int,
     column_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
     Delete a column.
     
-    This will delete the column definition and remove the column data from all rows.
+    This deletes the column definition right away. The column data is removed
+    from the stored rows in the background, in small batches; the returned
+    rewrite_job_id can be followed at GET /{table_id}/rewrites/{job_id}.
     """
     db_column = dynamic_tables.get_column_definition(db, column_id)
     if not db_column or db_column.table_id != table_id:
@@ -168,11 +240,46 @@ async def delete_column(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Column not found in this table"
         )
-    return dynamic_tables.delete_column_definition(db, column_id)
+    result = dynamic_tables.delete_column_definition(db, column_id)
+    background_tasks.add_task(dynamic_table_rewrites.run_pending_rewrites, table_id)
+    return result
+
+@dynamic_tables_router.get("/{table_id}/rewrites", response_model=List[schemas.DynamicTableRewriteJob])
+def get_rewrite_jobs(
+    table_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Get the background row rewrites of a table, newest first.
+    
+    A rewrite is queued whenever a column is dropped or renamed.
+    """
+    return dynamic_table_rewrites.get_rewrite_jobs(db, table_id, skip, limit)
+
+@dynamic_tables_router.get("/{table_id}/rewrites/{job_id}", response_model=schemas.DynamicTableRewriteJob)
+def get_rewrite_job(
+    table_id: int,
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Get the status and progress of a background row rewrite.
+    """
+    job = dynamic_table_rewrites.get_rewrite_job(db, job_id)
+    if not job or job.table_id != table_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Rewrite job not found in this table"
+        )
+    return job
 
 # Table Data Endpoints
 @dynamic_tables_router.post("/{table_id}/data", response_model=schemas.DynamicTableData)
-async def create_row(
+def create_row(
     table_id: int,
     data: schemas.DynamicTableDataCreate,
     db: Session = Depends(get_db),
@@ -186,8 +293,137 @@ async def create_row(
     """
     return dynamic_tables.create_table_row(db, table_id, data.data, current_user.user_id)
 
+# Most row errors returned from a bulk upload; the counts stay exact
+BULK_MAX_REPORTED_ERRORS = 1000
+
+async def _iter_lines(request: Request) -> AsyncIterator[str]:
+    """Split the streamed request body into lines without buffering the whole body"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8").rstrip("\r")
+
+async def _iter_records(request: Request, upload_format: str) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Yield (row number, record, parse error) for each record in an NDJSON or CSV body.
+
+    CSV records are dicts of strings keyed by the header row; quoted CSV
+    fields may not span lines.
+    """
+    row_no = 0
+    header = None
+    async for line in _iter_lines(request):
+        if not line.strip():
+            continue
+        if upload_format == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = values
+                continue
+            row_no += 1
+            if len(values) != len(header):
+                yield row_no, None, f"Expected {len(header)} values, got {len(values)}"
+                continue
+            yield row_no, dict(zip(header, values)), None
+        else:
+            row_no += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_no, None, f"Invalid JSON: {e.msg}"
+                continue
+            if isinstance(record, dict) and isinstance(record.get("data"), dict):
+                record = record["data"]
+            if not isinstance(record, dict):
+                yield row_no, None, "Each line must be a JSON object"
+                continue
+            yield row_no, record, None
+
+@dynamic_tables_router.post("/{table_id}/data/bulk", response_model=schemas.DynamicTableBulkResult)
+async def bulk_create_rows(
+    table_id: int,
+    request: Request,
+    upload_format: Optional[str] = Query(None, alias="format", description="ndjson or csv; defaults from Content-Type"),
+    batch_size: int = Query(1000, ge=1, le=5000, description="Rows validated and inserted per transaction"),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Stream many rows into a table in one request.
+    
+    The body is NDJSON (one JSON object per line, optionally wrapped as
+    {"data": {...}}) or CSV with a header row. Rows are validated and
+    checked for uniqueness in batches, and each batch is inserted with
+    multi-row statements in its own transaction. Invalid rows are skipped
+    and reported by row number; valid rows are kept.
+    
+    The route is async only to stream the body; every database call runs
+    in the threadpool, off the event loop.
+    """
+    def load_schema():
+        table = dynamic_tables.get_table_definition(db, table_id)
+        if not table:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Table not found"
+            )
+        return dynamic_tables.get_compiled_schema(db, table)
+    
+    compiled = await run_in_threadpool(load_schema)
+    
+    if upload_format is None:
+        content_type = request.headers.get("content-type", "")
+        upload_format = "csv" if "csv" in content_type else "ndjson"
+    if upload_format not in ("ndjson", "csv"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be ndjson or csv"
+        )
+    
+    result = {"inserted": 0, "failed": 0, "errors": [], "errors_truncated": False}
+    
+    def report(row_errors: Dict[int, Dict[str, str]]):
+        result["failed"] += len(row_errors)
+        for row_no in sorted(row_errors):
+            if len(result["errors"]) >= BULK_MAX_REPORTED_ERRORS:
+                result["errors_truncated"] = True
+                break
+            result["errors"].append({"row": row_no, "errors": row_errors[row_no]})
+    
+    async def flush(batch: List[Tuple[int, Dict[str, Any]]]):
+        try:
+            inserted, row_errors = await run_in_threadpool(
+                dynamic_tables.insert_row_batch, db, compiled, batch, current_user.user_id
+            )
+        except IntegrityError:
+            inserted = 0
+            row_errors = {row_no: {"_row": "Conflicting concurrent write; batch not inserted"} for row_no, _ in batch}
+        result["inserted"] += inserted
+        report(row_errors)
+    
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    async for row_no, record, parse_error in _iter_records(request, upload_format):
+        if parse_error:
+            report({row_no: {"_row": parse_error}})
+            continue
+        if upload_format == "csv":
+            record = dynamic_tables.coerce_csv_record(compiled, record)
+        batch.append((row_no, record))
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    
+    result["errors"].sort(key=lambda error: error["row"])
+    return result
+
 @dynamic_tables_router.get("/{table_id}/data", response_model=List[schemas.DynamicTableData])
-async def get_rows(
+def get_rows(
     table_id: int,
     filter: Optional[str] = Query(None, description="JSON string of filter criteria"),
     sort: Optional[str] = Query(None, description="Field to sort by"),
@@ -202,15 +438,51 @@ async def get_rows(
     
     Returns a list of rows from the specified table.
     You can filter and sort the results using query parameters.
+    
+    `filter` maps field names to a value (equality) or to an operator object
+    such as {"eq": v}, {"in": [...]}, {"gte": a, "lt": b}, {"range": [a, b]}
+    or {"prefix": "ab"}. Filters and sorts on indexed columns use the
+    column's generated index.
     """
     skip = (page - 1) * page_size
-    filter_params = json.loads(filter) if filter else None
+    try:
+        filter_params = json.loads(filter) if filter else None
+    except json.JSONDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="filter must be valid JSON"
+        )
     return dynamic_tables.get_table_rows(
         db, table_id, skip, page_size, filter_params, sort, sort_dir
     )
 
+@dynamic_tables_router.post("/{table_id}/aggregate", response_model=schemas.DynamicTableAggregateResult)
+def aggregate_rows(
+    table_id: int,
+    query: schemas.DynamicTableAggregateQuery,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Aggregate a table's rows on the server.
+    
+    Groups rows by the `group_by` fields and computes each metric
+    (count, sum, avg, min, max) per group, after applying the same
+    `filter` syntax as the data listing. sum and avg need numeric columns.
+    Only the aggregated rows are returned.
+    """
+    rows = dynamic_tables.aggregate_table_rows(
+        db,
+        table_id,
+        query.group_by,
+        [{**metric.model_dump(), "op": metric.op.value} for metric in query.metrics],
+        query.filter,
+        query.limit
+    )
+    return {"rows": rows}
+
 @dynamic_tables_router.get("/{table_id}/data/{row_id}", response_model=schemas.DynamicTableData)
-async def get_row(
+def get_row(
     table_id: int,
     row_id: int,
     db: Session = Depends(get_db),
@@ -224,23 +496,27 @@ async def get_row(
     return dynamic_tables.get_table_row(db, table_id, row_id)
 
 @dynamic_tables_router.put("/{table_id}/data/{row_id}", response_model=schemas.DynamicTableData)
-async def update_row(
+def update_row(
     table_id: int,
     row_id: int,
     data: schemas.DynamicTableDataCreate,
+    expected_version: Optional[int] = Query(None, description="Only update if the row is still at this version"),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
     Update a row of data.
     
-    This endpoint allows you to update the data in a specific row.
-    The data must conform to the table's column definitions.
+    Only the fields sent are changed; other fields keep their current
+    values, even if another request changes them at the same time.
+    The fields sent must conform to the table's column definitions.
+    Pass expected_version (the row's `version`) to get a 409 instead of
+    overwriting a change made since the row was read.
     """
-    return dynamic_tables.update_table_row(db, table_id, row_id, data.data)
+    return dynamic_tables.update_table_row(db, table_id, row_id, data.data, expected_version)
 
 @dynamic_tables_router.delete("/{table_id}/data/{row_id}")
-async def delete_row(
+def delete_row(
     table_id: int,
     row_id: int,
     db: Session = Depends(get_db),
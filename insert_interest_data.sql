@@ -9,10 +9,10 @@ BEGIN
     DECLARE v_interest_amount DECIMAL(10,2);
     
     -- Cursor to loop through grouped payment data
+    -- Reads the per-month rollup maintained by the API instead of scanning pay
     DECLARE cur CURSOR FOR
-        SELECT user_id, chit_no, SUM(amount) AS total_amount,MAX(week_no) as weeks_paid
-        FROM mychitfund.pay
-        WHERE status = 'completed'
+        SELECT user_id, chit_no, SUM(total_amount) AS total_amount, MAX(last_week_no) as weeks_paid
+        FROM mychitfund.pay_monthly_rollup
         GROUP BY user_id, chit_no;
 
     DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = TRUE;
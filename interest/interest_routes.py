@@ -3,16 +3,18 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
 
-from database import get_db
+from database import get_db, get_read_db
 from models import InterestTracking
 from schemas import InterestTracking as InterestTrackingSchema
 from schemas import InterestTrackingCreate, InterestTrackingUpdate
 from sqlalchemy import text
+from single_flight import CoalescedRoute, coalesced
 
 router = APIRouter(
     prefix="/interest",
     tags=["interest"],
     responses={404: {"description": "Not found"}},
+    route_class=CoalescedRoute,
 )
 
 @router.post("/calculate", response_model=List[InterestTrackingSchema])
@@ -45,13 +47,14 @@ def calculate_monthly_interest(month: int, year: int, db: Session = Depends(get_
         raise HTTPException(status_code=500, detail=f"Failed to calculate interest: {str(e)}")
 
 @router.get("/", response_model=List[InterestTrackingSchema])
+@coalesced()
 def get_interest_records(
     month: Optional[int] = None,
     year: Optional[int] = None,
     user_id: Optional[int] = None,
     chit_id: Optional[int] = None,
     is_paid: Optional[bool] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get interest records with optional filtering.
@@ -76,7 +79,7 @@ def get_interest_records(
     return query.all()
 
 @router.get("/{interest_id}", response_model=InterestTrackingSchema)
-def get_interest_record(interest_id: int, db: Session = Depends(get_db)):
+def get_interest_record(interest_id: int, db: Session = Depends(get_read_db)):
     """
     Get a specific interest record by ID.
     """
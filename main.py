@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI, APIRouter, Request
+from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 
@@ -9,14 +9,18 @@ from models import create_tables
 from routes import router, auth_router, users_router, roles_router, login_history_router, chits_router
 from payments.payments_routes import payments_router
 from interest.interest_routes import router as interest_router
-from middleware import audit_middleware
+from dynamic_tables_routes import dynamic_tables_router
+from middleware import AuditMiddleware, ReplicaPinMiddleware
 from migrations import run_migrations
+import schema_capabilities
+from sql_instrumentation import SqlInstrumentationMiddleware
 
 load_dotenv()
 
 # Create tables and run migrations
 create_tables(engine)
 run_migrations()
+schema_capabilities.detect(engine)
 
 API_TITLE = os.getenv("API_TITLE", "MyChitFund API")
 API_VERSION = os.getenv("API_VERSION", "1.0.0")
@@ -33,6 +37,12 @@ app = FastAPI(
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:3001").split(",")
 CORS_ORIGINS = [origin.strip() for origin in CORS_ORIGINS]
 
+# Middleware, outermost first: CORS, SQL instrumentation, audit, replica pin.
+# All pure ASGI; add_middleware puts each new one outside the previous, so
+# they are added innermost first (see app.py for why this order).
+app.add_middleware(ReplicaPinMiddleware)
+app.add_middleware(AuditMiddleware)
+app.add_middleware(SqlInstrumentationMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
@@ -43,13 +53,6 @@ app.add_middleware(
     max_age=3600
 )
 
-# Add audit middleware
-
-
-@app.middleware("http")
-async def audit_middleware_wrapper(request: Request, call_next):
-    return await audit_middleware(request, call_next)
-
 # Custom OpenAPI schema
 
 
@@ -80,7 +83,7 @@ api_router.include_router(roles_router)
 api_router.include_router(login_history_router)
 api_router.include_router(payments_router)
 api_router.include_router(interest_router)
-# api_router.include_router(dynamic_tables_router)
+api_router.include_router(dynamic_tables_router)
 
 # Include the API router in the main app
 app.include_router(api_router)
@@ -1,49 +1,97 @@
-from fastapi import Request
-from typing import Callable, Any
+"""
+Pure ASGI middleware.
+
+These wrap the application directly instead of going through
+`@app.middleware("http")` (Starlette's BaseHTTPMiddleware), which runs every
+request in an extra task and re-streams the response body through a memory
+channel. Each one only looks at the scope and, where it has to, the
+`http.response.start` message, so streaming responses pass straight through.
+"""
+import logging
+import time
+from http.cookies import SimpleCookie
 from jose import JWTError, jwt
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from database import SessionLocal
+from database import AsyncSessionLocal, replica_engines, PRIMARY_PIN_COOKIE
+from dbconfig import REPLICA_PIN_SECONDS
 from auth import SECRET_KEY, ALGORITHM
-import crud
+import async_crud
+
+logger = logging.getLogger(__name__)
+
+
+def _is_audited_path(path: str) -> bool:
+    # Only API routes, not the docs or static files
+    return path.startswith("/api/") and not path.startswith("/api/docs") and not path.startswith("/api/redoc")
 
 
-async def audit_middleware(request: Request, call_next: Callable) -> Any:
+class AuditMiddleware:
     """
-    Middleware to add audit information to all database operations
-    
-    This middleware will be applied to all routes and will ensure that
-    created_by and updated_by fields are populated for all database operations.
+    Put the id of the user making the request in request.state.current_user_id
+    (and the name in current_user_fullname) so that created_by and updated_by
+    can be filled in. Both are None for anonymous requests or bad tokens.
     """
-    # Initialize user ID as None
-    request.state.current_user_id = None
-    
-    # Only try to extract user ID for API routes, not for docs or static files
-    path = request.url.path
-    if path.startswith("/api/") and not path.startswith("/api/docs") and not path.startswith("/api/redoc"):
-        # Try to get the current user ID from the token
-        try:
-            token = request.headers.get("Authorization", "")
-            if token and token.startswith("Bearer "):
-                token = token.replace("Bearer ", "")
-                # Decode the token
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                email = payload.get("sub")
-                
-                if email:
-                    # Get a database session
-                    db = SessionLocal()
-                    try:
-                        # Get the user by email
-                        user = crud.get_user_by_email(db, email=email)
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        state["current_user_id"] = None
+        state["current_user_fullname"] = None
+        if _is_audited_path(scope["path"]):
+            try:
+                authorization = Headers(scope=scope).get("authorization", "")
+                if authorization.startswith("Bearer "):
+                    payload = jwt.decode(authorization[len("Bearer "):], SECRET_KEY, algorithms=[ALGORITHM])
+                    email = payload.get("sub")
+                    if email:
+                        async with AsyncSessionLocal() as db:
+                            user = await async_crud.get_user_identity_by_email(db, email=email)
                         if user:
-                            request.state.current_user_id = user.user_id
-                    finally:
-                        db.close()
-        except (JWTError, Exception):
-            # If any error occurs, just continue with current_user_id as None
-            pass
-    
-    # Process the request
-    response = await call_next(request)
-    
-    return response
\ No newline at end of file
+                            state["current_user_id"] = user.user_id
+                            state["current_user_fullname"] = user.fullname
+            except JWTError:
+                # Bad or expired token: continue with current_user_id as None
+                pass
+            except SQLAlchemyError:
+                # The lookup failing shouldn't fail the request; the audit columns stay empty
+                logger.warning("Audit user lookup failed", exc_info=True)
+
+        await self.app(scope, receive, send)
+
+
+def _primary_pin_cookie() -> str:
+    cookie = SimpleCookie()
+    cookie[PRIMARY_PIN_COOKIE] = str(time.time() + REPLICA_PIN_SECONDS)
+    cookie[PRIMARY_PIN_COOKIE]["max-age"] = REPLICA_PIN_SECONDS
+    cookie[PRIMARY_PIN_COOKIE]["path"] = "/"
+    cookie[PRIMARY_PIN_COOKIE]["httponly"] = True
+    cookie[PRIMARY_PIN_COOKIE]["samesite"] = "lax"
+    return cookie.output(header="").strip()
+
+
+class ReplicaPinMiddleware:
+    """Pin a client to the primary for REPLICA_PIN_SECONDS after a successful write request"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not replica_engines or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message: Message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                MutableHeaders(scope=message).append("set-cookie", _primary_pin_cookie())
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
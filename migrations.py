@@ -1,7 +1,24 @@
+"""
+Numbered database migrations, recorded in the schema_migrations ledger.
+
+Startup reads the ledger's highest version with one query and returns right
+away when nothing is pending. Otherwise the process that gets the MySQL
+named lock applies the pending migrations in order, recording each one as it
+completes; the other workers don't wait for it and go on serving.
+
+Add new migrations at the end of MIGRATIONS with the next version number and
+never renumber or edit one that has shipped. Keep them safe to run against
+a database that already has the change, since databases that predate the
+ledger run every migration once.
+"""
 from sqlalchemy import Column, Integer, DateTime, ForeignKey, text
 from sqlalchemy.sql import func
 from database import engine
 import sqlalchemy
+import time
+
+# Named lock held by the process applying migrations
+MIGRATION_LOCK = "mychitfund_schema_migrations"
 
 
 def execute_safe(query, description):
@@ -51,151 +68,464 @@ def table_exists(table):
     except Exception:
         return False
 
-def run_migrations():
-    """Run database migrations to add audit fields to existing tables"""
-    print("Running database migrations...")
-    
-    # Check if interest_tracking table exists, if not, run the SQL script
-    if not table_exists('interest_tracking'):
+
+# Online schema change primitives
+#
+# Plain ALTER TABLE can lock a busy table for the whole copy. These run each
+# change with ALGORITHM=INSTANT or INPLACE and LOCK=NONE, which MySQL refuses
+# with an error instead of falling back to a locking copy, and move data in
+# small key-range batches with pauses in between. Batched work saves its
+# position in migration_progress, so a run that stops resumes where it left off.
+
+# Rows per backfill batch and pause between batches (seconds)
+ONLINE_BATCH_SIZE = 1000
+ONLINE_BATCH_PAUSE = 0.1
+
+
+def _execute(connection, query, params=None):
+    result = connection.execute(text(query), params or {})
+    connection.commit()
+    return result
+
+
+def alter_table_online(table, clause, description):
+    """Run ALTER TABLE without blocking writes; raises if MySQL can only do it with a lock"""
+    print(f"Executing online: {description}...")
+    with engine.connect() as connection:
         try:
-            print("Creating interest_tracking table and stored procedures...")
-            # Read the SQL script
-            with open('interest_table_and_procedure.sql', 'r') as file:
-                sql_script = file.read()
-            
-            # Split the script by delimiter
-            statements = sql_script.split('DELIMITER //')
-            
-            # Execute the first part (table creation)
-            if len(statements) > 0:
-                execute_safe(statements[0], "Creating interest_tracking table")
-            
-            # Execute stored procedures
-            if len(statements) > 1:
-                for i in range(1, len(statements)):
-                    # Split by DELIMITER ;
-                    proc_parts = statements[i].split('DELIMITER ;')
-                    if len(proc_parts) > 0:
-                        # Extract the procedure definition
-                        proc_def = proc_parts[0].strip()
-                        if proc_def:
-                            execute_safe(proc_def, f"Creating stored procedure {i}")
-            
-            print("Interest tracking table and stored procedures created successfully!")
-        except Exception as e:
-            print(f"Error creating interest tracking table: {e}")
-    
-    # Add created_at column to users table if it doesn't exist
-    if not column_exists('users', 'created_at'):
-        execute_safe("""
-            ALTER TABLE users 
-            ADD COLUMN created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        """, "Adding created_at to users table")
-    
-    # Add updated_at column to users table if it doesn't exist
-    if not column_exists('users', 'updated_at'):
-        execute_safe("""
-            ALTER TABLE users 
-            ADD COLUMN updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        """, "Adding updated_at to users table")
-    
-    # Add created_by column to users table if it doesn't exist
-    if not column_exists('users', 'created_by'):
-        execute_safe("""
-            ALTER TABLE users 
-            ADD COLUMN created_by INT,
-            ADD CONSTRAINT fk_users_created_by
-            FOREIGN KEY (created_by) REFERENCES users(user_id) ON DELETE SET NULL
-        """, "Adding created_by to users table")
-    
-    # Add updated_by column to users table if it doesn't exist
-    if not column_exists('users', 'updated_by'):
-        execute_safe("""
-            ALTER TABLE users 
-            ADD COLUMN updated_by INT,
-            ADD CONSTRAINT fk_users_updated_by
-            FOREIGN KEY (updated_by) REFERENCES users(user_id) ON DELETE SET NULL
-        """, "Adding updated_by to users table")
-    
-    # Add created_at column to chit_users table if it doesn't exist
-    if not column_exists('chit_users', 'created_at'):
-        execute_safe("""
-            ALTER TABLE chit_users 
-            ADD COLUMN created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        """, "Adding created_at to chit_users table")
-    
-    # Add updated_at column to chit_users table if it doesn't exist
-    if not column_exists('chit_users', 'updated_at'):
-        execute_safe("""
-            ALTER TABLE chit_users 
-            ADD COLUMN updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        """, "Adding updated_at to chit_users table")
-    
-    # Add created_by column to chit_users table if it doesn't exist
-    if not column_exists('chit_users', 'created_by'):
-        execute_safe("""
-            ALTER TABLE chit_users 
-            ADD COLUMN created_by INT,
-            ADD CONSTRAINT fk_chit_users_created_by
-            FOREIGN KEY (created_by) REFERENCES users(user_id) ON DELETE SET NULL
-        """, "Adding created_by to chit_users table")
-    
-    # Add updated_by column to chit_users table if it doesn't exist
-    if not column_exists('chit_users', 'updated_by'):
-        execute_safe("""
-            ALTER TABLE chit_users 
-            ADD COLUMN updated_by INT,
-            ADD CONSTRAINT fk_chit_users_updated_by
-            FOREIGN KEY (updated_by) REFERENCES users(user_id) ON DELETE SET NULL
-        """, "Adding updated_by to chit_users table")
-    
-    # Add foreign key to user_id in chit_users table if it doesn't exist
+            _execute(connection, f"ALTER TABLE {table} {clause}, ALGORITHM=INSTANT")
+        except sqlalchemy.exc.DBAPIError:
+            # Not an instant change on this server; an in-place rebuild still allows writes
+            connection.rollback()
+            _execute(connection, f"ALTER TABLE {table} {clause}, ALGORITHM=INPLACE, LOCK=NONE")
+    print(f"Successfully executed: {description}")
+
+
+def add_column_online(table, column, definition):
+    """Add a nullable column; backfill it and set defaults in separate steps"""
+    if column_exists(table, column):
+        print(f"Skipped (already exists): adding {column} to {table} table")
+        return
+    alter_table_online(table, f"ADD COLUMN {column} {definition} NULL", f"Adding {column} to {table} table")
+
+
+def index_exists(table, index):
+    """Check if an index exists on a table"""
+    with engine.connect() as connection:
+        result = connection.execute(text("""
+            SELECT COUNT(*)
+            FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = :table
+            AND INDEX_NAME = :index
+        """), {"table": table, "index": index})
+        return result.scalar() > 0
+
+
+def constraint_exists(table, constraint):
+    """Check if a named constraint exists on a table"""
+    with engine.connect() as connection:
+        result = connection.execute(text("""
+            SELECT COUNT(*)
+            FROM information_schema.TABLE_CONSTRAINTS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = :table
+            AND CONSTRAINT_NAME = :constraint
+        """), {"table": table, "constraint": constraint})
+        return result.scalar() > 0
+
+
+def add_index_online(table, index, columns, unique=False):
+    """Build an index while the table stays writable"""
+    if index_exists(table, index):
+        print(f"Skipped (already exists): index {index} on {table} table")
+        return
+    print(f"Executing online: creating index {index} on {table} table...")
+    with engine.connect() as connection:
+        _execute(connection, f"""
+            CREATE {'UNIQUE ' if unique else ''}INDEX {index} ON {table} ({columns})
+            ALGORITHM=INPLACE LOCK=NONE
+        """)
+    print(f"Successfully executed: creating index {index} on {table} table")
+
+
+def _progress(connection, name):
+    return connection.execute(
+        text("SELECT last_key, rows_done, done FROM migration_progress WHERE name = :name"),
+        {"name": name}
+    ).first()
+
+
+def _save_progress(connection, name, last_key, rows_done, done=False):
+    params = {"name": name, "last_key": last_key, "rows_done": rows_done, "done": done}
+    updated = connection.execute(text("""
+        UPDATE migration_progress
+        SET last_key = :last_key, rows_done = :rows_done, done = :done, updated_at = CURRENT_TIMESTAMP
+        WHERE name = :name
+    """), params)
+    if not updated.rowcount:
+        connection.execute(text("""
+            INSERT INTO migration_progress (name, last_key, rows_done, done)
+            VALUES (:name, :last_key, :rows_done, :done)
+        """), params)
+    connection.commit()
+
+
+def run_in_batches(name, table, key, statement, batch_size=None, pause=None):
+    """
+    Run `statement` once per key range of `table`, committing and pausing in between.
+
+    `statement` is SQL with :low and :high placeholders to be applied to the
+    rows with `key > :low AND key <= :high`. Progress is saved under `name`
+    after every batch and printed as it goes; a finished run is not repeated.
+    """
+    batch_size = batch_size or ONLINE_BATCH_SIZE
+    pause = ONLINE_BATCH_PAUSE if pause is None else pause
+    with engine.connect() as connection:
+        saved = _progress(connection, name)
+        if saved is not None and saved.done:
+            print(f"Skipped (already done): {name}")
+            return
+        last_key, rows_done = (saved.last_key, saved.rows_done) if saved is not None else (0, 0)
+        max_key = _max_key(table, key)
+
+        while last_key < max_key:
+            high = min(last_key + batch_size, max_key)
+            result = connection.execute(text(statement), {"low": last_key, "high": high})
+            rows_done += max(result.rowcount, 0)
+            last_key = high
+            _save_progress(connection, name, last_key, rows_done)
+            print(f"{name}: {last_key}/{max_key} keys ({last_key * 100 // max_key}%), {rows_done} rows changed")
+            time.sleep(pause)
+        _save_progress(connection, name, last_key, rows_done, done=True)
+
+
+def backfill_column(table, key, column, value, batch_size=None, pause=None):
+    """Fill a column's NULLs with `value` (an SQL expression) in key-range batches"""
+    run_in_batches(
+        f"backfill {table}.{column}", table, key,
+        f"UPDATE {table} SET {column} = {value} WHERE {key} > :low AND {key} <= :high AND {column} IS NULL",
+        batch_size, pause
+    )
+
+
+def _max_key(table, key):
+    with engine.connect() as connection:
+        return connection.execute(text(f"SELECT COALESCE(MAX({key}), 0) FROM {table}")).scalar()
+
+
+def add_foreign_key_online(table, constraint, column, ref_table, ref_column, on_delete=None, key=None,
+                           batch_size=None, pause=None):
+    """
+    Add a foreign key without copying the table.
+
+    MySQL only adds a foreign key in place with foreign_key_checks off, which
+    skips checking the existing rows, so they are checked here first in
+    key-range batches; raises if any row references a missing parent.
+    """
+    if constraint_exists(table, constraint):
+        print(f"Skipped (already exists): foreign key {constraint} on {table} table")
+        return
+    key = key or column
+    batch_size = batch_size or ONLINE_BATCH_SIZE
+    pause = ONLINE_BATCH_PAUSE if pause is None else pause
+
+    max_key = _max_key(table, key)
+    last_key = 0
+    with engine.connect() as connection:
+        while last_key < max_key:
+            high = min(last_key + batch_size, max_key)
+            orphans = connection.execute(text(f"""
+                SELECT COUNT(*) FROM {table} t
+                LEFT JOIN {ref_table} r ON r.{ref_column} = t.{column}
+                WHERE t.{key} > :low AND t.{key} <= :high
+                AND t.{column} IS NOT NULL AND r.{ref_column} IS NULL
+            """), {"low": last_key, "high": high}).scalar()
+            connection.rollback()
+            if orphans:
+                raise RuntimeError(
+                    f"{table}.{column} has rows referencing missing {ref_table} rows "
+                    f"({key} {last_key + 1}-{high}); fix them before adding {constraint}"
+                )
+            last_key = high
+            time.sleep(pause)
+
+    print(f"Executing online: adding foreign key {constraint} to {table} table...")
+    with engine.connect() as connection:
+        _execute(connection, "SET SESSION foreign_key_checks = 0")
+        try:
+            _execute(connection, f"""
+                ALTER TABLE {table}
+                ADD CONSTRAINT {constraint}
+                FOREIGN KEY ({column}) REFERENCES {ref_table}({ref_column})
+                {f'ON DELETE {on_delete}' if on_delete else ''},
+                ALGORITHM=INPLACE, LOCK=NONE
+            """)
+        finally:
+            _execute(connection, "SET SESSION foreign_key_checks = 1")
+    print(f"Successfully executed: adding foreign key {constraint} to {table} table")
+
+
+def _create_interest_tracking():
+    # Check if interest_tracking table exists, if not, run the SQL script
+    if table_exists('interest_tracking'):
+        return
     try:
-        print("Checking foreign key for user_id in chit_users table...")
-        with engine.connect() as connection:
-            result = connection.execute(text("""
-                SELECT COUNT(*) 
-                FROM information_schema.KEY_COLUMN_USAGE 
-                WHERE TABLE_SCHEMA = DATABASE() 
-                AND TABLE_NAME = 'chit_users' 
-                AND COLUMN_NAME = 'user_id' 
-                AND REFERENCED_TABLE_NAME = 'users'
-            """))
-        count = result.scalar()
+        print("Creating interest_tracking table and stored procedures...")
+        # Read the SQL script
+        with open('interest_table_and_procedure.sql', 'r') as file:
+            sql_script = file.read()
         
-        if count == 0:
-            execute_safe("""
-                ALTER TABLE chit_users
-                ADD CONSTRAINT fk_chit_users_user_id
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            """, "Adding foreign key to user_id in chit_users table")
-        else:
-            print("Foreign key already exists for user_id in chit_users table")
+        # Split the script by delimiter
+        statements = sql_script.split('DELIMITER //')
+        
+        # Execute the first part (table creation)
+        if len(statements) > 0:
+            execute_safe(statements[0], "Creating interest_tracking table")
+        
+        # Execute stored procedures
+        if len(statements) > 1:
+            for i in range(1, len(statements)):
+                # Split by DELIMITER ;
+                proc_parts = statements[i].split('DELIMITER ;')
+                if len(proc_parts) > 0:
+                    # Extract the procedure definition
+                    proc_def = proc_parts[0].strip()
+                    if proc_def:
+                        execute_safe(proc_def, f"Creating stored procedure {i}")
+        
+        print("Interest tracking table and stored procedures created successfully!")
     except Exception as e:
-        print(f"Error checking foreign key for user_id in chit_users table: {e}")
+        print(f"Error creating interest tracking table: {e}")
+
+
+def _add_audit_columns(table, key):
+    # Nullable columns first, then their defaults, then backfill the existing rows in batches
+    add_column_online(table, 'created_at', 'DATETIME')
+    add_column_online(table, 'updated_at', 'DATETIME')
+    alter_table_online(
+        table, "MODIFY COLUMN created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP",
+        f"Setting created_at default on {table} table"
+    )
+    alter_table_online(
+        table, "MODIFY COLUMN updated_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP",
+        f"Setting updated_at default on {table} table"
+    )
+    backfill_column(table, key, 'created_at', 'CURRENT_TIMESTAMP')
+    backfill_column(table, key, 'updated_at', 'created_at')
     
-    # Make email column nullable in users table
-    try:
-        print("Making email column nullable in users table...")
-        execute_safe("""
-            ALTER TABLE users 
-            MODIFY COLUMN email VARCHAR(100) NULL
-        """, "Making email column nullable in users table")
-    except Exception as e:
-        print(f"Error making email column nullable: {e}")
+    # Foreign keys last, once the columns exist
+    for column in ('created_by', 'updated_by'):
+        add_column_online(table, column, 'INT')
+        add_foreign_key_online(table, f"fk_{table}_{column}", column, 'users', 'user_id', on_delete='SET NULL', key=key)
+
+
+def _add_chit_users_user_fk():
+    # Add foreign key to user_id in chit_users table if it doesn't exist
+    print("Checking foreign key for user_id in chit_users table...")
+    with engine.connect() as connection:
+        result = connection.execute(text("""
+            SELECT COUNT(*) 
+            FROM information_schema.KEY_COLUMN_USAGE 
+            WHERE TABLE_SCHEMA = DATABASE() 
+            AND TABLE_NAME = 'chit_users' 
+            AND COLUMN_NAME = 'user_id' 
+            AND REFERENCED_TABLE_NAME = 'users'
+        """))
+        count = result.scalar()
     
-    # Make aadhar column nullable in users table
+    if count == 0:
+        add_foreign_key_online('chit_users', 'fk_chit_users_user_id', 'user_id', 'users', 'user_id', key='chit_id')
+    else:
+        print("Foreign key already exists for user_id in chit_users table")
+
+
+def _add_table_schema_version():
+    if table_exists('table_definitions') and not column_exists('table_definitions', 'schema_version'):
+        alter_table_online(
+            'table_definitions', "ADD COLUMN schema_version INT NOT NULL DEFAULT 1",
+            "Adding schema_version to table_definitions table"
+        )
+
+
+def _add_physical_table():
+    if table_exists('table_definitions'):
+        add_column_online('table_definitions', 'physical_table', 'VARCHAR(64)')
+
+
+def _add_row_version():
+    # Add version column to dynamic_table_data and materialized tables if it doesn't exist
+    if table_exists('dynamic_table_data') and not column_exists('dynamic_table_data', 'version'):
+        alter_table_online(
+            'dynamic_table_data', "ADD COLUMN version INT NOT NULL DEFAULT 1",
+            "Adding version to dynamic_table_data table"
+        )
+    if table_exists('table_definitions') and column_exists('table_definitions', 'physical_table'):
+        with engine.connect() as connection:
+            physical_tables = [row[0] for row in connection.execute(text(
+                "SELECT physical_table FROM table_definitions WHERE physical_table IS NOT NULL"
+            ))]
+        for physical_table in physical_tables:
+            if not column_exists(physical_table, 'version'):
+                alter_table_online(
+                    physical_table, "ADD COLUMN version INT NOT NULL DEFAULT 1",
+                    f"Adding version to {physical_table} table"
+                )
+
+
+def _add_indexed_column():
+    if table_exists('column_definitions'):
+        add_column_online('column_definitions', 'indexed_column', 'VARCHAR(64)')
+
+
+def _make_user_contact_nullable():
+    alter_table_online('users', "MODIFY COLUMN email VARCHAR(100) NULL", "Making email column nullable in users table")
+    alter_table_online('users', "MODIFY COLUMN aadhar VARCHAR(20) NULL", "Making aadhar column nullable in users table")
+
+
+def _find_duplicates(table, columns):
+    """Up to 5 values of `columns` that more than one row of `table` shares"""
+    with engine.connect() as connection:
+        return connection.execute(text(f"""
+            SELECT {columns}, COUNT(*) AS copies FROM {table}
+            GROUP BY {columns} HAVING COUNT(*) > 1 LIMIT 5
+        """)).fetchall()
+
+
+def _add_hot_path_indexes():
+    # Composite indexes matching the filters and joins of the crud hot paths;
+    # the same indexes are declared in models.py for new databases. The unique
+    # pay_details index has a migration of its own, since it may need a dedupe first
+    add_index_online('chit_users', 'ix_chit_users_user_id_amount', 'user_id, amount')
+    add_index_online('chit_users', 'ix_chit_users_user_id_chit_no', 'user_id, chit_no')
+    add_index_online('pay', 'ix_pay_user_id_chit_no_week_no', 'user_id, chit_no, week_no')
+    add_index_online('pay', 'ix_pay_transaction_id', 'transaction_id')
+    add_index_online('user_login_history', 'ix_user_login_history_user_id_login_date', 'user_id, login_date')
+
+
+def _dedupe_pay_details():
+    """
+    Merge pay_details rows that share a (chit_id, week) into the one with the lowest details_id.
+
+    The kept row is marked paid if any of the merged rows was.
+    """
+    duplicates = _find_duplicates('pay_details', 'chit_id, week')
+    if not duplicates:
+        return
+    print(f"Merging duplicate pay_details rows, e.g. (chit_id, week, copies) {duplicates}...")
+    groups = """
+        SELECT chit_id, week, MIN(details_id) AS keep_id, MAX(is_paid = 'Y') AS paid
+        FROM pay_details WHERE chit_id IS NOT NULL
+        GROUP BY chit_id, week HAVING COUNT(*) > 1
+    """
+    with engine.connect() as connection:
+        _execute(connection, f"""
+            UPDATE pay_details kept JOIN ({groups}) d ON kept.details_id = d.keep_id
+            SET kept.is_paid = 'Y' WHERE d.paid = 1
+        """)
+        removed = _execute(connection, f"""
+            DELETE extra FROM pay_details extra JOIN ({groups}) d
+            ON extra.chit_id = d.chit_id AND extra.week = d.week AND extra.details_id <> d.keep_id
+        """).rowcount
+    print(f"Removed {removed} duplicate pay_details rows")
+
+
+def _add_pay_details_unique_week():
+    # A row written twice between the dedupe and the index build fails the
+    # build; running the migrations again merges it and retries
+    if not index_exists('pay_details', 'uq_pay_details_chit_id_week'):
+        _dedupe_pay_details()
+    add_index_online('pay_details', 'uq_pay_details_chit_id_week', 'chit_id, week', unique=True)
+
+
+# (version, description, function), in the order they are applied
+MIGRATIONS = [
+    (1, "Create interest_tracking table and stored procedures", _create_interest_tracking),
+    (2, "Add audit columns to users", lambda: _add_audit_columns('users', 'user_id')),
+    (3, "Add audit columns to chit_users", lambda: _add_audit_columns('chit_users', 'chit_id')),
+    (4, "Add foreign key from chit_users.user_id to users", _add_chit_users_user_fk),
+    (5, "Add schema_version to table_definitions", _add_table_schema_version),
+    (6, "Add physical_table to table_definitions", _add_physical_table),
+    (7, "Add version to dynamic table rows", _add_row_version),
+    (8, "Add indexed_column to column_definitions", _add_indexed_column),
+    (9, "Make users.email and users.aadhar nullable", _make_user_contact_nullable),
+    (10, "Add composite indexes for crud hot paths", _add_hot_path_indexes),
+    (11, "Merge duplicate pay_details weeks and make (chit_id, week) unique", _add_pay_details_unique_week),
+]
+
+
+def current_version():
+    """Highest migration version recorded in the ledger, 0 if there is no ledger yet"""
     try:
-        print("Making aadhar column nullable in users table...")
-        execute_safe("""
-            ALTER TABLE users 
-            MODIFY COLUMN aadhar VARCHAR(20) NULL
-        """, "Making aadhar column nullable in users table")
-    except Exception as e:
-        print(f"Error making aadhar column nullable: {e}")
-    
-    print("Database migrations completed")
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+    except Exception:
+        return 0
+
+
+def _create_ledger(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    # Position of batched steps, so an interrupted migration resumes
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS migration_progress (
+            name VARCHAR(191) NOT NULL PRIMARY KEY,
+            last_key BIGINT NOT NULL DEFAULT 0,
+            rows_done BIGINT NOT NULL DEFAULT 0,
+            done BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    connection.commit()
 
 
+def _record_migration(version, description):
+    with engine.connect() as connection:
+        connection.execute(
+            text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+            {"version": version, "description": description}
+        )
+        connection.commit()
+
+
+def run_migrations():
+    """Apply pending migrations, unless another process is already applying them"""
+    latest = MIGRATIONS[-1][0]
+    if current_version() >= latest:
+        print(f"Database schema is up to date (version {latest})")
+        return
+    
+    with engine.connect() as lock_connection:
+        # Don't wait: the process holding the lock brings the schema up to date
+        acquired = lock_connection.execute(
+            text("SELECT GET_LOCK(:name, 0)"), {"name": MIGRATION_LOCK}
+        ).scalar()
+        if not acquired:
+            print("Another process is applying database migrations; skipping")
+            return
+        try:
+            _create_ledger(lock_connection)
+            # Re-read under the lock, another process may have just finished
+            version = current_version()
+            for number, description, migrate in MIGRATIONS:
+                if number <= version:
+                    continue
+                print(f"Applying migration {number}: {description}...")
+                try:
+                    migrate()
+                except Exception as e:
+                    # Later migrations may depend on this one; all of them are retried on the next start
+                    print(f"Migration {number} failed and will be retried on the next start: {e}")
+                    break
+                _record_migration(number, description)
+            print("Database migrations completed")
+        finally:
+            lock_connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK})
+
 if __name__ == "__main__":
     run_migrations()
\ No newline at end of file
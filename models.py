@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey, JSON, LargeBinary, UniqueConstraint, Text, Float, Index
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from database import Base
 import enum
@@ -11,21 +11,28 @@ class User(Base):
     fullname = Column(String(100), nullable=False, index=True)
     email = Column(String(100), nullable=True, unique=True, index=True)  # Made optional
     phone = Column(String(20), nullable=False, unique=True, index=True)  # Mandatory
-    aadhar = Column(String(20), nullable=True, unique=False, index=False)  # Made optional
-    dob = Column(Date, nullable=False)
-    password = Column(String(100), nullable=False)
-    pin = Column(Integer, nullable=True)
+    # Sensitive columns are only loaded when asked for: the profile group by the
+    # profile endpoints, the password by authentication
+    aadhar = deferred(Column(String(20), nullable=True, unique=False, index=False), group="profile")  # Made optional
+    dob = deferred(Column(Date, nullable=False), group="profile")
+    password = deferred(Column(String(100), nullable=False), group="credentials")
+    pin = deferred(Column(Integer, nullable=True), group="profile")
     role = Column(String(20), nullable=False)
     created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
-    # created_by = Column(String(100), ForeignKey("users.fullname", ondelete="SET NULL", name="fk_users_created_by", use_alter=True), nullable=True)
-    # updated_by = Column(String(100), ForeignKey("users.fullname", ondelete="SET NULL", name="fk_users_updated_by", use_alter=True), nullable=True)
+    # Added by migrations, so older databases may not have them: never loaded,
+    # and only set where schema_capabilities found them (see set_audit_columns)
+    created_by = deferred(Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_users_created_by", use_alter=True), nullable=True), group="audit")
+    updated_by = deferred(Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_users_updated_by", use_alter=True), nullable=True), group="audit")
     
     
     # Self-referential relationships
     # created_by_user = relationship("User", foreign_keys=[created_by], remote_side=[user_id], backref="created_users")
     # updated_by_user = relationship("User", foreign_keys=[updated_by], remote_side=[user_id], backref="updated_users")
 
+# Columns of the lean user projections: enough to identify and authorize a user
+USER_IDENTITY_COLUMNS = (User.user_id, User.email, User.fullname, User.role)
+
 class ColumnType(enum.Enum):
     STRING = "string"
     INTEGER = "integer"
@@ -36,68 +43,148 @@ class ColumnType(enum.Enum):
     TEXT = "text"
     JSON = "json"
 
-# class TableDefinition(Base):
-#     __tablename__ = "table_definitions"
+class TableDefinition(Base):
+    __tablename__ = "table_definitions"
 
-#     id = Column(Integer, primary_key=True, index=True)
-#     name = Column(String(100), nullable=False, unique=True, index=True)
-#     description = Column(String(255), nullable=True)
-#     created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
-#     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
-#     # created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
-#     # updated_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False, unique=True, index=True)
+    description = Column(String(255), nullable=True)
+    schema_version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on every definition or column change
+    physical_table = Column(String(64), nullable=True)  # Set while the rows live in their own materialized table
+    created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
+    created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_table_definitions_created_by", use_alter=True), nullable=True)
+    # updated_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
 
-#     # Relationships
-#     columns = relationship("ColumnDefinition", back_populates="table", cascade="all, delete-orphan")
+    # Relationships
+    columns = relationship("ColumnDefinition", back_populates="table", cascade="all, delete-orphan")
     # creator = relationship("User", foreign_keys=[created_by])
     # updater = relationship("User", foreign_keys=[updated_by])
 
-# class ColumnDefinition(Base):
-#     __tablename__ = "column_definitions"
-
-#     id = Column(Integer, primary_key=True, index=True)
-#     table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), nullable=False)
-#     name = Column(String(100), nullable=False)
-#     description = Column(String(255), nullable=True)
-#     column_type = Column(String(50), nullable=False)  # Uses ColumnType enum values
-#     is_required = Column(Boolean, default=False)
-#     is_unique = Column(Boolean, default=False)
-#     is_primary_key = Column(Boolean, default=False)
-#     is_index = Column(Boolean, default=False)
-#     default_value = Column(String(255), nullable=True)
-#     max_length = Column(Integer, nullable=True)  # For string/text types
-#     created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
-#     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
-#     # created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
-#     # updated_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
+class ColumnDefinition(Base):
+    __tablename__ = "column_definitions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), nullable=False)
+    name = Column(String(100), nullable=False)
+    description = Column(String(255), nullable=True)
+    column_type = Column(String(50), nullable=False)  # Uses ColumnType enum values
+    is_required = Column(Boolean, default=False)
+    is_unique = Column(Boolean, default=False)
+    is_primary_key = Column(Boolean, default=False)
+    is_index = Column(Boolean, default=False)
+    default_value = Column(String(255), nullable=True)
+    max_length = Column(Integer, nullable=True)  # For string/text types
+    indexed_column = Column(String(64), nullable=True)  # Generated column on dynamic_table_data backing is_index
+    created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
+    # created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
+    # updated_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
     
-#     # Relationships
-#     # creator = relationship("User", foreign_keys=[created_by])
-#     # updater = relationship("User", foreign_keys=[updated_by])
-
-#     # Relationships
-#     table = relationship("TableDefinition", back_populates="columns")
-
-#     __table_args__ = (
-#         # Ensure column names are unique within a table
-#         {'sqlite_autoincrement': True},
-#     )
-
-# class DynamicTableData(Base):
-#     __tablename__ = "dynamic_table_data"
-
-#     id = Column(Integer, primary_key=True, index=True)
-#     table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), nullable=False)
-#     data = Column(JSON, nullable=False)  # Stores the row data as JSON
-#     created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
-#     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
-#     # created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
-#     # updated_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
-
-#     # Relationships
-#     table = relationship("TableDefinition")
-#     # creator = relationship("User", foreign_keys=[created_by])
-#     # updater = relationship("User", foreign_keys=[updated_by])
+    # Relationships
+    # creator = relationship("User", foreign_keys=[created_by])
+    # updater = relationship("User", foreign_keys=[updated_by])
+
+    # Relationships
+    table = relationship("TableDefinition", back_populates="columns")
+
+    __table_args__ = (
+        # Ensure column names are unique within a table
+        {'sqlite_autoincrement': True},
+    )
+
+class DynamicTableData(Base):
+    __tablename__ = "dynamic_table_data"
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), nullable=False)
+    data = Column(JSON, nullable=False)  # Stores the row data as JSON
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on every update, for optimistic concurrency
+    created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
+    created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_dynamic_table_data_created_by", use_alter=True), nullable=True)
+    # updated_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
+
+    # Relationships
+    table = relationship("TableDefinition")
+    # creator = relationship("User", foreign_keys=[created_by])
+    # updater = relationship("User", foreign_keys=[updated_by])
+
+class DynamicTableUniqueValue(Base):
+    __tablename__ = "dynamic_table_unique_values"
+
+    # One entry per unique column value; the unique key turns duplicate checks into an index probe
+    id = Column(Integer, primary_key=True, index=True)
+    table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), nullable=False)
+    column_id = Column(Integer, ForeignKey("column_definitions.id", ondelete="CASCADE"), nullable=False)
+    row_id = Column(Integer, ForeignKey("dynamic_table_data.id", ondelete="CASCADE"), nullable=False, index=True)
+    value_hash = Column(String(64), nullable=False)  # sha256 of the canonical JSON value
+
+    __table_args__ = (
+        UniqueConstraint("table_id", "column_id", "value_hash", name="uq_dynamic_unique_value"),
+    )
+
+class DynamicTableStats(Base):
+    __tablename__ = "dynamic_table_stats"
+
+    # Kept up to date by row writes; rebuilt on demand by scanning the rows
+    table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), primary_key=True)
+    row_count = Column(Integer, nullable=False, default=0)
+    modifications = Column(Integer, nullable=False, default=0)  # Updates and deletes since the last rebuild
+    rebuilt_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
+
+class DynamicTableColumnStats(Base):
+    __tablename__ = "dynamic_table_column_stats"
+
+    column_id = Column(Integer, ForeignKey("column_definitions.id", ondelete="CASCADE"), primary_key=True)
+    table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), nullable=False, index=True)
+    non_null_count = Column(Integer, nullable=False, default=0)
+    min_value = Column(JSON, nullable=True)
+    max_value = Column(JSON, nullable=True)
+    sketch = Column(LargeBinary, nullable=True)  # HyperLogLog registers behind the distinct estimate
+
+class DynamicTableRewriteJob(Base):
+    __tablename__ = "dynamic_table_rewrite_jobs"
+
+    # Background rewrite of stored rows after a column is dropped or renamed
+    id = Column(Integer, primary_key=True, index=True)
+    table_id = Column(Integer, ForeignKey("table_definitions.id", ondelete="CASCADE"), nullable=False, index=True)
+    operation = Column(String(10), nullable=False)  # drop or rename
+    field = Column(String(100), nullable=False)
+    new_field = Column(String(100), nullable=True)
+    status = Column(String(10), nullable=False, default="pending", index=True)  # pending, running, completed, failed
+    max_row_id = Column(Integer, nullable=False, default=0)  # Rows above this were written after the change
+    last_row_id = Column(Integer, nullable=False, default=0)  # Resume point
+    rows_total = Column(Integer, nullable=False, default=0)
+    rows_scanned = Column(Integer, nullable=False, default=0)
+    rows_rewritten = Column(Integer, nullable=False, default=0)
+    error = Column(String(255), nullable=True)
+    created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
+    finished_at = Column(DateTime, nullable=True)
+
+    @property
+    def progress(self):
+        if self.status == "completed":
+            return 1.0
+        return min(self.rows_scanned / self.rows_total, 1.0) if self.rows_total else 0.0
+
+class SlowQuery(Base):
+    __tablename__ = "slow_queries"
+
+    # One row per normalized statement that ran over SLOW_QUERY_MS
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String(40), nullable=False, unique=True, index=True)  # sha1 of the statement
+    statement = Column(Text, nullable=False)  # Literals replaced by ?
+    sample_parameters = Column(JSON, nullable=True)  # Redacted to type names
+    calls = Column(Integer, nullable=False, default=0)
+    total_ms = Column(Float, nullable=False, default=0)
+    max_ms = Column(Float, nullable=False, default=0)
+    plan = Column(JSON, nullable=True)  # EXPLAIN output, taken once
+    explained_at = Column(DateTime, nullable=True)
+    first_seen = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
+    last_seen = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
 
 def create_tables(engine):
     """
@@ -114,14 +201,21 @@ class Chit_users(Base):
     amount = Column(Integer, nullable=True)
     created_at = Column(DateTime, server_default=func.now()) # pylint: disable=E1102
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
-    # created_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_chit_users_created_by", use_alter=True), nullable=True)
-    # updated_by = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_chit_users_updated_by", use_alter=True), nullable=True)
+    # Added by migrations, like the users audit columns
+    created_by = deferred(Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_chit_users_created_by", use_alter=True), nullable=True), group="audit")
+    updated_by = deferred(Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_chit_users_updated_by", use_alter=True), nullable=True), group="audit")
     
     # Relationships
     user = relationship("User", foreign_keys=[user_id])
     # creator = relationship("User", foreign_keys=[created_by])
     # updater = relationship("User", foreign_keys=[updated_by])
 
+    __table_args__ = (
+        # get_chit_by_user_id_and_chit_no and create_payment lookups; both also cover the user_id foreign key
+        Index("ix_chit_users_user_id_amount", "user_id", "amount"),
+        Index("ix_chit_users_user_id_chit_no", "user_id", "chit_no"),
+    )
+
 class Pay_details(Base):
     __tablename__ = "pay_details"
 
@@ -139,6 +233,11 @@ class Pay_details(Base):
     # creator = relationship("User", foreign_keys=[created_by])
     # updater = relationship("User", foreign_keys=[updated_by])
 
+    __table_args__ = (
+        # One row per chit week; serves update_pay_detail and the transaction history join
+        Index("uq_pay_details_chit_id_week", "chit_id", "week", unique=True),
+    )
+
 class Payment(Base):
     __tablename__ = "pay"
 
@@ -164,6 +263,27 @@ class Payment(Base):
     creator = relationship("User", foreign_keys=[created_by])
     updater = relationship("User", foreign_keys=[updated_by])
 
+    __table_args__ = (
+        # Transaction history joins payments on (user_id, chit_no, week_no)
+        Index("ix_pay_user_id_chit_no_week_no", "user_id", "chit_no", "week_no"),
+        Index("ix_pay_transaction_id", "transaction_id"),
+    )
+
+class PayMonthlyRollup(Base):
+    __tablename__ = "pay_monthly_rollup"
+
+    # One row per chit per calendar month, maintained by crud on every payment write
+    chit_id = Column(Integer, ForeignKey("chit_users.chit_id", ondelete="CASCADE", name="fk_pay_rollup_chit_id", use_alter=True), primary_key=True, nullable=False)
+    year = Column(Integer, primary_key=True, nullable=False)
+    month = Column(Integer, primary_key=True, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    chit_no = Column(Integer, nullable=False)
+    total_amount = Column(Integer, nullable=False, default=0)  # Sum of completed payments
+    weeks_paid = Column(Integer, nullable=False, default=0)    # Number of completed payments, not distinct weeks
+    last_week_no = Column(Integer, nullable=True)              # Highest week_no paid
+    last_paid_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # pylint: disable=E1102
+
 class Role(Base):
     __tablename__ = "roles"
    
@@ -188,6 +308,11 @@ class UserLoginHistory(Base):
     
     # Relationship to User
     user = relationship("User", foreign_keys=[user_id])
+
+    __table_args__ = (
+        # Login history of one user, newest first
+        Index("ix_user_login_history_user_id_login_date", "user_id", "login_date"),
+    )
  
 
 class InterestTracking(Base):
@@ -126,3 +126,17 @@ class TransactionHistoryResponse(BaseModel):
     class Config:
         from_attributes = True
         arbitrary_types_allowed = True
+
+class PayMonthlyRollupResponse(BaseModel):
+    chit_id: int
+    year: int
+    month: int
+    user_id: int
+    chit_no: int
+    total_amount: int
+    weeks_paid: int
+    last_week_no: Optional[int] = None
+    last_paid_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
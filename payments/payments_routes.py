@@ -8,7 +8,7 @@ from payments import payment_schemas
 
 import crud
 import models
-from database import get_db
+from database import get_db, get_read_db
 from auth import (
     authenticate_user,
     create_access_token,
@@ -16,16 +16,20 @@ from auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from utils import get_current_user_id
+from response_cache import cached
+from single_flight import CoalescedRoute, coalesced
 # Payments router
-payments_router = APIRouter(prefix="/payments", tags=["Payments"])
+payments_router = APIRouter(prefix="/payments", tags=["Payments"], route_class=CoalescedRoute)
 
 @payments_router.get("/chits/", response_model=list[payment_schemas.ChitSchemaBase])
-def chit_list_read(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@cached(ttl=60, tags=("chits",))
+def chit_list_read(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     chit_list = crud.get_chit_list(db, skip=skip, limit=limit)
     return chit_list
 
 @payments_router.get("/chits/user/{user_id}", response_model=list[payment_schemas.ChitUserResponse])
-def get_user_chits(user_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@cached(ttl=60, tags=("chits",))
+def get_user_chits(user_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     # Check if user exists
     db_user = crud.get_user(db, user_id=user_id)
     if db_user is None:
@@ -75,7 +79,8 @@ def create_pay_details(
         )
 
 @payments_router.get("/chit_users/{chit_id}/pay_details/",response_model=List[payment_schemas.PayDetailResponse])
-def read_pay_details(chit_id: int,db: Session = Depends(get_db), current_user_id: Optional[int] = Depends(get_current_user_id)):
+@cached(ttl=60, tags=("pay_details:{chit_id}",))
+def read_pay_details(chit_id: int,db: Session = Depends(get_read_db), current_user_id: Optional[int] = Depends(get_current_user_id)):
     pay_details = crud.get_pay_details(db=db, chit_id=chit_id)
     if not pay_details:
         raise HTTPException(status_code=404, detail="Pay details not found")
@@ -149,11 +154,42 @@ def create_payment(
     # Create the payment
     return crud.create_payment(db=db, payment=payment, current_user_id=current_user_id)
 
+@payments_router.patch("/{pay_id}/status", response_model=payment_schemas.PaymentResponse)
+def update_payment_status(
+    pay_id: int,
+    payment_status: str,
+    db: Session = Depends(get_db),
+    current_user_id: Optional[int] = Depends(get_current_user_id)
+):
+    """Change a payment's status (completed/pending/failure) and keep the monthly rollup in step"""
+    if payment_status not in ['completed', 'pending', 'failure']:
+        raise HTTPException(status_code=400, detail="payment_status must be one of completed, pending or failure")
+    return crud.update_payment_status(db=db, pay_id=pay_id, payment_status=payment_status, current_user_id=current_user_id)
+
+@payments_router.get("/rollup/", response_model=List[payment_schemas.PayMonthlyRollupResponse])
+def read_pay_rollups(
+    user_id: Optional[int] = None,
+    chit_no: Optional[int] = None,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db),
+    current_user_id: Optional[int] = Depends(get_current_user_id)
+):
+    """
+    Get per-chit monthly payment totals.
+    
+    Served from the pay_monthly_rollup table, so reports do not have to
+    re-aggregate the pay table.
+    """
+    return crud.get_pay_rollups(db=db, user_id=user_id, chit_no=chit_no, year=year, month=month, skip=skip, limit=limit)
+
 @payments_router.get("/", response_model=List[payment_schemas.PaymentResponse])
 def read_payments(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user_id: Optional[int] = Depends(get_current_user_id)
 ):
     """Get all payments"""
@@ -163,7 +199,7 @@ def read_payments(
 @payments_router.get("/transaction/{transaction_id}", response_model=List[payment_schemas.PaymentResponse])
 def read_payments_by_transaction_id(
     transaction_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user_id: Optional[int] = Depends(get_current_user_id)
 ):
     """Get all payments with the same transaction ID prefix"""
@@ -175,7 +211,7 @@ def read_payments_by_transaction_id(
 @payments_router.get("/{pay_id}", response_model=payment_schemas.PaymentResponse)
 def read_payment(
     pay_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user_id: Optional[int] = Depends(get_current_user_id)
 ):
     """Get a specific payment by ID"""
@@ -189,7 +225,7 @@ def read_user_payments(
     user_id: int,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user_id: Optional[int] = Depends(get_current_user_id)
 ):
     """Get all payments for a specific user"""
@@ -202,12 +238,13 @@ def read_user_payments(
     return payments
 
 @payments_router.get("/transaction-history/", response_model=List[payment_schemas.TransactionHistoryResponse])
+@coalesced()
 def get_transaction_history(
     user_id: Optional[int] = None,
     chit_no: Optional[int] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user_id: Optional[int] = Depends(get_current_user_id)
 ):
     """
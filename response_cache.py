@@ -0,0 +1,309 @@
+"""
+Route-level response cache.
+
+A GET route opts in with the `cached` decorator, placed under the router
+decorator, on a router created with `route_class=CachedRoute`:
+
+    @roles_router.get("/", response_model=List[schemas.Role])
+    @cached(ttl=300, tags=("roles",))
+    def read_roles(...):
+
+The rendered response body is stored under a key made of the route, its path
+and query parameters and, with `per_user=True`, the user the bearer token
+belongs to. A hit is answered without running the route's dependencies, so
+no session is opened and no query runs. Routes that depend on
+`get_current_user` still need a valid, non-blacklisted token to be served
+from the cache; without one the route runs and rejects the request itself.
+
+Tags name the data a response was built from; they may refer to path
+parameters ("pay_details:{chit_id}"). The crud functions that change that
+data call `invalidate` with the same tags after they commit. A response
+whose computation started less than REPLICA_PIN_SECONDS before the latest
+invalidation of one of its tags is not stored: it may have been read
+before the commit, or from a replica that hadn't caught up yet. Clients
+pinned to the primary after a write bypass the cache altogether, so they
+read their own writes. The TTL bounds what is left, such as a replica
+lagging by more than REPLICA_PIN_SECONDS.
+
+RESPONSE_CACHE_BACKEND picks where responses live:
+
+- "memory": an LRU of RESPONSE_CACHE_MAX_ENTRIES in each worker. Writes only
+  invalidate the worker that made them, so other workers may serve a stale
+  response for up to the TTL; use it with a single worker.
+- "redis": shared by every worker through REDIS_URL, with invalidation seen
+  by all of them. A cache error is logged and the route runs as if uncached.
+- "off" (default): no caching.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from jose import JWTError, jwt
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+import auth
+from database import is_pinned_to_primary
+from dbconfig import REDIS_URL, REPLICA_PIN_SECONDS, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "response_cache:"
+
+# (media type, body)
+Entry = Tuple[str, bytes]
+
+# Longest TTL of any cached route
+_max_ttl = 0
+
+
+class MemoryBackend:
+    """LRU of cached responses in this worker, with per-entry expiry"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Entry, Tuple[str, ...]]]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        # tag -> time.time() of its latest invalidation, kept for REPLICA_PIN_SECONDS
+        self._invalidated: Dict[str, float] = {}
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, entry: Entry, ttl: int, tags: Iterable[str]):
+        tags = tuple(tags)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, entry, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags: Iterable[str]):
+        now = time.time()
+        with self._lock:
+            for tag in tags:
+                self._invalidated[tag] = now
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+            for tag, at in list(self._invalidated.items()):
+                if at < now - REPLICA_PIN_SECONDS:
+                    del self._invalidated[tag]
+
+    def invalidated_after(self, tags: Iterable[str], since: float) -> bool:
+        """Whether any of `tags` was invalidated after `since` (a time.time())"""
+        with self._lock:
+            return any(self._invalidated.get(tag, 0) > since for tag in tags)
+
+    def _remove(self, key: str):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        for tag in item[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisBackend:
+    """
+    Cached responses in Redis, shared by every worker. Each tag is a set of
+    the keys stored under it; invalidating a tag deletes those keys.
+
+    `client` is any redis-py compatible client (fakeredis works as a local
+    stand-in); by default one is created from `url`.
+    """
+
+    def __init__(self, url: str = None, client=None):
+        if client is None:
+            import redis
+            # Short timeouts: an unreachable Redis should cost a miss, not a hung request
+            client = redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        self.client = client
+
+    def get(self, key: str) -> Optional[Entry]:
+        value = self.client.get(KEY_PREFIX + key)
+        if value is None:
+            return None
+        media_type, _, body = value.partition(b"\n")
+        return media_type.decode(), body
+
+    def set(self, key: str, entry: Entry, ttl: int, tags: Iterable[str]):
+        media_type, body = entry
+        pipe = self.client.pipeline()
+        pipe.set(KEY_PREFIX + key, media_type.encode() + b"\n" + body, ex=ttl)
+        for tag in tags:
+            # Outlive every key added to the tag, whichever route stored it
+            pipe.sadd(KEY_PREFIX + "tag:" + tag, key)
+            pipe.expire(KEY_PREFIX + "tag:" + tag, max(ttl, _max_ttl))
+        pipe.execute()
+
+    def invalidate(self, tags: Iterable[str]):
+        now = time.time()
+        for tag in tags:
+            tag_key = KEY_PREFIX + "tag:" + tag
+            pipe = self.client.pipeline()
+            pipe.smembers(tag_key)
+            pipe.delete(tag_key)
+            pipe.set(KEY_PREFIX + "invalidated:" + tag, repr(now), ex=REPLICA_PIN_SECONDS + 1)
+            keys = pipe.execute()[0]
+            if keys:
+                self.client.delete(*(KEY_PREFIX + key.decode() for key in keys))
+
+    def invalidated_after(self, tags: Iterable[str], since: float) -> bool:
+        """Whether any of `tags` was invalidated after `since` (a time.time())"""
+        tags = list(tags)
+        if not tags:
+            return False
+        times = self.client.mget([KEY_PREFIX + "invalidated:" + tag for tag in tags])
+        return any(at is not None and float(at) > since for at in times)
+
+
+def _make_backend():
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryBackend(RESPONSE_CACHE_MAX_ENTRIES)
+    if RESPONSE_CACHE_BACKEND == "redis":
+        return RedisBackend(REDIS_URL)
+    if RESPONSE_CACHE_BACKEND != "off":
+        logger.warning(f"Unknown RESPONSE_CACHE_BACKEND {RESPONSE_CACHE_BACKEND!r}; response cache disabled")
+    return None
+
+
+backend = _make_backend()
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "errors": 0}
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats() -> Dict[str, Any]:
+    """Cache hits, misses, stores, invalidations and backend errors of this worker"""
+    with _stats_lock:
+        return {"backend": RESPONSE_CACHE_BACKEND if backend is not None else "off", **_stats}
+
+
+def invalidate(*tags: str):
+    """Drop every cached response stored under any of `tags`; call after the write commits"""
+    if backend is None:
+        return
+    try:
+        backend.invalidate(tags)
+        _count("invalidations")
+    except Exception as e:
+        _count("errors")
+        logger.error(f"Response cache invalidation of {tags} failed: {e}")
+
+
+def cached(ttl: int, tags: Iterable[str] = (), per_user: bool = False):
+    """Cache the route's responses for `ttl` seconds under `tags` (see the module docstring)"""
+    global _max_ttl
+    _max_ttl = max(_max_ttl, ttl)
+
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.response_cache = {"ttl": ttl, "tags": tuple(tags), "per_user": per_user}
+        return endpoint
+    return decorator
+
+
+def requires_auth(dependant) -> bool:
+    """Whether a route depends on get_current_user, directly or through another dependency"""
+    return any(
+        dependency.call is auth.get_current_user or requires_auth(dependency)
+        for dependency in dependant.dependencies
+    )
+
+
+def token_subject(request: Request) -> Optional[str]:
+    """Email of a valid, non-blacklisted bearer token, or None"""
+    authorization = request.headers.get("authorization", "")
+    if not authorization.startswith("Bearer "):
+        return None
+    token = authorization[len("Bearer "):]
+    if auth.is_token_blacklisted(token):
+        return None
+    try:
+        return jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+
+class CachedRoute(APIRoute):
+    """APIRoute that serves GET requests of `cached` endpoints from the response cache"""
+
+    def get_route_handler(self) -> Callable:
+        # Called from APIRoute.__init__, once the dependencies are resolved
+        handler = super().get_route_handler()
+        config = getattr(self.endpoint, "response_cache", None)
+        if config is None:
+            return handler
+        route_path = self.path_format
+        needs_subject = config["per_user"] or requires_auth(self.dependant)
+
+        async def cached_handler(request: Request) -> Response:
+            if request.method != "GET" or backend is None or is_pinned_to_primary(request):
+                # Pinned clients wrote recently and must read their own writes
+                return await handler(request)
+            subject = token_subject(request) if needs_subject else None
+            if needs_subject and subject is None:
+                # Let the route's own authentication answer
+                return await handler(request)
+
+            key_parts = [route_path, str(sorted(request.path_params.items())), str(sorted(request.query_params.multi_items()))]
+            if config["per_user"]:
+                key_parts.append(subject)
+            key = hashlib.sha1("|".join(key_parts).encode("utf-8")).hexdigest()
+
+            entry = await _call(backend.get, key)
+            if entry is not None:
+                _count("hits")
+                media_type, body = entry
+                return Response(content=body, media_type=media_type, headers={"X-Cache": "HIT"})
+
+            _count("misses")
+            started = time.time()
+            response = await handler(request)
+            body = getattr(response, "body", None)
+            tags = [tag.format(**request.path_params) for tag in config["tags"]]
+            if response.status_code == 200 and body is not None and not await _call(
+                backend.invalidated_after, tags, started - REPLICA_PIN_SECONDS, default=True
+            ):
+                media_type = response.media_type or response.headers.get("content-type", "application/json")
+                if await _call(backend.set, key, (media_type, body), config["ttl"], tags, default=False) is not False:
+                    _count("stores")
+            response.headers["X-Cache"] = "MISS"
+            return response
+
+        return cached_handler
+
+
+async def _call(method: Callable, *args, default=None):
+    """Run a backend call, off the event loop for Redis; errors count as a miss"""
+    try:
+        if isinstance(backend, RedisBackend):
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+    except Exception as e:
+        _count("errors")
+        logger.warning(f"Response cache {method.__name__} failed: {e}")
+        return default
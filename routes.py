@@ -1,22 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from typing import Optional, List
 from jose import JWTError, jwt
 
+import async_crud
 import crud
 import schemas
 import auth
-from database import get_db
+import slow_queries
+from database import get_db, get_read_db, get_async_db, pool_metrics
 from auth import (
-    authenticate_user,
+    authenticate_user_async,
     create_access_token,
     get_current_user,
     blacklist_token,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from utils import get_current_user_id
+from sql_instrumentation import route_metrics
+from response_cache import CachedRoute, cached
+import response_cache
+import single_flight
 
 # Main router
 router = APIRouter()
@@ -34,6 +41,47 @@ def health_check():
         "version": "1.0.0"
     }
 
+@router.get("/metrics/db-pool")
+def db_pool_metrics():
+    """
+    Database connection pool usage of the worker that serves the request:
+    pool size, connections checked out and in overflow, saturation, and how
+    long checkouts waited for a connection.
+    """
+    return pool_metrics()
+
+@router.get("/metrics/sql")
+def sql_metrics():
+    """
+    SQL statements and database time per route for the worker that serves
+    the request, with the number of requests that repeated a statement
+    often enough to look like an N+1.
+    """
+    return route_metrics()
+
+@router.get("/metrics/response-cache")
+def response_cache_metrics():
+    """Response cache hits, misses, stores and invalidations of the worker that serves the request"""
+    return response_cache.stats()
+
+@router.get("/metrics/single-flight")
+def single_flight_metrics():
+    """Requests computed and coalesced per route by the worker that serves the request"""
+    return single_flight.stats()
+
+@router.get("/metrics/slow-queries")
+def slow_query_report(limit: int = 50, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    """
+    Admin only. Statements that ran over SLOW_QUERY_MS, slowest in total
+    first, with their EXPLAIN plans and the indexes that would avoid the
+    full scans and sorts in them.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    # Include what this worker caught since its last flush
+    slow_queries.flush()
+    return slow_queries.build_report(db, limit=limit)
+
 # Authentication router
 auth_router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -47,11 +95,11 @@ async def cors_check():
     return {"status": "ok", "cors": "enabled", "message": "CORS is properly configured"}
 
 @auth_router.post("/token", response_model=schemas.Token)
-async def login_for_access_token(request: Request, db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(request: Request, db: AsyncSession = Depends(get_async_db), form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         # Try to find user by email to get user_id for failed login record
-        potential_user = crud.get_user_by_email(db, email=form_data.username)
+        potential_user = await async_crud.get_user_identity_by_email(db, email=form_data.username)
         if potential_user:
             # Record failed login
             login_history = schemas.UserLoginHistoryCreate(
@@ -63,7 +111,7 @@ async def login_for_access_token(request: Request, db: Session = Depends(get_db)
                 ip_address=request.client.host if request.client else None,
                 login_status="failed"
             )
-            crud.create_login_history(db, login_history)
+            await async_crud.create_login_history(db, login_history)
             
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -81,7 +129,7 @@ async def login_for_access_token(request: Request, db: Session = Depends(get_db)
         ip_address=request.client.host if request.client else None,
         login_status="success"
     )
-    crud.create_login_history(db, login_history)
+    await async_crud.create_login_history(db, login_history)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -90,7 +138,7 @@ async def login_for_access_token(request: Request, db: Session = Depends(get_db)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @auth_router.post("/login", response_model=schemas.Token)
-async def login(login_data: schemas.UserLogin, request: Request, db: Session = Depends(get_db)):
+async def login(login_data: schemas.UserLogin, request: Request, db: AsyncSession = Depends(get_async_db)):
     # Log the received login data for debugging
     print(f"Login attempt received - email: {login_data.email}, phone: {login_data.phone}, aadhar: {login_data.aadhar}")
     
@@ -103,7 +151,7 @@ async def login(login_data: schemas.UserLogin, request: Request, db: Session = D
         )
 
     # Authenticate user by identifier without password
-    user = auth.authenticate_user_by_identifier(
+    user = await auth.authenticate_user_by_identifier_async(
         db,
         email=login_data.email,
         phone=login_data.phone,
@@ -114,7 +162,7 @@ async def login(login_data: schemas.UserLogin, request: Request, db: Session = D
         # Record failed login attempt if email was provided
         if login_data.email:
             # Try to find user by email to get user_id
-            potential_user = crud.get_user_by_email(db, email=login_data.email)
+            potential_user = await async_crud.get_user_identity_by_email(db, email=login_data.email)
             if potential_user:
                 # Record failed login
                 login_history = schemas.UserLoginHistoryCreate(
@@ -126,7 +174,7 @@ async def login(login_data: schemas.UserLogin, request: Request, db: Session = D
                     ip_address=request.client.host if request.client else None,
                     login_status="failed"
                 )
-                crud.create_login_history(db, login_history)
+                await async_crud.create_login_history(db, login_history)
         
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -144,7 +192,7 @@ async def login(login_data: schemas.UserLogin, request: Request, db: Session = D
         ip_address=request.client.host if request.client else None,
         login_status="success"
     )
-    crud.create_login_history(db, login_history)
+    await async_crud.create_login_history(db, login_history)
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -153,11 +201,11 @@ async def login(login_data: schemas.UserLogin, request: Request, db: Session = D
     return {"access_token": access_token, "token_type": "bearer", "user_id": user.user_id}
 
 @auth_router.get("/me", response_model=schemas.User)
-async def read_users_me(current_user = Depends(get_current_user)):
-    return current_user
+async def read_users_me(current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await async_crud.get_user_profile(db, current_user.user_id)
 
 @auth_router.get("/validate-token")
-async def validate_token(request: Request, db: Session = Depends(get_db)):
+async def validate_token(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Validate a token without requiring authentication.
     This endpoint checks if a token is valid and not blacklisted.
@@ -189,7 +237,7 @@ async def validate_token(request: Request, db: Session = Depends(get_db)):
             return {"valid": False, "message": "Invalid token payload"}
         
         # Check if the user exists
-        user = crud.get_user_by_email(db, email=email)
+        user = await async_crud.get_user_identity_by_email(db, email=email)
         if user is None:
             return {"valid": False, "message": "User not found"}
         
@@ -200,7 +248,7 @@ async def validate_token(request: Request, db: Session = Depends(get_db)):
         return {"valid": False, "message": f"Error validating token: {str(e)}"}
 
 @auth_router.post("/refresh-token", response_model=schemas.Token)
-async def refresh_token(request: Request, db: Session = Depends(get_db)):
+async def refresh_token(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Refresh an access token.
     This endpoint creates a new token with a new expiration time.
@@ -252,7 +300,7 @@ async def refresh_token(request: Request, db: Session = Depends(get_db)):
             )
         
         # Check if the user exists
-        user = crud.get_user_by_email(db, email=email)
+        user = await async_crud.get_user_identity_by_email(db, email=email)
         if user is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -312,7 +360,7 @@ async def logout(request: Request):
 users_router = APIRouter(prefix="/users", tags=["Users"])
 
 @users_router.get("/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     users = crud.get_users(db, skip=skip, limit=limit)
     return users
 
@@ -327,8 +375,8 @@ def create_user(user: schemas.UserCreate, request: Request, db: Session = Depend
     return crud.create_user(db=db, user=user)
 
 @users_router.get("/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
+    db_user = crud.get_user_profile(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -354,17 +402,17 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
 login_history_router = APIRouter(prefix="/login-history", tags=["Login History"])
 
 @login_history_router.get("/", response_model=List[schemas.UserLoginHistory])
-def read_all_login_history(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_all_login_history(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Get all login history entries"""
     return crud.get_all_login_history(db, skip=skip, limit=limit)
 
 @login_history_router.get("/user/{user_id}", response_model=List[schemas.UserLoginHistory])
-def read_user_login_history(user_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_user_login_history(user_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Get login history for a specific user"""
     return crud.get_user_login_history(db, user_id=user_id, skip=skip, limit=limit)
 
 @login_history_router.get("/{user_login_id}", response_model=schemas.UserLoginHistory)
-def read_login_history(user_login_id: int, db: Session = Depends(get_db)):
+def read_login_history(user_login_id: int, db: Session = Depends(get_read_db)):
     """Get a login history entry by ID"""
     login_history = crud.get_login_history(db, user_login_id=user_login_id)
     if login_history is None:
@@ -372,10 +420,11 @@ def read_login_history(user_login_id: int, db: Session = Depends(get_db)):
     return login_history
 
 # Roles router
-roles_router = APIRouter(prefix="/roles", tags=["Roles"])
+roles_router = APIRouter(prefix="/roles", tags=["Roles"], route_class=CachedRoute)
 
 @roles_router.get("/", response_model=List[schemas.Role])
-def read_roles(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@cached(ttl=300, tags=("roles",))
+def read_roles(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Get all roles"""
     roles = crud.get_roles(db, skip=skip, limit=limit)
     return roles
@@ -386,7 +435,7 @@ def create_role(role: schemas.RoleCreate, db: Session = Depends(get_db)):
     return crud.create_role(db=db, role=role)
 
 @roles_router.get("/{role_id}", response_model=schemas.Role)
-def read_role(role_id: int, db: Session = Depends(get_db)):
+def read_role(role_id: int, db: Session = Depends(get_read_db)):
     """Get a role by ID"""
     db_role = crud.get_role(db, role_id=role_id)
     if db_role is None:
@@ -405,9 +454,10 @@ def delete_role(role_id: int, db: Session = Depends(get_db)):
 
 
 # Chits users router
-chits_router = APIRouter(prefix="/chits", tags=["Chits"])
+chits_router = APIRouter(prefix="/chits", tags=["Chits"], route_class=CachedRoute)
 
 @chits_router.get("/", response_model=List[schemas.ChitUsers])
-def chits_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user_id: Optional[int] = Depends(get_current_user_id)):
+@cached(ttl=60, tags=("chits",), per_user=True)
+def chits_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db), current_user_id: Optional[int] = Depends(get_current_user_id)):
     chit_users = crud.get_chits_users(db, skip=skip, limit=limit, current_user_id=current_user_id)
     return chit_users
@@ -0,0 +1,11 @@
+from database import engine
+from models import create_tables
+import dynamic_table_rewrites
+
+if __name__ == "__main__":
+    print("Running queued dynamic table rewrites...")
+    # Make sure the rewrite job table exists before reading it
+    create_tables(engine)
+    # Picks up jobs that were never started and running jobs whose worker stopped
+    count = dynamic_table_rewrites.run_pending_rewrites()
+    print(f"Dynamic table rewrites finished: {count} job(s) run.")
@@ -0,0 +1,74 @@
+"""
+Optional schema features, detected once per process.
+
+Older databases may not have the audit columns that migrations add
+(created_by and updated_by on users and chit_users). The models map them as
+deferred columns, so they are never read, and an INSERT or UPDATE only
+names them when they are set. Instead of trying a write and retrying
+without them when it fails, the columns that exist are read from the
+database at startup, after the migrations ran, and the CRUD layer sets them
+only where they exist, so they go out in the row's own statement.
+
+A worker that skipped the migrations because another process held the
+migration lock may detect before the columns are added; a column found
+missing is looked for again at most every REDETECT_SECONDS.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from sqlalchemy import inspect
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+# table -> optional columns looked for in it
+OPTIONAL_COLUMNS = {
+    "users": ("created_by", "updated_by"),
+    "chit_users": ("created_by", "updated_by"),
+}
+
+REDETECT_SECONDS = 60
+
+_columns: Optional[Dict[str, Set[str]]] = None
+_detected_at = 0.0
+_lock = threading.Lock()
+
+
+def detect(bind=None) -> Dict[str, Set[str]]:
+    """Read which optional columns exist and cache the result for the process"""
+    global _columns, _detected_at
+    inspector = inspect(bind or engine)
+    found = {}
+    for table, columns in OPTIONAL_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table)} if inspector.has_table(table) else set()
+        found[table] = {column for column in columns if column in existing}
+    with _lock:
+        _columns = found
+        _detected_at = time.monotonic()
+    logger.info(f"Schema capabilities: {({table: sorted(columns) for table, columns in found.items()})}")
+    return found
+
+
+def has_column(table: str, column: str) -> bool:
+    """Whether an optional column exists; detects on first use if startup didn't"""
+    columns = _columns if _columns is not None else detect()
+    if column not in columns.get(table, ()) and time.monotonic() - _detected_at > REDETECT_SECONDS:
+        # The migrations may have added it since
+        columns = detect()
+    return column in columns.get(table, ())
+
+
+def set_audit_columns(row, current_user_id: Optional[int], is_new: bool):
+    """
+    Set created_by (new rows) and updated_by on an ORM row before it is
+    flushed, for the audit columns its table has. Nothing is set when there
+    is no user or no such column.
+    """
+    if current_user_id is None:
+        return
+    for column in ("created_by", "updated_by") if is_new else ("updated_by",):
+        if has_column(row.__tablename__, column):
+            setattr(row, column, current_user_id)
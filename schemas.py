@@ -165,11 +165,33 @@ class TableDefinition(TableDefinitionBase):
     created_at: datetime
     updated_at: datetime
     created_by: Optional[int] = None
+    physical_table: Optional[str] = None
     columns: List[ColumnDefinition] = []
 
     class Config:
         from_attributes = True
 
+class DynamicTableColumnStats(BaseModel):
+    """Statistics of one column; distinct estimate and min/max can drift until a rebuild."""
+    column_id: int
+    name: str
+    non_null_count: int
+    null_count: int
+    distinct_estimate: int
+    min_value: Optional[Any] = None
+    max_value: Optional[Any] = None
+
+class DynamicTableStats(BaseModel):
+    """Cached row count and column statistics of a dynamic table."""
+    row_count: int
+    modifications: int
+    rebuilt_at: Optional[datetime] = None
+    columns: List[DynamicTableColumnStats] = []
+
+class TableDefinitionDetail(TableDefinition):
+    """Table definition with its statistics, when they have been built."""
+    stats: Optional[DynamicTableStats] = None
+
 class DynamicTableDataCreate(BaseModel):
     """Model for creating new data entries in dynamic tables."""
     data: Dict[str, Any]
@@ -179,6 +201,7 @@ class DynamicTableData(BaseModel):
     id: int
     table_id: int
     data: Dict[str, Any]
+    version: int = 1
     created_at: datetime
     updated_at: datetime
     created_by: Optional[int] = None
@@ -186,6 +209,70 @@ class DynamicTableData(BaseModel):
     class Config:
         from_attributes = True
 
+class DynamicTableStorageResult(BaseModel):
+    """Outcome of moving a table's rows between JSON and physical storage."""
+    table_id: int
+    physical_table: Optional[str] = None
+    rows_moved: int
+    rows_renumbered: int = 0
+
+class DynamicTableRewriteJob(BaseModel):
+    """Background rewrite of stored rows after a column was dropped or renamed."""
+    id: int
+    table_id: int
+    operation: str
+    field: str
+    new_field: Optional[str] = None
+    status: str
+    rows_total: int
+    rows_scanned: int
+    rows_rewritten: int
+    progress: float
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class DynamicTableRowError(BaseModel):
+    """Validation errors for one row of a bulk upload."""
+    row: int
+    errors: Dict[str, str]
+
+class DynamicTableBulkResult(BaseModel):
+    """Summary of a bulk upload into a dynamic table."""
+    inserted: int
+    failed: int
+    errors: List[DynamicTableRowError] = []
+    errors_truncated: bool = False
+
+class DynamicTableMetricOp(str, Enum):
+    """Aggregate functions supported over dynamic table columns."""
+    COUNT = "count"
+    SUM = "sum"
+    AVG = "avg"
+    MIN = "min"
+    MAX = "max"
+
+class DynamicTableMetric(BaseModel):
+    """One aggregate to compute; field may be omitted for a row count."""
+    op: DynamicTableMetricOp
+    field: Optional[str] = None
+    alias: Optional[str] = None
+
+class DynamicTableAggregateQuery(BaseModel):
+    """Group-by aggregation request over a dynamic table."""
+    group_by: List[str] = []
+    metrics: List[DynamicTableMetric]
+    filter: Optional[Dict[str, Any]] = None
+    limit: int = Field(1000, ge=1, le=10000)
+
+class DynamicTableAggregateResult(BaseModel):
+    """Aggregated rows: group-by values plus one entry per metric alias."""
+    rows: List[Dict[str, Any]]
+
 class DynamicTableQueryParams(BaseModel):
     """Query parameters for filtering and pagination of dynamic table data."""
     filter: Optional[Dict[str, Any]] = None
@@ -0,0 +1,230 @@
+"""
+Single-flight coalescing of identical concurrent reads.
+
+A GET route opts in with the `coalesced` decorator, placed under the router
+decorator, on a router created with `route_class=CoalescedRoute`:
+
+    @payments_router.get("/transaction-history/", ...)
+    @coalesced()
+    def get_transaction_history(...):
+
+Requests with the same route, path and query parameters and authorization
+scope that arrive while one of them is being computed wait for it and get a
+copy of its response instead of running the same query again. The scope is
+"public" for routes without authentication, "authenticated" for routes that
+depend on get_current_user but return the same data to every user (waiting
+requests still need a valid, non-blacklisted token), and the token's
+subject with `per_user=True`.
+
+SINGLE_FLIGHT picks how far requests are coalesced:
+
+- "worker" (default): within each worker process.
+- "redis": also across workers through REDIS_URL. The first worker to claim
+  a request computes it and publishes the response for a few seconds;
+  the others poll for it for up to SINGLE_FLIGHT_WAIT_SECONDS and compute it
+  themselves if it doesn't come (or Redis fails).
+- "off": no coalescing.
+
+Only 200 responses are shared across workers; within a worker, errors raised
+by the route are re-raised for every waiting request.
+
+CoalescedRoute extends the response cache's CachedRoute, so a router can use
+both; a coalesced request that misses the cache is computed once.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from dbconfig import REDIS_URL, SINGLE_FLIGHT, SINGLE_FLIGHT_WAIT_SECONDS
+from response_cache import CachedRoute, requires_auth, token_subject
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "single_flight:"
+# How long a published response stays readable by the workers polling for it
+RESULT_SECONDS = 5
+POLL_SECONDS = 0.05
+
+# (status code, headers, body)
+Shared = Tuple[int, list, bytes]
+
+# key -> future of the in-flight computation in this worker
+_in_flight: Dict[str, asyncio.Future] = {}
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _count(route: str, name: str):
+    with _stats_lock:
+        counts = _stats.setdefault(route, {"computed": 0, "coalesced": 0, "coalesced_across_workers": 0})
+        counts[name] += 1
+
+
+def stats() -> Dict[str, Any]:
+    """Per route: requests computed, and requests that shared another's response in this worker or from another"""
+    with _stats_lock:
+        return {"mode": SINGLE_FLIGHT, "routes": {route: dict(counts) for route, counts in _stats.items()}}
+
+
+def coalesced(per_user: bool = False):
+    """Coalesce identical concurrent requests to the route (see the module docstring)"""
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.single_flight = {"per_user": per_user}
+        return endpoint
+    return decorator
+
+
+def _share(response: Response) -> Optional[Shared]:
+    body = getattr(response, "body", None)
+    if body is None:
+        return None
+    headers = [(name, value) for name, value in response.raw_headers if name != b"content-length"]
+    return response.status_code, headers, body
+
+
+def _rebuild(shared: Shared) -> Response:
+    status_code, headers, body = shared
+    response = Response(content=body, status_code=status_code)
+    response.raw_headers.extend(headers)
+    return response
+
+
+class _RedisFlights:
+    """Claims and published responses in Redis, shared by every worker"""
+
+    def __init__(self, url: str):
+        import redis
+        # Short timeouts: an unreachable Redis should cost a local computation, not a hung request
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+    def claim(self, key: str) -> bool:
+        # Expires on its own if the claiming worker dies before publishing
+        return bool(self.client.set(KEY_PREFIX + "claim:" + key, 1, nx=True, ex=int(SINGLE_FLIGHT_WAIT_SECONDS) + 1))
+
+    def publish(self, key: str, shared: Optional[Shared]):
+        pipe = self.client.pipeline()
+        if shared is not None and shared[0] == 200:
+            _, headers, body = shared
+            content_type = dict(headers).get(b"content-type", b"application/json")
+            pipe.set(KEY_PREFIX + "result:" + key, content_type + b"\n" + body, ex=RESULT_SECONDS)
+        pipe.delete(KEY_PREFIX + "claim:" + key)
+        pipe.execute()
+
+    def poll(self, key: str) -> Tuple[Optional[Shared], bool]:
+        """(published response or None, whether the claim is still held)"""
+        pipe = self.client.pipeline()
+        pipe.get(KEY_PREFIX + "result:" + key)
+        pipe.exists(KEY_PREFIX + "claim:" + key)
+        result, claimed = pipe.execute()
+        if result is None:
+            return None, bool(claimed)
+        content_type, _, body = result.partition(b"\n")
+        return (200, [(b"content-type", content_type)], body), bool(claimed)
+
+
+_redis: Optional[_RedisFlights] = None
+if SINGLE_FLIGHT == "redis":
+    _redis = _RedisFlights(REDIS_URL)
+elif SINGLE_FLIGHT not in ("worker", "off"):
+    logger.warning(f"Unknown SINGLE_FLIGHT {SINGLE_FLIGHT!r}; coalescing within each worker")
+
+
+async def _redis_call(method: Callable, *args, default=None):
+    try:
+        return await run_in_threadpool(method, *args)
+    except Exception as e:
+        logger.warning(f"Single-flight {method.__name__} failed: {e}")
+        return default
+
+
+async def _compute_across_workers(key: str, route: str, compute: Callable) -> Response:
+    """Compute the response, or wait for the worker that claimed it to publish it"""
+    if await _redis_call(_redis.claim, key, default=True):
+        response = None
+        try:
+            response = await compute()
+        finally:
+            # Release the claim even if the route failed, so the others stop waiting
+            await _redis_call(_redis.publish, key, _share(response) if response is not None else None)
+        return response
+
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(POLL_SECONDS)
+        shared, claimed = await _redis_call(_redis.poll, key, default=(None, False))
+        if shared is not None:
+            _count(route, "coalesced_across_workers")
+            return _rebuild(shared)
+        if not claimed:
+            # The other worker finished without a response to share, or gave up
+            break
+    return await compute()
+
+
+class CoalescedRoute(CachedRoute):
+    """CachedRoute that also coalesces identical concurrent GET requests of `coalesced` endpoints"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        config = getattr(self.endpoint, "single_flight", None)
+        if config is None or SINGLE_FLIGHT == "off":
+            return handler
+        route_name = f"GET {self.path_format}"
+        authenticated = requires_auth(self.dependant)
+
+        async def compute(request: Request) -> Response:
+            _count(route_name, "computed")
+            return await handler(request)
+
+        async def coalescing_handler(request: Request) -> Response:
+            if request.method != "GET":
+                return await handler(request)
+            if config["per_user"] or authenticated:
+                subject = token_subject(request)
+                if subject is None:
+                    # Let the route's own authentication answer
+                    return await handler(request)
+                scope = subject if config["per_user"] else "authenticated"
+            else:
+                scope = "public"
+            key = hashlib.sha1("|".join([
+                route_name, str(sorted(request.path_params.items())), str(sorted(request.query_params.multi_items())), scope
+            ]).encode("utf-8")).hexdigest()
+
+            flight = _in_flight.get(key)
+            if flight is not None:
+                shared = await asyncio.shield(flight)
+                if shared is not None:
+                    _count(route_name, "coalesced")
+                    if isinstance(shared, BaseException):
+                        raise shared
+                    return _rebuild(shared)
+                # Nothing to share (streamed or cancelled): compute it here
+                return await compute(request)
+
+            flight = asyncio.get_running_loop().create_future()
+            _in_flight[key] = flight
+            try:
+                if _redis is not None:
+                    response = await _compute_across_workers(key, route_name, lambda: compute(request))
+                else:
+                    response = await compute(request)
+                flight.set_result(_share(response))
+                return response
+            except Exception as e:
+                flight.set_result(e)
+                raise
+            finally:
+                if not flight.done():
+                    flight.set_result(None)
+                _in_flight.pop(key, None)
+
+        return coalescing_handler
@@ -0,0 +1,345 @@
+"""
+Slow-query capture and index advisor.
+
+The SQL instrumentation hooks hand every statement that runs longer than
+SLOW_QUERY_MS to `capture`. Statements are normalized (whitespace collapsed,
+placeholder lists folded, literals replaced by ?) and fingerprinted; only the
+normalized text and the parameter types are kept. The first time a
+fingerprint is seen it is EXPLAINed with the parameters it ran with, which
+are then dropped. Captures are buffered per worker and written to the
+`slow_queries` table after the request that caught them.
+
+`build_report` reads that table back, works out from each plan which tables
+were scanned in full or sorted without an index, and suggests an index on
+the columns the statement filters and sorts those tables by, unless an
+existing index already starts with them. `slow_query_report.py` prints the
+report; `/metrics/slow-queries` serves it to admins.
+"""
+import hashlib
+import logging
+import re
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from dbconfig import SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+# Captures kept in memory between flushes; further slow statements are only logged
+MAX_PENDING = 500
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_PLACEHOLDER_LIST = re.compile(rf"\((?:\s*{_PLACEHOLDER}\s*,)+\s*{_PLACEHOLDER}\s*\)")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.$`])-?\d+(?:\.\d+)?\b")
+_NAMED_PLACEHOLDER = re.compile(r"%\(\w+\)s|(?<!:):\w+")
+
+_EXPLAINABLE = ("select", "update", "delete", "with")
+
+_pending: Dict[str, Dict[str, Any]] = {}
+_pending_lock = threading.Lock()
+
+# Set while flushing, so the flush's own statements (EXPLAIN included) are not captured
+_flushing: ContextVar[bool] = ContextVar("slow_query_flushing", default=False)
+
+
+def normalize(statement: str) -> str:
+    """Statement with literals and placeholders replaced by ? and placeholder lists folded to one"""
+    normalized = _WHITESPACE.sub(" ", statement).strip()
+    normalized = _STRING_LITERAL.sub("?", normalized)
+    normalized = _NAMED_PLACEHOLDER.sub("?", normalized).replace("%s", "?")
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    return _PLACEHOLDER_LIST.sub("(?)", normalized)
+
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def redact(parameters: Any) -> Any:
+    """Parameters with every value replaced by its type name"""
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None:
+        return None
+    return f"<{type(parameters).__name__}>"
+
+
+def capture(statement: str, parameters: Any, executemany: bool, elapsed: float):
+    """Buffer a statement that ran over the threshold; called from the engine hooks"""
+    if _flushing.get() or models.SlowQuery.__tablename__ in statement:
+        return
+    normalized = normalize(statement)
+    key = fingerprint(normalized)
+    elapsed_ms = elapsed * 1000
+    if executemany and isinstance(parameters, (list, tuple)):
+        parameters = parameters[0] if parameters else None
+
+    with _pending_lock:
+        entry = _pending.get(key)
+        if entry is None:
+            if len(_pending) >= MAX_PENDING:
+                logger.warning(f"Slow query buffer full, not captured ({elapsed_ms:.0f} ms): {normalized[:300]}")
+                return
+            entry = _pending[key] = {
+                "statement": normalized,
+                # The original text and parameters are only kept until EXPLAIN has run
+                "raw_statement": statement,
+                "raw_parameters": parameters,
+                "sample_parameters": redact(parameters),
+                "calls": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "last_seen": datetime.now(),
+            }
+        entry["calls"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["last_seen"] = datetime.now()
+
+
+def has_pending() -> bool:
+    return bool(_pending)
+
+
+def _explain(db: Session, statement: str, parameters: Any) -> Optional[List[Dict[str, Any]]]:
+    """Plan of a statement as a list of rows, or None if it can't be explained"""
+    if not statement.lstrip().lower().startswith(_EXPLAINABLE):
+        return None
+    prefix = "EXPLAIN QUERY PLAN" if db.get_bind().dialect.name == "sqlite" else "EXPLAIN"
+    try:
+        # A savepoint keeps a failed EXPLAIN from aborting the flush
+        with db.begin_nested():
+            result = db.connection().exec_driver_sql(f"{prefix} {statement}", parameters if parameters is not None else ())
+            return [
+                {key: value if isinstance(value, (int, float, str)) or value is None else str(value)
+                 for key, value in row._mapping.items()}
+                for row in result
+            ]
+    except Exception as e:
+        logger.info(f"Could not EXPLAIN slow query: {e}")
+        return None
+
+
+def _save(db: Session, key: str, entry: Dict[str, Any]):
+    record = db.query(models.SlowQuery).filter(models.SlowQuery.fingerprint == key).first()
+    if record is None:
+        record = models.SlowQuery(
+            fingerprint=key,
+            statement=entry["statement"],
+            calls=0,
+            total_ms=0,
+            max_ms=0,
+        )
+        db.add(record)
+    record.calls += entry["calls"]
+    record.total_ms += entry["total_ms"]
+    record.max_ms = max(record.max_ms, entry["max_ms"])
+    record.sample_parameters = entry["sample_parameters"]
+    record.last_seen = entry["last_seen"]
+    if record.plan is None and record.explained_at is None:
+        record.plan = _explain(db, entry["raw_statement"], entry["raw_parameters"])
+        record.explained_at = datetime.now()
+    db.commit()
+
+
+def flush():
+    """Write buffered captures to the slow_queries table, EXPLAINing new statements"""
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+
+    token = _flushing.set(True)
+    db = SessionLocal()
+    try:
+        for key, entry in pending.items():
+            try:
+                _save(db, key, entry)
+            except IntegrityError:
+                # Another worker recorded the same statement first
+                db.rollback()
+                _save(db, key, entry)
+    except Exception:
+        db.rollback()
+        logger.exception("Could not save slow queries")
+    finally:
+        db.close()
+        _flushing.reset(token)
+
+
+def _table_aliases(statement: str) -> Dict[str, str]:
+    """Alias (or name) -> table for the tables a statement reads or writes"""
+    aliases = {}
+    keywords = {"where", "on", "left", "right", "inner", "outer", "cross", "join", "order", "group",
+                "limit", "set", "using", "for", "having", "union", "values", "natural"}
+    pattern = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?", re.IGNORECASE)
+    for match in pattern.finditer(statement):
+        table, alias = match.group(1), match.group(2)
+        if table.lower() in keywords:
+            continue
+        aliases[table] = table
+        if alias and alias.lower() not in keywords:
+            aliases[alias] = table
+    return aliases
+
+
+def _clause(statement: str, start: str, ends: Sequence[str]) -> str:
+    match = re.search(rf"\b{start}\b(.*?)(?:\b(?:{'|'.join(ends)})\b|$)", statement, re.IGNORECASE | re.DOTALL)
+    return match.group(1) if match else ""
+
+
+def _columns_by_table(statement: str, aliases: Dict[str, str]) -> Dict[str, Dict[str, List[str]]]:
+    """Columns each table is filtered by (equality, then range) and sorted by"""
+    columns: Dict[str, Dict[str, List[str]]] = {}
+    single_table = next(iter(set(aliases.values()))) if len(set(aliases.values())) == 1 else None
+
+    def add(kind: str, qualifier: Optional[str], column: str):
+        table = aliases.get(qualifier) if qualifier else single_table
+        if table is None:
+            return
+        entry = columns.setdefault(table, {"equality": [], "range": [], "order": []})
+        if column not in entry[kind]:
+            entry[kind].append(column)
+
+    where = _clause(statement, "WHERE", ["GROUP BY", "ORDER BY", "LIMIT", "FOR UPDATE", "HAVING"])
+    predicate = re.compile(
+        r"(?:`?(\w+)`?\.)?`?(\w+)`?\s*(=|IN\b|<=|>=|<|>|BETWEEN\b|LIKE\b)\s*(\?|\()",
+        re.IGNORECASE
+    )
+    for qualifier, column, operator, _ in predicate.findall(where):
+        add("equality" if operator.upper() in ("=", "IN") else "range", qualifier, column)
+
+    order_by = _clause(statement, "ORDER BY", ["LIMIT", "FOR UPDATE", "OFFSET"])
+    for qualifier, column in re.findall(r"(?:`?(\w+)`?\.)?`?(\w+)`?(?:\s+(?:ASC|DESC))?\s*(?:,|$)", order_by.strip(), re.IGNORECASE):
+        add("order", qualifier, column)
+    return columns
+
+
+def _plan_problems(plan: List[Dict[str, Any]], aliases: Dict[str, str]) -> Dict[str, List[str]]:
+    """Table -> what the plan does without an index (full scan, sort)"""
+    problems: Dict[str, List[str]] = {}
+    for row in plan:
+        if "detail" in row:
+            # SQLite: "SCAN pay", "SEARCH pay USING INDEX ...", "USE TEMP B-TREE FOR ORDER BY"
+            detail = str(row["detail"])
+            match = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+            if match and "COVERING INDEX" not in detail:
+                problems.setdefault(aliases.get(match.group(1), match.group(1)), []).append("full scan")
+            elif "TEMP B-TREE FOR ORDER BY" in detail and len(set(aliases.values())) == 1:
+                problems.setdefault(next(iter(set(aliases.values()))), []).append("sort")
+            continue
+        # MySQL: one row per table with the access type and the key used
+        table = aliases.get(str(row.get("table")), row.get("table"))
+        if table is None:
+            continue
+        if row.get("type") in ("ALL", "index"):
+            problems.setdefault(table, []).append("full scan")
+        if "filesort" in str(row.get("Extra") or ""):
+            problems.setdefault(table, []).append("sort")
+    return problems
+
+
+def _existing_indexes(inspector, table: str) -> List[List[str]]:
+    indexes = []
+    try:
+        primary_key = inspector.get_pk_constraint(table).get("constrained_columns")
+        if primary_key:
+            indexes.append(primary_key)
+        indexes.extend(index["column_names"] for index in inspector.get_indexes(table))
+        indexes.extend(unique["column_names"] for unique in inspector.get_unique_constraints(table))
+    except Exception:
+        return []
+    return [[name for name in columns if name] for columns in indexes]
+
+
+def _suggest(columns: Dict[str, List[str]], problems: List[str], existing: List[List[str]]) -> Optional[List[str]]:
+    """Columns of an index for one table, or None if it has no usable columns or one already exists"""
+    suggestion = list(columns["equality"])
+    if "sort" in problems and columns["order"]:
+        suggestion.extend(c for c in columns["order"] if c not in suggestion)
+    elif columns["range"]:
+        suggestion.append(columns["range"][0])
+    if not suggestion:
+        return None
+    suggestion = suggestion[:4]
+
+    leading = set(columns["equality"]) or {suggestion[0]}
+    for index in existing:
+        if set(index[:len(leading)]) == leading and index[:len(suggestion)] == suggestion[:len(index)]:
+            return None
+    return suggestion
+
+
+def build_report(db: Session, limit: int = 50) -> Dict[str, Any]:
+    """
+    Slowest captured statements by total time, with their plans and the
+    indexes suggested for them, and the suggested indexes ranked by the
+    time spent in the statements they would help.
+    """
+    inspector = inspect(db.get_bind())
+    existing_cache: Dict[str, List[List[str]]] = {}
+    suggested: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+
+    statements = []
+    records = db.query(models.SlowQuery).order_by(models.SlowQuery.total_ms.desc()).limit(limit).all()
+    for record in records:
+        aliases = _table_aliases(record.statement)
+        problems = _plan_problems(record.plan or [], aliases)
+        columns = _columns_by_table(record.statement, aliases)
+
+        suggestions = []
+        for table, table_problems in problems.items():
+            if table not in columns:
+                continue
+            if table not in existing_cache:
+                existing_cache[table] = _existing_indexes(inspector, table)
+            index_columns = _suggest(columns[table], table_problems, existing_cache[table])
+            if index_columns is None:
+                continue
+            suggestions.append({"table": table, "columns": index_columns, "reason": ", ".join(table_problems)})
+            index = suggested.setdefault((table, tuple(index_columns)), {
+                "table": table,
+                "columns": index_columns,
+                "statements": 0,
+                "total_ms": 0.0,
+            })
+            index["statements"] += 1
+            index["total_ms"] += record.total_ms
+
+        statements.append({
+            "fingerprint": record.fingerprint,
+            "statement": record.statement,
+            "sample_parameters": record.sample_parameters,
+            "calls": record.calls,
+            "total_ms": round(record.total_ms, 3),
+            "avg_ms": round(record.total_ms / record.calls, 3) if record.calls else 0.0,
+            "max_ms": round(record.max_ms, 3),
+            "first_seen": record.first_seen,
+            "last_seen": record.last_seen,
+            "plan": record.plan,
+            "problems": problems,
+            "suggested_indexes": suggestions,
+        })
+
+    indexes = sorted(suggested.values(), key=lambda index: index["total_ms"], reverse=True)
+    for index in indexes:
+        index["total_ms"] = round(index["total_ms"], 3)
+        index["ddl"] = f"CREATE INDEX ix_{index['table']}_{'_'.join(index['columns'])} ON {index['table']} ({', '.join(index['columns'])})"
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "suggested_indexes": indexes,
+        "statements": statements,
+    }
@@ -0,0 +1,35 @@
+import argparse
+
+from database import SessionLocal, engine
+from models import create_tables
+import slow_queries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the slow query report and suggested indexes")
+    parser.add_argument("--limit", type=int, default=50, help="number of statements to include")
+    args = parser.parse_args()
+
+    # Make sure the slow query table exists before reading it
+    create_tables(engine)
+    db = SessionLocal()
+    try:
+        report = slow_queries.build_report(db, limit=args.limit)
+    finally:
+        db.close()
+
+    print(f"Slow query report (statements over {report['threshold_ms']:g} ms)")
+    print()
+    print("Suggested indexes:")
+    if not report["suggested_indexes"]:
+        print("  none")
+    for index in report["suggested_indexes"]:
+        print(f"  {index['ddl']};")
+        print(f"      helps {index['statements']} statement(s), {index['total_ms']:.0f} ms in total")
+    print()
+    print("Slowest statements:")
+    for entry in report["statements"]:
+        print(f"  {entry['total_ms']:.0f} ms total, {entry['calls']} call(s), avg {entry['avg_ms']:.1f} ms, max {entry['max_ms']:.1f} ms")
+        print(f"    {entry['statement'][:500]}")
+        for table, problems in entry["problems"].items():
+            print(f"    {table}: {', '.join(problems)}")
+        print()
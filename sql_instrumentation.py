@@ -0,0 +1,186 @@
+"""
+Per-request SQL instrumentation.
+
+Engine event hooks count every statement and time it against the request
+being served (tracked in a context variable, which follows the request into
+the threadpool and into the async engine). The middleware then:
+
+- adds a Server-Timing header with the request's database time and
+  statement count,
+- folds the request into per-route totals served at /metrics/sql,
+- logs a warning when one statement shape ran more than
+  SQL_REPEAT_WARN_THRESHOLD times in the request, the usual sign of an N+1.
+
+Statements slower than SLOW_QUERY_MS are also handed to `slow_queries`,
+which the middleware flushes once the request is done.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import engine, async_engine, replica_engines
+from dbconfig import SQL_REPEAT_WARN_THRESHOLD, SLOW_QUERY_MS
+import slow_queries
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+# IN lists and multi-row VALUES differ only in how many placeholders they have
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)")
+
+
+def statement_shape(statement: str) -> str:
+    """Statement text with whitespace collapsed and placeholder lists folded to one"""
+    return _PLACEHOLDER_LIST.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class RequestSqlStats:
+    """Statements run while serving one request"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.db_time = 0.0
+        self.shapes: Counter = Counter()
+
+    def record(self, statement: str, elapsed: float):
+        shape = statement_shape(statement)
+        with self.lock:
+            self.statements += 1
+            self.db_time += elapsed
+            self.shapes[shape] += 1
+
+
+_current_stats: ContextVar[Optional[RequestSqlStats]] = ContextVar("sql_request_stats", default=None)
+
+# route -> totals over every request this worker served on it
+_route_metrics: Dict[str, Dict[str, Any]] = {}
+_route_metrics_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.capture(statement, parameters, executemany, elapsed)
+
+
+def _handle_error(exception_context):
+    # Keep the start-time stack balanced when a statement fails
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+def instrument_engine(target: Engine):
+    if event.contains(target, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(target, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target, "after_cursor_execute", _after_cursor_execute)
+    event.listen(target, "handle_error", _handle_error)
+
+
+for _engine in (engine, async_engine.sync_engine, *replica_engines):
+    instrument_engine(_engine)
+
+
+def _route_name(scope: Scope) -> str:
+    # The router leaves the matched route in the scope. Unmatched requests
+    # share one bucket so that scanned or random URLs can't grow the metrics
+    path = getattr(scope.get("route"), "path", None) or "<unmatched>"
+    return f"{scope['method']} {path}"
+
+
+def _record_route(route: str, stats: RequestSqlStats, repeated: int):
+    with _route_metrics_lock:
+        metrics = _route_metrics.setdefault(route, {
+            "requests": 0,
+            "statements": 0,
+            "max_statements": 0,
+            "db_time_ms": 0.0,
+            "max_db_time_ms": 0.0,
+            "repeated_statement_requests": 0,
+        })
+        db_time_ms = stats.db_time * 1000
+        metrics["requests"] += 1
+        metrics["statements"] += stats.statements
+        metrics["max_statements"] = max(metrics["max_statements"], stats.statements)
+        metrics["db_time_ms"] += db_time_ms
+        metrics["max_db_time_ms"] = max(metrics["max_db_time_ms"], db_time_ms)
+        if repeated:
+            metrics["repeated_statement_requests"] += 1
+
+
+def route_metrics() -> Dict[str, Dict[str, Any]]:
+    """Per-route statement counts and database time for this worker, busiest routes first"""
+    with _route_metrics_lock:
+        snapshot = {route: dict(metrics) for route, metrics in _route_metrics.items()}
+    for metrics in snapshot.values():
+        metrics["avg_statements"] = round(metrics["statements"] / metrics["requests"], 2)
+        metrics["avg_db_time_ms"] = round(metrics["db_time_ms"] / metrics["requests"], 3)
+        metrics["db_time_ms"] = round(metrics["db_time_ms"], 3)
+        metrics["max_db_time_ms"] = round(metrics["max_db_time_ms"], 3)
+    return dict(sorted(snapshot.items(), key=lambda item: item[1]["db_time_ms"], reverse=True))
+
+
+class SqlInstrumentationMiddleware:
+    """
+    Measure the SQL a request runs and report it in a Server-Timing header.
+    Pure ASGI, so the request's statements run in this middleware's context
+    and the header is added to the response start message as it goes out.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestSqlStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                # Statements a streaming response runs after this point still
+                # count toward the route totals, just not the header
+                total_ms = (time.perf_counter() - started) * 1000
+                MutableHeaders(scope=message).append(
+                    "Server-Timing",
+                    f'db;dur={stats.db_time * 1000:.2f};desc="{stats.statements} statements", total;dur={total_ms:.2f}'
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_stats.reset(token)
+
+        route = _route_name(scope)
+        repeated = 0
+        for shape, count in stats.shapes.items():
+            if count > SQL_REPEAT_WARN_THRESHOLD:
+                repeated += 1
+                logger.warning(f"{route} ran the same statement {count} times (possible N+1): {shape[:300]}")
+        _record_route(route, stats, repeated)
+
+        if slow_queries.has_pending():
+            await run_in_threadpool(slow_queries.flush)
@@ -17,6 +17,8 @@ def main():
     
     # Calculate optimal worker count
     workers = (multiprocessing.cpu_count() * 2) + 1
+    # Workers size their database pools from this (see DB_CONNECTION_BUDGET)
+    os.environ["WEB_CONCURRENCY"] = str(workers)
     
     print("🚀 Starting MyChitFund API Production Server")
     print(f"👥 Workers: {workers}")
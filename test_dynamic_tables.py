@@ -250,6 +250,103 @@ def update_customer(token, table_id, row_id):
     else:
         print(f"Failed to update customer: {response.status_code}")
         print(response.json())
+        return
+    
+    # Updating from a stale read is rejected instead of overwriting
+    response = requests.put(
+        f"{BASE_URL}/tables/{table_id}/data/{row_id}",
+        headers=headers,
+        params={"expected_version": 1},
+        json={"data": {"age": 40}}
+    )
+    print(f"Stale update returned {response.status_code} (expected 409)")
+
+def bulk_add_test_data(token, table_id):
+    """Stream several customers in one NDJSON request"""
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/x-ndjson"
+    }
+    
+    lines = []
+    for i in range(4, 104):
+        lines.append(json.dumps({
+            "customer_id": f"CUST{i:03d}",
+            "name": f"Bulk Customer {i}",
+            "email": f"bulk{i}@example.com",
+            "age": 20 + i % 50,
+            "is_active": i % 2 == 0,
+            "registration_date": "2023-03-01"
+        }))
+    # This one repeats an existing customer_id and should be reported, not inserted
+    lines.append(json.dumps({
+        "customer_id": "CUST001",
+        "name": "Duplicate",
+        "email": "duplicate@example.com",
+        "is_active": True,
+        "registration_date": "2023-03-01"
+    }))
+    
+    response = requests.post(
+        f"{BASE_URL}/tables/{table_id}/data/bulk",
+        headers=headers,
+        data="\n".join(lines)
+    )
+    
+    if response.status_code == 200:
+        print("\nBulk upload result:")
+        pprint(response.json())
+    else:
+        print(f"Failed to bulk upload customers: {response.status_code}")
+        print(response.json())
+
+def aggregate_table_data(token, table_id):
+    """Count customers and average their age, grouped by active flag"""
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+    
+    aggregate = {
+        "group_by": ["is_active"],
+        "metrics": [
+            {"op": "count"},
+            {"op": "avg", "field": "age"},
+            {"op": "max", "field": "registration_date", "alias": "latest_registration"}
+        ],
+        "filter": {"age": {"gte": 18}}
+    }
+    
+    response = requests.post(
+        f"{BASE_URL}/tables/{table_id}/aggregate",
+        headers=headers,
+        json=aggregate
+    )
+    
+    if response.status_code == 200:
+        print("\nCustomers by active flag:")
+        pprint(response.json())
+    else:
+        print(f"Failed to aggregate customers: {response.status_code}")
+        print(response.json())
+
+def move_table_storage(token, table_id, action):
+    """Materialize the table into its own SQL table, or move it back to JSON storage"""
+    headers = {
+        "Authorization": f"Bearer {token}"
+    }
+    
+    response = requests.post(
+        f"{BASE_URL}/tables/{table_id}/{action}",
+        headers=headers
+    )
+    
+    if response.status_code == 200:
+        print(f"\n{action.capitalize()} result:")
+        pprint(response.json())
+    else:
+        print(f"Failed to {action} table: {response.status_code}")
+        print(response.json())
 
 def main():
     # Get authentication token
@@ -270,15 +367,27 @@ def main():
     if not customers:
         return
     
+    # Bulk upload more customers
+    bulk_add_test_data(token, table_id)
+    
     # Query table data
     query_table_data(token, table_id)
     
+    # Aggregate on the server
+    aggregate_table_data(token, table_id)
+    
     # Update a customer
     if customers:
         update_customer(token, table_id, customers[0]["id"])
     
     # Query again to see the update
     query_table_data(token, table_id)
+    
+    # Rows read the same from a materialized table
+    move_table_storage(token, table_id, "materialize")
+    query_table_data(token, table_id)
+    aggregate_table_data(token, table_id)
+    move_table_storage(token, table_id, "dematerialize")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file